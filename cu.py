@@ -1,50 +1,42 @@
-import json
+from telebot.storage import open_inventory
 
-CODES_FILE = "codes.json"
-
-def load_codes():
-    try:
-        with open(CODES_FILE, "r") as file:
-            return json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {"codes": []}
-
-def save_codes(data):
-    with open(CODES_FILE, "w") as file:
-        json.dump(data, file, indent=4)
-
-def jload(amount):
-    data = load_codes()
+def jload(inventory, amount):
     print(f"Upload codes for {amount} UC:")
-    
+
     codes_input = []
     while True:
         code = input("Enter code (or type 'done' to finish): ")
         if code.lower() == 'done':
             break
-        codes_input.append({"code": code, "redeemed": False})
-    
+        codes_input.append(code)
+
     if not codes_input:
         print("No codes provided.")
         return
-    
-    for entry in data["codes"]:
-        if entry["amount"] == amount:
-            entry["codes"].extend(codes_input)
-            break
-    else:
-        data["codes"].append({"amount": amount, "codes": codes_input, "price": float(amount)})
-    
-    save_codes(data)
-    print(f"Added {len(codes_input)} codes for amount: {amount}")
+
+    # New amounts start priced at their UC amount
+    if amount not in dict(inventory.price_list()):
+        inventory.set_price(amount, float(amount))
+
+    added, duplicates = inventory.add_codes(amount, codes_input)
+    print(f"Added {len(added)} codes for amount: {amount}")
+    if duplicates:
+        print(f"Skipped {len(duplicates)} duplicate codes: {', '.join(duplicates)}")
 
 if __name__ == "__main__":
-    while True:
-        command = input("Enter command: ")
-        parts = command.split()
-        if len(parts) == 2 and parts[0].lower() == "jload" and parts[1].isdigit():
-            jload(int(parts[1]))
-        elif command.lower() == "exit":
-            break
-        else:
-            print("Invalid command. Use 'Jload <amount>' or 'exit' to quit.")
+    # Uses STORAGE_BACKEND like the bot; the JSON inventory can only be open in one
+    # process, so stop the bot first unless it runs on sqlite
+    inventory = open_inventory().load()
+    try:
+        while True:
+            command = input("Enter command: ")
+            parts = command.split()
+            if len(parts) == 2 and parts[0].lower() == "jload" and parts[1].isdigit():
+                jload(inventory, int(parts[1]))
+            elif command.lower() == "exit":
+                break
+            else:
+                print("Invalid command. Use 'Jload <amount>' or 'exit' to quit.")
+    finally:
+        inventory.flush()
+        inventory.close()
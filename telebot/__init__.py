@@ -0,0 +1,7 @@
+""" Telegram bot that sells UC codes from a local inventory.
+
+Run it with python -m telebot, or build it with create_app(config).
+"""
+from .app import App, Config, create_app
+
+__all__ = ["App", "Config", "create_app"]
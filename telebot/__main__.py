@@ -0,0 +1,8 @@
+import logging
+
+from . import create_app
+
+# Logging setup
+logging.basicConfig(level=logging.INFO)
+
+create_app().run()
@@ -0,0 +1,104 @@
+HOUR = 3600
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+# Report granularities accepted by Jsales
+UNITS = {"hour": HOUR, "day": DAY, "week": WEEK}
+
+# Weeks start on Monday; the epoch was a Thursday
+WEEK_OFFSET = 4 * DAY
+
+
+def bucket_start(at, unit):
+    """ Start of the hour, day or week (UTC) containing the timestamp at """
+    offset = WEEK_OFFSET if unit == WEEK else 0
+    return (at - offset) // unit * unit + offset
+
+
+def window_start(now, unit, count):
+    """ Start of the last count buckets of unit, the current one included """
+    return bucket_start(now, unit) - (count - 1) * unit
+
+
+class SalesRollup:
+    """ Codes sold and revenue per hour and amount.
+
+    Every dispense adds to its hour's bucket, so a report sums a few hundred
+    buckets per month of data instead of scanning the used codes. Day and week
+    figures are folded from the hourly buckets at query time.
+    """
+
+    def __init__(self):
+        self.buckets = {}  # hour start -> {amount: [count, revenue]}, oldest first
+
+    @classmethod
+    def from_json(cls, rows):
+        rollup = cls()
+        for hour, amount, count, revenue in rows:
+            rollup.buckets.setdefault(hour, {})[amount] = [count, revenue]
+        rollup.buckets = dict(sorted(rollup.buckets.items()))
+        return rollup
+
+    def to_json(self):
+        return [[hour, amount, count, revenue] for hour, amounts in self.buckets.items()
+                for amount, (count, revenue) in amounts.items()]
+
+    def add(self, at, amount, count, revenue):
+        hour = bucket_start(at, HOUR)
+        bucket = self.buckets.get(hour)
+        if bucket is None:
+            in_order = not self.buckets or hour > next(reversed(self.buckets))
+            bucket = self.buckets[hour] = {}
+            if not in_order:
+                self.buckets = dict(sorted(self.buckets.items()))  # Clock went back
+        totals = bucket.setdefault(amount, [0, 0])
+        totals[0] += count
+        totals[1] += revenue
+
+    def _since(self, since):
+        """ Hourly buckets from since on, newest first """
+        for hour in reversed(self.buckets):
+            if hour < since:
+                return
+            yield hour, self.buckets[hour]
+
+    def series(self, since, unit):
+        """ (bucket start, amount, codes sold, revenue) per unit and amount from since on, oldest first """
+        series = {}
+        for hour, amounts in self._since(since):
+            start = bucket_start(hour, unit)
+            for amount, (count, revenue) in amounts.items():
+                totals = series.setdefault((start, amount), [0, 0])
+                totals[0] += count
+                totals[1] += revenue
+        return [(start, amount, count, revenue) for (start, amount), (count, revenue) in sorted(series.items())]
+
+    def totals(self, since):
+        """ {amount: (codes sold, revenue)} from since on """
+        totals = {}
+        for _, amounts in self._since(since):
+            for amount, (count, revenue) in amounts.items():
+                amount_totals = totals.setdefault(amount, [0, 0])
+                amount_totals[0] += count
+                amount_totals[1] += revenue
+        return {amount: tuple(amount_totals) for amount, amount_totals in totals.items()}
+
+
+def stock_outlook(totals, stock_summary, seconds):
+    """ (amount, sold, revenue, available, sell-through, days of stock left) per amount.
+
+    totals are the sales over the last seconds. Sell-through is the share of
+    the window's supply (sold + still available) that sold; days left assumes
+    the window's average daily rate continues, and is None without sales.
+    """
+    days = seconds / DAY
+    rows = []
+    available_by_amount = {amount: available for amount, _, available in stock_summary}
+    for amount in sorted(set(available_by_amount) | set(totals)):
+        sold, revenue = totals.get(amount, (0, 0))
+        available = available_by_amount.get(amount, 0)
+        supply = sold + available
+        sell_through = sold / supply if supply else 0
+        days_left = available / (sold / days) if sold else None
+        rows.append((amount, sold, revenue, available, sell_through, days_left))
+    return rows
@@ -0,0 +1,148 @@
+import logging
+import os
+
+from . import handlers
+from . import metrics
+from .forecast import LOW_STOCK_HOURS
+from .io_executor import IOExecutor
+from .storage import open_inventory
+from .validation import StubValidator
+
+
+def parse_ids(text):
+    """ Telegram IDs from a comma separated list """
+    return [int(item) for item in (text or "").split(",") if item.strip()]
+
+
+def make_validator(name):
+    """ The validator named by VALIDATOR: none (the default) or stub """
+    name = (name or "none").lower()
+    if name == "none":
+        return None
+    if name == "stub":
+        return StubValidator()
+    raise ValueError(f"Unknown validator: {name}. Use 'none' or 'stub'.")
+
+
+class Config:
+    """ Bot settings. from_env() reads them from the environment and .env.
+
+    admin_ids may see every account and clear dues; when empty nobody is an
+    admin. Low-stock alerts go to alert_chat_ids (ALERT_CHAT_ID, comma
+    separated like ADMIN_IDS), the admins by default; with neither set they
+    are only logged, and setup() warns about it.
+    metrics_port 0 turns the metrics endpoint off. validator, a
+    validation.Validator, checks uploaded codes before they go on sale.
+    """
+
+    def __init__(self, api_id=None, api_hash=None, session="my_account", admin_ids=(), alert_chat_ids=(),
+                 low_stock_hours=LOW_STOCK_HOURS, metrics_host=metrics.METRICS_HOST,
+                 metrics_port=metrics.METRICS_PORT, storage_backend=None, sqlite_file=None, validator=None):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.session = session
+        self.admin_ids = set(admin_ids)
+        self.alert_chat_ids = list(alert_chat_ids)
+        self.low_stock_hours = low_stock_hours
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.storage_backend = storage_backend
+        self.sqlite_file = sqlite_file
+        self.validator = validator
+
+    @classmethod
+    def from_env(cls):
+        from dotenv import load_dotenv
+
+        # Load environment variables
+        load_dotenv()
+        # API credentials come from an app created on my.telegram.org
+        return cls(api_id=os.getenv("TELEGRAM_API_ID"),
+                   api_hash=os.getenv("TELEGRAM_API_HASH"),
+                   session=os.getenv("TELEGRAM_SESSION") or "my_account",
+                   admin_ids=parse_ids(os.getenv("ADMIN_IDS")),
+                   alert_chat_ids=parse_ids(os.getenv("ALERT_CHAT_ID")),
+                   low_stock_hours=float(os.getenv("LOW_STOCK_HOURS") or LOW_STOCK_HOURS),
+                   metrics_host=os.getenv("METRICS_HOST") or metrics.METRICS_HOST,
+                   metrics_port=int(os.getenv("METRICS_PORT") or metrics.METRICS_PORT),
+                   storage_backend=os.getenv("STORAGE_BACKEND"),
+                   sqlite_file=os.getenv("SQLITE_FILE"),
+                   validator=make_validator(os.getenv("VALIDATOR")))
+
+
+class App:
+    """ The bot, as built by create_app().
+
+    Nothing happens on construction: the TelegramClient is created on first
+    use of client, and setup() loads the inventory and registers the command
+    handlers. run() does both, then connects and blocks until disconnected.
+    The handlers keep module state, so a process runs one App at a time.
+    """
+
+    def __init__(self, config, client=None):
+        self.config = config
+        self._client = client
+        self.executor = None
+        self.inventory = None
+        self.metrics_server = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from telethon import TelegramClient
+
+            if not self.config.api_id or not self.config.api_hash:
+                raise ValueError("Your API ID or Hash cannot be empty or None. Please check your .env file.")
+            self._client = TelegramClient(self.config.session, self.config.api_id, self.config.api_hash)
+        return self._client
+
+    def setup(self):
+        """ Load the inventory and register the handlers on the client """
+        if self.inventory is not None:
+            return self
+        config = self.config
+        self.executor = IOExecutor()
+        self.inventory = open_inventory(config.storage_backend, self.executor, config.sqlite_file).load()
+        handlers.setup(self.client, self.inventory, self.executor, admin_ids=config.admin_ids,
+                       alert_chat_ids=config.alert_chat_ids, low_stock_hours=config.low_stock_hours,
+                       validator=config.validator)
+        return self
+
+    def run(self):
+        """ Start the bot and serve until Jstop or a disconnect """
+        self.setup()
+        client = self.client
+        if self.config.metrics_port:
+            try:
+                self.metrics_server = client.loop.run_until_complete(
+                    metrics.start_server(self.config.metrics_host, self.config.metrics_port))
+            except OSError as e:
+                logging.error(f"Could not serve metrics on {self.config.metrics_host}:{self.config.metrics_port}: {e}")
+        print("Bot is running...")
+        client.start()
+        client.loop.run_until_complete(handlers.resume())
+        try:
+            client.run_until_disconnected()
+        finally:
+            self.close()
+
+    def close(self):
+        """ Make the inventory durable, stop the I/O thread and release the inventory """
+        if self.inventory is not None:
+            self.inventory.flush()
+            self.executor.shutdown()
+            self.inventory.close()
+            self.inventory = None
+
+
+def create_app(config=None, client=None):
+    """ Build the bot without connecting or loading anything.
+
+    config is a Config, a dict of Config arguments, or None to read the
+    environment. client replaces the TelegramClient, e.g. with a stub.
+    """
+    if config is None:
+        config = Config.from_env()
+    elif isinstance(config, dict):
+        config = Config(**config)
+    return App(config, client)
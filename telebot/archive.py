@@ -0,0 +1,198 @@
+import gzip
+import json
+import logging
+import os
+import re
+import time
+
+from .columns import CodeIndex
+from .metrics import STORAGE_BYTES, STORAGE_SECONDS
+from .snapshot import INDEX, index_sections, open_snapshot, save_snapshot
+
+ARCHIVE_DIR = 'archive'
+INDEX_FILE = 'index.jsonl'
+CODE_INDEX_FILE = 'code-index.bin'
+
+SEGMENT_PATTERN = re.compile(r'^period-(\d+)\.json\.gz$')
+
+
+def make_segment(period, closed_at, dealer, groups, dues):
+    """ A closed settlement period.
+
+    groups is [{"amount", "price", "codes": [[code, dealer], ...]}], with a
+    group per price an amount sold at; dues maps each settled dealer to the
+    due they had at closing. dealer is None when everyone was settled.
+    """
+    return {"period": period, "closed_at": closed_at, "dealer": dealer, "groups": groups,
+            "dues": {str(dealer): due for dealer, due in dues.items()}}
+
+
+def summarize(segment):
+    """ Index entry for a segment: per dealer and amount counts instead of the codes """
+    lines = {}
+    for group in segment['groups']:
+        for _, dealer in group['codes']:
+            key = (dealer, group['amount'], group['price'])
+            lines[key] = lines.get(key, 0) + 1
+    return {"period": segment['period'], "closed_at": segment['closed_at'], "dealer": segment['dealer'],
+            "lines": [[dealer, amount, price, count] for (dealer, amount, price), count in sorted(lines.items())],
+            "dues": segment['dues']}
+
+
+class Archive:
+    """ Settlement periods closed by Jclear, kept out of the hot inventory files.
+
+    Each period is one gzip-compressed JSON segment that is written once and
+    never changed. index.jsonl gets one summary line per segment, so listing
+    past periods never opens the segments; a segment missing from the index
+    (a crash between the two writes) is re-indexed on load.
+
+    code-index.bin holds every archived code packed for the duplicate check,
+    so startup reads only the segments closed since it was last brought up
+    to date.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self.index_file = os.path.join(directory, INDEX_FILE)
+        self.code_index_file = os.path.join(directory, CODE_INDEX_FILE)
+        self.periods = {}  # period -> summary, in period order
+
+    def segment_name(self, period):
+        return os.path.join(self.directory, f"period-{period:05d}.json.gz")
+
+    def load(self):
+        self.periods = {}
+        torn = False
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'rb') as file:
+                for line in file:
+                    try:
+                        summary = json.loads(line)
+                    except json.JSONDecodeError:
+                        torn = True
+                        continue
+                    self.periods[summary['period']] = summary
+
+        names = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+        missing = sorted(int(match.group(1)) for match in map(SEGMENT_PATTERN.match, names)
+                         if match and int(match.group(1)) not in self.periods)
+        for period in missing:
+            logging.warning(f"Archive segment {period} is not indexed. Re-indexing it.")
+            self.periods[period] = summarize(self.read(period))
+        self.periods = dict(sorted(self.periods.items()))
+        if torn or missing:
+            self._rewrite_index()
+        return self
+
+    @property
+    def last_period(self):
+        return next(reversed(self.periods), 0)
+
+    # ✅ Writes
+    def add(self, segment):
+        """ Index a segment in memory; write() puts it on disk """
+        self.periods[segment['period']] = summarize(segment)
+
+    def write(self, segment):
+        """ Write a segment and append its index line, both fsynced """
+        start = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+        file_name = self.segment_name(segment['period'])
+        tmp_name = f"{file_name}.tmp"
+        with open(tmp_name, 'wb') as file:
+            with gzip.GzipFile(fileobj=file, mode='wb') as gz:
+                gz.write(json.dumps(segment, separators=(',', ':')).encode())
+            file.flush()
+            os.fsync(file.fileno())
+            STORAGE_BYTES.inc("archive_write", amount=file.tell())
+        os.replace(tmp_name, file_name)
+        STORAGE_SECONDS.since(start, "archive_write")
+
+        with open(self.index_file, 'a') as file:
+            file.write(json.dumps(summarize(segment), separators=(',', ':')) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+    def rollback(self, last_period):
+        """ Drop segments written for periods the inventory never committed """
+        orphans = [period for period in self.periods if period > last_period]
+        for period in orphans:
+            logging.warning(f"Archive segment {period} was never committed. Removing it.")
+            del self.periods[period]
+            if os.path.exists(self.segment_name(period)):
+                os.remove(self.segment_name(period))
+        if orphans:
+            self._rewrite_index()
+
+    def _rewrite_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_name = f"{self.index_file}.tmp"
+        with open(tmp_name, 'w') as file:
+            for summary in self.periods.values():
+                file.write(json.dumps(summary, separators=(',', ':')) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_name, self.index_file)
+
+    # ✅ Reads
+    def read(self, period):
+        with gzip.open(self.segment_name(period), 'rt') as file:
+            return json.load(file)
+
+    def codes(self):
+        """ (amount, code) for every archived code, oldest period first """
+        for period in self.periods:
+            for group in self.read(period)['groups']:
+                for code, _ in group['codes']:
+                    yield group['amount'], code
+
+    def code_index(self, committed):
+        """ CodeIndex of every archived code.
+
+        code-index.bin is brought up to committed, the last period known to
+        be committed; segments after it are read but not saved, as they may
+        yet be rolled back.
+        """
+        index, covered = CodeIndex(), 0
+        snapshot = open_snapshot(self.code_index_file)
+        if snapshot is not None:
+            if snapshot.kind == INDEX and snapshot.seq <= committed and len(snapshot.groups) == 1:
+                index, covered = snapshot.code_index(snapshot.groups[0]), snapshot.seq
+            else:
+                logging.warning(f"{self.code_index_file} doesn't match the archive. Rebuilding it.")
+            snapshot.close()
+
+        periods = [period for period in self.periods if covered < period <= committed]
+        for period in periods:
+            index.add(code for group in self.read(period)['groups'] for code, _ in group['codes'])
+        if periods:
+            save_snapshot({"kind": INDEX, "seq": periods[-1], "groups": [(0, None, index_sections(index))]},
+                          self.code_index_file)
+        for period in self.periods:
+            if period > max(covered, committed):
+                index.add(code for group in self.read(period)['groups'] for code, _ in group['codes'])
+        return index
+
+    def period_list(self, dealer=None):
+        """ (period, closed_at, codes, due) for every period, or the ones that settled dealer """
+        result = []
+        for period, summary in self.periods.items():
+            lines = [line for line in summary['lines'] if dealer is None or line[0] == dealer]
+            dues = [due for key, due in summary['dues'].items() if dealer is None or int(key) == dealer]
+            if dealer is None or lines or dues:
+                result.append((period, summary['closed_at'], sum(line[3] for line in lines), sum(dues)))
+        return result
+
+    def period_detail(self, period, dealer=None):
+        """ (closed_at, [(amount, price, count)], {dealer: due}) for one period, or None """
+        summary = self.periods.get(period)
+        if summary is None:
+            return None
+        counts = {}
+        for line_dealer, amount, price, count in summary['lines']:
+            if dealer is None or line_dealer == dealer:
+                key = (amount, price)
+                counts[key] = counts.get(key, 0) + count
+        dues = {int(key): due for key, due in summary['dues'].items() if dealer is None or int(key) == dealer}
+        return summary['closed_at'], [(amount, price, count) for (amount, price), count in sorted(counts.items())], dues
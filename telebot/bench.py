@@ -0,0 +1,412 @@
+""" Offline benchmark: drives handlers.handle_message with synthetic events through a stub client.
+
+    python -m telebot.bench --sizes 10 1000 100000 1000000 --ops 2000 --backend json
+
+Each size gets a fresh inventory in a temporary directory. Reports load time,
+then throughput and p50/p99 latency of Jbaki, Jup, Jstock, Jcheck and a mixed
+Jbaki/Jstock/Jcheck loop, and finishes with a concurrent dispense check that
+fails (exit status 1) if any code is handed out twice, a check that codes
+whose reply could not be sent go back to stock uncharged, a check that
+concurrent Jorder replies add up and take every code once, a check that a
+price change leaves codes already sold at their price, and a large upload
+through a validation pool with a stub validator.
+
+--processes N runs the check across N bot processes instead: with
+--backend sqlite they all dispense from one database at once, and with
+--backend json a second process must be refused the inventory files.
+"""
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+
+from . import handlers
+from .columns import CodeColumn
+from .inventory import FILE_NAME
+from .io_executor import IOExecutor
+from .outbox import Outbox
+from .snapshot import STOCK, save_snapshot, stock_sections
+from .storage import open_inventory
+from .validation import StubValidator
+
+AMOUNTS = (20, 36, 80, 160, 405, 810, 1625)
+ADMIN = 1
+CODE_IN_REPLY = re.compile(r'`([^`\n]+)`')
+ORDER_LINE_IN_REPLY = re.compile(r'✓ (\d+) 🆄︎🅲︎  x  (\d+)  ✓')
+ORDER_TOTAL_IN_REPLY = re.compile(r'Tᴏᴛᴀʟ : (\d+) 🆄︎🅲︎')
+
+
+class FakeClient:
+    """ Stands in for TelegramClient: records what the bot sends instead of sending it """
+
+    def __init__(self):
+        self.sent = []
+        self.failing = False  # Make every send raise, like a dropped connection
+
+    def add_event_handler(self, callback, event=None):
+        pass
+
+    async def send_message(self, chat_id, message):
+        self.sent.append((chat_id, message))
+
+    async def disconnect(self):
+        pass
+
+
+class FakeMessage:
+    __slots__ = ('message', 'document')
+
+    def __init__(self, text):
+        self.message = text
+        self.document = None
+
+
+class FakeEvent:
+    """ A NewMessage event carrying text; replies land in client.sent """
+
+    __slots__ = ('client', 'chat_id', 'sender_id', 'message')
+
+    def __init__(self, client, text, sender_id=ADMIN):
+        self.client = client
+        self.chat_id = sender_id
+        self.sender_id = sender_id
+        self.message = FakeMessage(text)
+
+    async def respond(self, message):
+        if self.client.failing:
+            raise ConnectionError("stub client is failing")
+        self.client.sent.append((self.chat_id, message))
+
+
+def make_code(serial):
+    pin = f"{serial % 10**16:016d}"
+    return f"BNCH-N-S-{serial % 10**8:08d} {pin[:4]}-{pin[4:8]}-{pin[8:12]}-{pin[12:]}"
+
+
+def write_inventory(size):
+    """ codes.bin with size codes spread over AMOUNTS, in the current directory """
+    groups = []
+    per_amount, extra = divmod(size, len(AMOUNTS))
+    serial = 0
+    for i, amount in enumerate(AMOUNTS):
+        count = per_amount + (1 if i < extra else 0)
+        column = CodeColumn()
+        for n in range(count):
+            column.append(make_code(serial + n))
+        serial += count
+        groups.append((amount, amount * 0.92, stock_sections(column)))
+    save_snapshot({"kind": STOCK, "seq": 0, "groups": groups}, FILE_NAME)
+    return serial
+
+
+def available(amount):
+    return {stock_amount: count for stock_amount, _, count in handlers.inventory.stock_summary()}.get(amount, 0)
+
+
+def due_of(dealer):
+    return {account: due for account, _, due in handlers.inventory.account_summary()}.get(dealer, 0)
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def report(name, samples, elapsed):
+    if not samples:
+        print(f"  {name:<8} skipped (out of stock)")
+        return
+    print(f"  {name:<8} {len(samples) / elapsed:>10.0f} ops/s   p50 {percentile(samples, 0.5) * 1000:8.3f} ms"
+          f"   p99 {percentile(samples, 0.99) * 1000:8.3f} ms   max {max(samples) * 1000:8.3f} ms")
+
+
+async def run(client, texts, sender_id=ADMIN):
+    """ Feed each text through handle_message, returning per-message latencies and the wall time """
+    samples = []
+    started = time.perf_counter()
+    for text in texts:
+        event = FakeEvent(client, text, sender_id)
+        start = time.perf_counter()
+        await handlers.handle_message(event)
+        samples.append(time.perf_counter() - start)
+    return samples, time.perf_counter() - started
+
+
+async def check_exactly_once(client, amount, workers, per_worker):
+    """ Many dealers take codes for one amount at once; every code must come out once """
+    await handlers.outbox.drain()
+    client.sent.clear()
+    before = available(amount)
+
+    async def worker(dealer):
+        for _ in range(per_worker):
+            await handlers.handle_message(FakeEvent(client, f"Jbaki {amount}", dealer))
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(worker(ADMIN + 1 + n) for n in range(workers)))
+    await handlers.outbox.drain()
+    codes = [code for _, message in client.sent for code in CODE_IN_REPLY.findall(message)]
+    left = available(amount)
+    unique = len(set(codes)) == len(codes)
+    consistent = len(codes) == before - left == min(before, workers * per_worker)
+    print(f"  exactly-once: {workers} dealers x {per_worker} Jbaki {amount} -> {len(codes)} codes, "
+          f"{'OK' if unique and consistent else 'FAILED'}"
+          f"{'' if unique else ' (duplicates)'}{'' if consistent else f' (stock {before} -> {left})'}")
+    return unique and consistent
+
+
+async def check_failed_delivery(client, amount, count):
+    """ Jbaki whose replies can't be sent must leave the stock and the dealer's due as they were """
+    dealer = ADMIN + 100
+    await handlers.outbox.drain()
+    await handlers.service.settle()
+    before = available(amount), due_of(dealer)
+    client.failing = True
+    try:
+        for _ in range(count):
+            await handlers.handle_message(FakeEvent(client, f"Jbaki {amount}", dealer))
+        await handlers.outbox.drain()
+        await handlers.service.settle()
+    finally:
+        client.failing = False
+    after = available(amount), due_of(dealer)
+    ok = before == after
+    print(f"  failed delivery: {count} Jbaki {amount} -> "
+          f"{'stock and due unchanged, OK' if ok else f'(stock, due) {before} -> {after}, FAILED'}")
+    return ok
+
+
+async def check_orders(client, target, workers, per_worker):
+    """ Dealers order a UC total and a multi-amount order at once; replies must add up and codes come out once """
+    await handlers.outbox.drain()
+    await handlers.service.settle()
+    client.sent.clear()
+    before = {amount: available(amount) for amount in AMOUNTS}
+    lines = f"{AMOUNTS[0]}x2 {AMOUNTS[1]}x1"
+
+    async def worker(dealer):
+        for _ in range(per_worker):
+            await handlers.handle_message(FakeEvent(client, f"Jorder {target}", dealer))
+            await handlers.handle_message(FakeEvent(client, f"Jorder {lines}", dealer))
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(ADMIN + 200 + n) for n in range(workers)))
+    await handlers.outbox.drain()
+    await handlers.service.settle()
+    elapsed = time.perf_counter() - start
+    # Replies to one chat may be merged into one message
+    codes, taken, totals = [], {}, []
+    for _, message in client.sent:
+        for amount, count in ORDER_LINE_IN_REPLY.findall(message):
+            taken[int(amount)] = taken.get(int(amount), 0) + int(count)
+        totals.extend(int(total) for total in ORDER_TOTAL_IN_REPLY.findall(message))
+        codes.extend(CODE_IN_REPLY.findall(message))
+    unique = len(set(codes)) == len(codes) == sum(taken.values())
+    consistent = all(before[amount] - available(amount) == taken.get(amount, 0) for amount in AMOUNTS)
+    complete = sum(totals) == sum(amount * count for amount, count in taken.items()) and \
+        set(totals) <= {target, 2 * AMOUNTS[0] + AMOUNTS[1]}
+    ok = unique and consistent and complete
+    print(f"  orders: {workers} dealers x {per_worker} Jorder {target} + Jorder {lines} -> {len(totals)} orders "
+          f"in {elapsed:.3f} s, {'OK' if ok else 'FAILED'}{'' if unique else ' (duplicates)'}"
+          f"{'' if consistent else ' (stock mismatch)'}{'' if complete else f' (totals {sorted(set(totals))})'}")
+    return ok
+
+
+async def check_price_change(client, amount, serial):
+    """ Codes sold before a Jprice keep their price: Jcheck's lines must add up to the dealer's due """
+    dealer = ADMIN + 300
+    # Its own three codes, so the check doesn't depend on the inventory size
+    await run(client, [f"Jup {amount} " + " ".join(make_code(serial + n) for n in range(3)), f"Jprice {amount} 1"])
+    await run(client, [f"Jbaki {amount}"], dealer)
+    await run(client, [f"Jprice {amount} 2"])
+    await run(client, [f"Jbaki {amount} 2"], dealer)
+    await handlers.outbox.drain()
+    await handlers.service.settle()
+    lines, due = handlers.inventory.check_summary(dealer)
+    ok = sorted((price, count) for _, price, count in lines) == [(1, 1), (2, 2)] and due == 5 == due_of(dealer)
+    print(f"  price change: Jcheck {lines} due {due}, {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+async def check_validation(inventory, executor, serial, count):
+    """ A large upload goes through the validation pool; every tenth code is bad and must be quarantined """
+    client = FakeClient()
+    invalid = {make_code(serial + n) for n in range(0, count, 10)}
+    validator = StubValidator(invalid, delay=0.005)
+    handlers.setup(client, inventory, executor, admin_ids={ADMIN},
+                   bot_outbox=Outbox(per_chat_interval=0, global_rate=10**9), validator=validator)
+    await handlers.resume()
+    amount = AMOUNTS[0]
+    before = available(amount)
+    start = time.perf_counter()
+    samples, _ = await run(client, [f"Jup {amount} " + " ".join(make_code(serial + n) for n in range(count))])
+    await handlers.service.validation.drain()
+    elapsed = time.perf_counter() - start
+    accepted = available(amount) - before
+    quarantined = sum(len(codes) for _, codes in inventory.quarantine_list(amount))
+    ok = accepted == count - len(invalid) and quarantined == len(invalid)
+    print(f"  validate {count} codes: Jup {samples[0] * 1000:.1f} ms, done in {elapsed:.3f} s "
+          f"over {validator.calls} calls, {accepted} in stock, {quarantined} quarantined, {'OK' if ok else 'FAILED'}")
+    await stop_handlers()
+    return ok
+
+
+async def stop_handlers():
+    await handlers.outbox.drain()
+    await handlers.service.flush()
+    handlers.service.close()
+    handlers.outbox.close()
+    handlers.forecaster.close()
+
+
+async def bench_size(size, ops, backend):
+    print(f"\n{size} codes ({backend})")
+    serial = write_inventory(size)
+
+    executor = IOExecutor()
+    try:
+        return await bench_inventory(executor, serial, ops, backend)
+    finally:
+        # Pending snapshot writes use relative paths; finish them before leaving the directory
+        executor.shutdown()
+
+
+async def bench_inventory(executor, serial, ops, backend):
+    start = time.perf_counter()
+    inventory = open_inventory(backend, executor=executor).load()
+    print(f"  load     {time.perf_counter() - start:10.3f} s")
+
+    client = FakeClient()
+    # No per-chat or global throttling: the stub delivers instantly
+    handlers.setup(client, inventory, executor, admin_ids={ADMIN},
+                   bot_outbox=Outbox(per_chat_interval=0, global_rate=10**9))
+    await handlers.resume()
+
+    amount = AMOUNTS[len(AMOUNTS) // 2]
+    baki_ops = min(ops, available(amount))
+    report("Jbaki", *await run(client, [f"Jbaki {amount}"] * baki_ops))
+
+    uploads = []
+    for n in range(ops):
+        batch = " ".join(make_code(serial + n * 10 + i) for i in range(10))
+        uploads.append(f"Jup {amount} {batch}")
+    report("Jup", *await run(client, uploads))
+
+    report("Jstock", *await run(client, ["Jstock"] * ops))
+    report("Jcheck", *await run(client, ["Jcheck all"] * ops))
+    mixed = [text for _ in range(ops // 3) for text in (f"Jbaki {amount}", "Jstock", "Jcheck")]
+    report("mixed", *await run(client, mixed))
+
+    ok = await check_exactly_once(client, AMOUNTS[-1], workers=20, per_worker=max(ops // 100, 5))
+    ok = await check_failed_delivery(client, AMOUNTS[-1], 5) and ok
+    ok = await check_orders(client, AMOUNTS[3] + AMOUNTS[2] + AMOUNTS[0], workers=10, per_worker=5) and ok
+    ok = await check_price_change(client, AMOUNTS[1], serial + ops * 20) and ok
+    await stop_handlers()
+
+    ok = await check_validation(inventory, executor, serial + ops * 10, ops * 10) and ok
+    inventory.close()
+    return ok
+
+
+def dispense_process(directory, backend, amount, dealer, count, start_at):
+    """ One bot process sending count Jbaki from dealer, returning the codes it was given """
+    os.chdir(directory)
+    logging.basicConfig(level=logging.ERROR)
+    return asyncio.run(dispense_from_process(backend, amount, dealer, count, start_at))
+
+
+async def dispense_from_process(backend, amount, dealer, count, start_at):
+    executor = IOExecutor()
+    try:
+        inventory = open_inventory(backend, executor=executor).load()
+    except RuntimeError as e:
+        executor.shutdown()
+        return str(e)
+    client = FakeClient()
+    handlers.setup(client, inventory, executor, admin_ids={ADMIN},
+                   bot_outbox=Outbox(per_chat_interval=0, global_rate=10**9))
+    await handlers.resume()
+    await asyncio.sleep(max(start_at - time.time(), 0))  # Start together with the other processes
+    for _ in range(count):
+        await handlers.handle_message(FakeEvent(client, f"Jbaki {amount}", dealer))
+    await stop_handlers()
+    executor.shutdown()
+    inventory.close()
+    return [code for _, message in client.sent for code in CODE_IN_REPLY.findall(message)]
+
+
+def check_processes(processes, per_process, backend):
+    """ Run dispensing bot processes against one inventory; no code may come out twice """
+    print(f"\n{processes} processes ({backend})")
+    amount = AMOUNTS[-1]
+    write_inventory(processes * per_process * len(AMOUNTS))
+    inventory = open_inventory(backend).load()  # Imports codes.bin into the database for sqlite
+    before = {stock_amount: count for stock_amount, _, count in inventory.stock_summary()}[amount]
+    if backend == "sqlite":
+        inventory.close()
+
+    start_at = time.time() + 2  # Time for every process to start and load
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(processes, mp_context=context) as pool:
+        results = list(pool.map(dispense_process, [os.getcwd()] * processes, [backend] * processes,
+                                [amount] * processes, range(ADMIN + 1, ADMIN + 1 + processes),
+                                [per_process] * processes, [start_at] * processes))
+
+    if backend == "json":
+        # The parent still holds the files; every child must have been turned away
+        refused = [result for result in results if isinstance(result, str)]
+        inventory.close()
+        ok = len(refused) == processes
+        print(f"  shared files: {len(refused)} of {processes} processes refused, {'OK' if ok else 'FAILED'}")
+        return ok
+
+    codes = [code for result in results for code in result]
+    inventory = open_inventory(backend).load()
+    left = {stock_amount: count for stock_amount, _, count in inventory.stock_summary()}[amount]
+    inventory.close()
+    unique = len(set(codes)) == len(codes)
+    consistent = len(codes) == before - left == min(before, processes * per_process)
+    print(f"  exactly-once: {processes} processes x {per_process} Jbaki {amount} -> {len(codes)} codes, "
+          f"{'OK' if unique and consistent else 'FAILED'}"
+          f"{'' if unique else ' (duplicates)'}{'' if consistent else f' (stock {before} -> {left})'}")
+    return unique and consistent
+
+
+async def main(args):
+    logging.basicConfig(level=logging.ERROR)  # Low-stock alerts would flood the report
+    ok = True
+    for size in args.sizes if not args.processes else ():
+        with tempfile.TemporaryDirectory(prefix="uc-bench-") as directory:
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                ok = await bench_size(size, args.ops, args.backend) and ok
+            finally:
+                os.chdir(cwd)
+    if args.processes:
+        with tempfile.TemporaryDirectory(prefix="uc-bench-") as directory:
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                ok = check_processes(args.processes, args.ops, args.backend) and ok
+            finally:
+                os.chdir(cwd)
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the bot's command handlers offline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000],
+                        help="inventory sizes in codes (default: 10 1000 100000)")
+    parser.add_argument("--ops", type=int, default=1000, help="commands per scenario (default: 1000)")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="instead of the benchmarks, check N processes dispensing --ops codes each")
+    sys.exit(0 if asyncio.run(main(parser.parse_args())) else 1)
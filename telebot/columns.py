@@ -0,0 +1,327 @@
+from array import array
+import base64
+from bisect import bisect_left
+from itertools import chain, islice, repeat
+import operator
+import re
+import sys
+
+# A normalised code, "UPBD-N-S-04811675 1679-5939-2679-5224" (see uploads.parse_codes):
+# a five letter prefix, an 8 digit serial and a 16 digit PIN
+PACKED_CODE = re.compile(r'([A-Za-z]{4}-[A-Za-z])-S-(\d{8}) (\d{4})-(\d{4})-(\d{4})-(\d{4})')
+
+# Prefix id of rows whose code doesn't fit the packed format and is kept as text
+RAW = 0xFFFF
+
+# Bits of a serial in CodeIndex.rest, below the prefix id
+SERIAL_BITS = 27  # 10**8 < 2**27
+SERIAL_MASK = (1 << SERIAL_BITS) - 1
+
+# Codes CodeIndex collects before merging them into its sorted arrays
+MERGE_CODES = 1024
+
+# Bits of CodeIndex.rest in its pin << 64 | rest keys
+REST_MASK = (1 << 64) - 1
+
+# Taken rows at the front of a column before they are cut off
+TRIM_AFTER = 4096
+
+
+def parse_code(code):
+    """ (prefix, serial, pin) of a code in the packed format, or None """
+    match = PACKED_CODE.fullmatch(code)
+    if match is None:
+        return None
+    prefix, serial, *pin = match.groups()
+    return prefix, int(serial), int("".join(pin))
+
+
+def _decode(typecode, text):
+    """ Array from base64 of its little-endian bytes """
+    column = array(typecode, base64.b64decode(text))
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+class CodeColumn:
+    """ Codes of one amount in upload order, packed into parallel arrays.
+
+    A code in the usual format is a prefix id, the serial and the PIN as
+    fixed-width integers - 14 bytes instead of a ~90 byte string plus the
+    containers pointing at it. Codes that don't fit are kept as text in raw.
+    taken is a bitmap of dispensed rows; rows before head are all taken,
+    so the oldest code in stock is found without scanning.
+    """
+
+    __slots__ = ('prefixes', 'prefix_ids', 'prefix', 'serial', 'pin', 'raw', 'taken', 'head', 'live')
+
+    def __init__(self):
+        self.prefixes = []  # prefix id -> prefix
+        self.prefix_ids = {}
+        self.prefix = array('H')
+        self.serial = array('I')
+        self.pin = array('Q')
+        self.raw = {}  # row -> code, for RAW rows
+        self.taken = bytearray()
+        self.head = 0
+        self.live = 0
+
+    def __len__(self):
+        return self.live
+
+    def _prefix_id(self, prefix):
+        prefix_id = self.prefix_ids.get(prefix)
+        if prefix_id is None:
+            prefix_id = self.prefix_ids[prefix] = len(self.prefixes)
+            self.prefixes.append(prefix)
+        return prefix_id
+
+    def append(self, code):
+        row = len(self.pin)
+        parsed = parse_code(code)
+        if parsed is not None and len(self.prefixes) < RAW:
+            prefix, serial, pin = parsed
+            self.prefix.append(self._prefix_id(prefix))
+            self.serial.append(serial)
+            self.pin.append(pin)
+        else:
+            self.prefix.append(RAW)
+            self.serial.append(0)
+            self.pin.append(0)
+            self.raw[row] = code
+        if row % 8 == 0:
+            self.taken.append(0)
+        self.live += 1
+
+    def code(self, row):
+        prefix_id = self.prefix[row]
+        if prefix_id == RAW:
+            return self.raw[row]
+        pin = f"{self.pin[row]:016d}"
+        return f"{self.prefixes[prefix_id]}-S-{self.serial[row]:08d} {pin[:4]}-{pin[4:8]}-{pin[8:12]}-{pin[12:]}"
+
+    def is_taken(self, row):
+        return bool(self.taken[row >> 3] >> (row & 7) & 1)
+
+    def rows(self):
+        """ Rows still in stock, oldest first """
+        taken = self.taken
+        for row in range(self.head, len(self.pin)):
+            if not taken[row >> 3] >> (row & 7) & 1:
+                yield row
+
+    def codes(self):
+        return map(self.code, self.rows())
+
+    def peek(self, count):
+        return [self.code(row) for row in islice(self.rows(), count)]
+
+    def row_of(self, code, taken=False):
+        """ Row of an untaken code (or with taken, of a taken one not yet trimmed), or None """
+        parsed = parse_code(code)
+        if parsed is None or parsed[0] not in self.prefix_ids:
+            return next((row for row, raw in self.raw.items() if raw == code and self.is_taken(row) == taken),
+                        None)
+        prefix, serial, pin = parsed
+        prefix_id = self.prefix_ids[prefix]
+        row = 0 if taken else self.head
+        while True:
+            try:
+                row = self.pin.index(pin, row)
+            except ValueError:
+                return None
+            if self.serial[row] == serial and self.prefix[row] == prefix_id and self.is_taken(row) == taken:
+                return row
+            row += 1
+
+    def take(self, codes):
+        """ Mark dispensed codes taken; they are normally the oldest, so no search is needed """
+        rows = self.rows()
+        for code in codes:
+            row = next(rows, None)
+            if row is None or self.code(row) != code:
+                row = self.row_of(code)
+                if row is None:
+                    continue
+            self.taken[row >> 3] |= 1 << (row & 7)
+            self.live -= 1
+        while self.head < len(self.pin) and self.is_taken(self.head):
+            self.head += 1
+        if self.head >= TRIM_AFTER and self.head * 2 >= len(self.pin):
+            self._trim()
+
+    def restore(self, codes):
+        """ Put taken codes back in stock, in their old rows unless those were trimmed """
+        for code in codes:
+            row = self.row_of(code, taken=True)
+            if row is None:
+                self.append(code)
+                continue
+            self.taken[row >> 3] &= ~(1 << (row & 7))
+            self.live += 1
+            self.head = min(self.head, row)
+
+    def _trim(self):
+        """ Drop the taken rows before head, keeping rows byte-aligned in the bitmap """
+        cut = self.head & ~7
+        self.prefix = self.prefix[cut:]
+        self.serial = self.serial[cut:]
+        self.pin = self.pin[cut:]
+        self.taken = self.taken[cut >> 3:]
+        self.raw = {row - cut: code for row, code in self.raw.items() if row >= cut}
+        self.head -= cut
+
+    def copy(self):
+        """ The codes in stock as a new column, trimmed of taken rows """
+        column = CodeColumn()
+        column.prefixes = list(self.prefixes)
+        column.prefix_ids = dict(self.prefix_ids)
+        if self.live == len(self.pin) - self.head:
+            # Nothing taken past head: plain array slices
+            column.prefix = self.prefix[self.head:]
+            column.serial = self.serial[self.head:]
+            column.pin = self.pin[self.head:]
+            column.raw = {row - self.head: code for row, code in self.raw.items() if row >= self.head}
+        else:
+            for row in self.rows():
+                if self.prefix[row] == RAW:
+                    column.raw[len(column.pin)] = self.raw[row]
+                column.prefix.append(self.prefix[row])
+                column.serial.append(self.serial[row])
+                column.pin.append(self.pin[row])
+        column.live = len(column.pin)
+        column.taken = bytearray((column.live + 7) // 8)
+        return column
+
+    @classmethod
+    def from_arrays(cls, prefixes, prefix, serial, pin, raw):
+        """ A column of codes all in stock, taking over the arrays given """
+        column = cls()
+        column.prefixes = prefixes
+        column.prefix_ids = {name: prefix_id for prefix_id, name in enumerate(prefixes)}
+        column.prefix, column.serial, column.pin, column.raw = prefix, serial, pin, raw
+        column.live = len(pin)
+        column.taken = bytearray((column.live + 7) // 8)
+        return column
+
+    @classmethod
+    def from_json(cls, data):
+        """ A column from the base64 form codes.json held before binary snapshots """
+        return cls.from_arrays(data['prefixes'], _decode('H', data['prefix']), _decode('I', data['serial']),
+                               _decode('Q', data['pin']),
+                               {int(row): code for row, code in data.get('raw', {}).items()})
+
+
+class CodeIndex:
+    """ Codes seen before - used, archived or in stock - for duplicate checks.
+
+    Packed like a CodeColumn into two arrays, pin and rest (the prefix id
+    and serial), 16 bytes a code. Until the first find() codes are only
+    appended; find() then folds in the stock columns and sorts the arrays
+    by (pin, rest), so every later lookup is a bisect. From then on new
+    codes, stocked ones included, wait in a set until merging them in is
+    cheap next to the arrays' size.
+    """
+
+    __slots__ = ('prefix_ids', 'pin', 'rest', 'raw', 'new', 'sorted')
+
+    def __init__(self):
+        self.prefix_ids = {}  # prefix -> id
+        self.pin = array('Q')
+        self.rest = array('Q')
+        self.raw = set()  # Codes that don't fit the packed format
+        self.new = set()  # pin << 64 | rest of codes not merged into the arrays yet
+        self.sorted = False  # Arrays sorted, with the stock columns folded in
+
+    def __len__(self):
+        return len(self.pin) + len(self.new) + len(self.raw)
+
+    @classmethod
+    def from_arrays(cls, prefixes, pin, rest, raw):
+        """ An index taking over the arrays given, in the order they were added """
+        index = cls()
+        index.prefix_ids = {prefix: prefix_id for prefix_id, prefix in enumerate(prefixes)}
+        index.pin, index.rest, index.raw = pin, rest, raw
+        return index
+
+    def prefixes(self):
+        """ prefix id -> prefix """
+        return sorted(self.prefix_ids, key=self.prefix_ids.get)
+
+    def codes(self):
+        """ Every code in the index; new ones not merged yet come last """
+        prefixes = self.prefixes()
+        for key in chain(map(operator.or_, map(operator.lshift, self.pin, repeat(64)), self.rest), self.new):
+            pin = f"{key >> 64:016d}"
+            rest = key & REST_MASK
+            yield (f"{prefixes[rest >> SERIAL_BITS]}-S-{rest & SERIAL_MASK:08d} "
+                   f"{pin[:4]}-{pin[4:8]}-{pin[8:12]}-{pin[12:]}")
+        yield from self.raw
+
+    def _key(self, code):
+        """ pin << 64 | rest of a packed code, or None for one kept as text """
+        parsed = parse_code(code)
+        if parsed is None:
+            return None
+        prefix, serial, pin = parsed
+        prefix_id = self.prefix_ids.setdefault(prefix, len(self.prefix_ids))
+        return pin << 64 | prefix_id << SERIAL_BITS | serial
+
+    def add(self, codes):
+        for code in codes:
+            key = self._key(code)
+            if key is None:
+                self.raw.add(code)
+            elif not self.sorted:
+                self.pin.append(key >> 64)
+                self.rest.append(key & REST_MASK)
+            elif not self._seen(key):
+                self.new.add(key)
+        if len(self.new) > max(MERGE_CODES, len(self.pin) // 16):
+            self._merge(self.new)
+            self.new = set()
+
+    def stocked(self, codes):
+        """ Note codes that just went into a column, once find() has folded the columns in """
+        if self.sorted:
+            self.add(codes)
+
+    def _seen(self, key):
+        if key in self.new:
+            return True
+        pin, rest = key >> 64, key & REST_MASK
+        index = bisect_left(self.pin, pin)
+        while index < len(self.pin) and self.pin[index] == pin:
+            if self.rest[index] == rest:
+                return True
+            index += 1
+        return False
+
+    def _merge(self, keys):
+        """ Sort keys into the arrays """
+        merged = sorted(chain(map(operator.or_, map(operator.lshift, self.pin, repeat(64)), self.rest), keys))
+        self.pin = array('Q', map(operator.rshift, merged, repeat(64)))
+        self.rest = array('Q', map(operator.and_, merged, repeat(REST_MASK)))
+
+    def find(self, codes, columns=()):
+        """ The subset of codes in the index or, the first time, in any of columns """
+        if not self.sorted:
+            keys = []
+            for column in columns:
+                remap = [self.prefix_ids.setdefault(prefix, len(self.prefix_ids)) for prefix in column.prefixes]
+                keys.extend(pin << 64 | remap[prefix_id] << SERIAL_BITS | serial
+                            for prefix_id, serial, pin in zip(column.prefix, column.serial, column.pin)
+                            if prefix_id != RAW)
+                self.raw.update(column.raw.values())
+            self._merge(keys)
+            self.sorted = True
+        found = set()
+        for code in codes:
+            key = self._key(code)
+            if key is None:
+                if code in self.raw:
+                    found.add(code)
+            elif self._seen(key):
+                found.add(code)
+        return found
@@ -0,0 +1,155 @@
+import re
+import time
+
+from .metrics import COMMAND_SECONDS, COMMANDS
+
+REQUIRED = object()
+
+
+def positive_int(text):
+    """ Arg type for counts: an int of at least 1 """
+    value = int(text)
+    if value < 1:
+        raise ValueError(f"{value} is not a positive count")
+    return value
+
+
+class Arg:
+    """ One positional command argument: its name, type and optional default """
+
+    __slots__ = ('name', 'type', 'default')
+
+    def __init__(self, name, type=str, default=REQUIRED):
+        self.name = name
+        self.type = type
+        self.default = default
+
+    @property
+    def required(self):
+        return self.default is REQUIRED
+
+    def __str__(self):
+        return f"<{self.name}>" if self.required else f"[{self.name}]"
+
+
+class Command:
+    """ A registered command.
+
+    With an args schema the handler is called as handler(event, *values);
+    with args=None it gets the raw word list as handler(event, args).
+    """
+
+    __slots__ = ('name', 'handler', 'description', 'args', 'usage', 'example', 'aliases')
+
+    def __init__(self, name, handler, description, args, usage, example, aliases):
+        self.name = name
+        self.handler = handler
+        self.description = description
+        self.args = args
+        self.usage = usage if usage is not None else " ".join(str(arg) for arg in args or ())
+        self.example = example
+        self.aliases = aliases
+
+
+class CommandRegistry:
+    """ Prefixed commands registered with the @command decorator.
+
+    The prefix matcher is compiled once, and messages that don't start with
+    the prefix character are dropped before any regex runs. Usage and error
+    replies go through respond(event, text), event.respond by default.
+
+    Every dispatch is counted by command and outcome and timed into
+    metrics.COMMAND_SECONDS.
+    """
+
+    def __init__(self, prefix, respond=None):
+        self.prefix = prefix
+        self.respond = respond or self._respond
+        self._first_chars = {prefix[0].lower(), prefix[0].upper()}
+        self._pattern = re.compile(rf"^{re.escape(prefix)}(\w+)\s*(.*)", re.IGNORECASE | re.DOTALL)
+        self._commands = []  # In registration order, for help
+        self._lookup = {}  # name or alias -> Command
+
+    def command(self, name, description, *, args=(), usage=None, example=None, aliases=()):
+        """ Decorator registering an async handler under name and its aliases """
+        def decorator(handler):
+            command = Command(name, handler, description, args, usage, example, aliases)
+            self._commands.append(command)
+            for key in (name, *aliases):
+                if key in self._lookup:
+                    raise ValueError(f"Command {self.prefix}{key} is already registered.")
+                self._lookup[key] = command
+            return handler
+        return decorator
+
+    @staticmethod
+    async def _respond(event, text):
+        await event.respond(text)
+
+    def parse(self, message):
+        """ Extract command and arguments from a prefixed message """
+        if not message or message[0] not in self._first_chars:
+            return None, []
+        match = self._pattern.match(message)
+        if match:
+            command = match.group(1).lower()
+            args = match.group(2).split() if match.group(2) else []
+            return command, args
+        return None, []
+
+    def usage(self, name):
+        command = self._lookup[name]
+        text = f"Usage: {self.prefix}{command.name} {command.usage}".rstrip()
+        if command.example:
+            text += f"\nExample: {command.example}"
+        return text
+
+    def help_text(self):
+        lines = ["Available commands:"]
+        for command in self._commands:
+            signature = f"{self.prefix}{command.name} {command.usage}".rstrip()
+            aliases = "".join(f", {self.prefix}{alias}" for alias in command.aliases)
+            lines.append(f"{signature} - {command.description}" + (f" (also {aliases[2:]})" if aliases else ""))
+        return "\n".join(lines)
+
+    async def dispatch(self, event):
+        """ Run the handler for a prefixed message; other messages are ignored """
+        name, args = self.parse(event.message.message.strip())
+        if not name:
+            return
+
+        command = self._lookup.get(name)
+        if command is None:
+            COMMANDS.inc("unknown", "unknown")
+            await self.respond(event, f"Unknown command: {name}")
+            return
+
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            outcome = await self._run(command, name, event, args)
+        finally:
+            COMMAND_SECONDS.since(start, command.name)
+            COMMANDS.inc(command.name, outcome)
+
+    async def _run(self, command, name, event, args):
+        """ Parse the arguments and call the handler, returning the outcome for the metrics """
+        if command.args is None:
+            await command.handler(event, args)
+            return "ok"
+
+        values = []
+        for i, arg in enumerate(command.args):
+            if i >= len(args):
+                if arg.required:
+                    await self.respond(event, self.usage(name))
+                    return "usage"
+                values.append(arg.default)
+                continue
+            try:
+                values.append(arg.type(args[i]))
+            except ValueError:
+                await self.respond(event, f"Invalid {' or '.join(a.name for a in command.args)}.")
+                return "invalid"
+        await command.handler(event, *values)
+        return "ok"
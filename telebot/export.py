@@ -0,0 +1,29 @@
+""" Print a binary snapshot as JSON, in the format codes.json and used.json had:
+
+    python -m telebot.export codes.bin > codes-export.json
+
+The output is for reading; it is not loaded back unless renamed to the JSON
+file name while the binary snapshot is absent.
+"""
+import argparse
+import json
+import sys
+
+from .snapshot import Snapshot, export_json
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a binary snapshot as JSON")
+    parser.add_argument("file", help="codes.bin, used.bin or archive/code-index.bin")
+    parser.add_argument("--indent", type=int, default=4)
+    args = parser.parse_args()
+    try:
+        snapshot = Snapshot(args.file)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Can't read {args.file}: {e}")
+    json.dump(export_json(snapshot), sys.stdout, indent=args.indent)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
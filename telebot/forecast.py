@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import math
+import time
+
+from .analytics import HOUR
+
+# Alert when an amount is projected to run out within this many hours
+LOW_STOCK_HOURS = 24
+
+# Time constant of the depletion rate average; sales older than a few of these barely count
+SMOOTHING_HOURS = 12
+
+
+class StockForecaster:
+    """ Projects how long each amount's stock lasts and warns before it runs out.
+
+    The depletion rate per amount is an exponentially weighted moving average
+    over time: every sale adds to a sum that decays by exp(-dt / tau), and the
+    rate is sum / tau codes per second. The service reports dispenses and
+    uploads through observe(); a background task applies them and re-evaluates
+    only the amount that changed, so the inventory is never polled.
+
+    notify(text) is called once when an amount's projected stock drops below
+    the horizon, and again only after a restock lifted it back above.
+    """
+
+    def __init__(self, notify, horizon_hours=LOW_STOCK_HOURS, smoothing_hours=SMOOTHING_HOURS):
+        self.notify = notify
+        self.horizon = horizon_hours * HOUR
+        self.tau = smoothing_hours * HOUR
+        self.available = {}  # amount -> codes in stock
+        self._sold = {}  # amount -> (decayed sales sum, time it was last updated)
+        self._alerted = set()  # amounts below the horizon that were already reported
+        self._events = None
+        self._worker = None
+
+    def seed(self, stock_summary, totals, seconds, now=None):
+        """ Start from current stock and the average rate of recent sales """
+        now = now if now is not None else time.time()
+        self.available = {amount: available for amount, _, available in stock_summary}
+        # A steady rate r keeps the decayed sum at r * tau
+        self._sold = {amount: (sold / seconds * self.tau, now) for amount, (sold, _) in totals.items() if sold}
+        for amount in self.available:
+            if self._below_horizon(amount, now):
+                self._alerted.add(amount)  # Already low at startup; Jforecast shows it
+        return self
+
+    # ✅ Events
+    def observe(self, kind, amount, count):
+        """ Service listener: kind is "dispense" or "restock" """
+        if self._worker is None:
+            self._events = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+        self._events.put_nowait((kind, amount, count, time.time()))
+
+    def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    async def _run(self):
+        while True:
+            kind, amount, count, at = await self._events.get()
+            try:
+                self._apply(kind, amount, count, at)
+            except Exception as e:
+                logging.error(f"Stock forecast for {amount} failed: {e}")
+
+    def _apply(self, kind, amount, count, at):
+        if kind == "dispense":
+            self.available[amount] = self.available.get(amount, 0) - count
+            self._sold[amount] = (self._decayed(amount, at) + count, at)
+        else:
+            self.available[amount] = self.available.get(amount, 0) + count
+
+        if not self._below_horizon(amount, at):
+            self._alerted.discard(amount)
+        elif amount not in self._alerted:
+            self._alerted.add(amount)
+            self.notify(self.alert_text(amount, at))
+
+    # ✅ Forecast
+    def _decayed(self, amount, now):
+        total, updated = self._sold.get(amount, (0, now))
+        return total * math.exp(-max(now - updated, 0) / self.tau)
+
+    def rate(self, amount, now=None):
+        """ Codes sold per hour, smoothed """
+        now = now if now is not None else time.time()
+        return self._decayed(amount, now) / self.tau * HOUR
+
+    def hours_left(self, amount, now=None):
+        """ Projected hours until amount runs out, or None if it is not selling """
+        rate = self.rate(amount, now)
+        if not rate:
+            return None
+        return max(self.available.get(amount, 0), 0) / rate
+
+    def _below_horizon(self, amount, now):
+        hours_left = self.hours_left(amount, now)
+        return hours_left is not None and hours_left * HOUR < self.horizon
+
+    def alert_text(self, amount, now=None):
+        available = max(self.available.get(amount, 0), 0)
+        if not available:
+            return f"⚠ {amount} UC is out of stock ⚠"
+        return (f"⚠ {amount} UC is running low: {available} pcs left, about "
+                f"{self.hours_left(amount, now):.1f} hours at {self.rate(amount, now):.1f} pcs/hour ⚠")
+
+    def summary(self, now=None):
+        """ (amount, available, pcs/hour, hours left or None) for every amount """
+        now = now if now is not None else time.time()
+        return [(amount, max(available, 0), self.rate(amount, now), self.hours_left(amount, now))
+                for amount, available in sorted(self.available.items())]
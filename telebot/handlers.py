@@ -0,0 +1,562 @@
+from datetime import datetime, timezone
+from itertools import groupby
+import logging
+import re
+import time
+
+from telethon import events
+
+from .analytics import DAY, HOUR, UNITS, stock_outlook, window_start
+from .commands import Arg, CommandRegistry, positive_int
+from .forecast import LOW_STOCK_HOURS, StockForecaster
+from .inventory import UNASSIGNED
+from . import metrics
+from .orders import parse_order
+from .outbox import Outbox
+from .service import InventoryService
+from .uploads import parse_amount, parse_codes, read_document, upload_report, validation_report
+
+# Custom prefix
+PREFIX = "J"  # Can be changed as needed
+
+# Telegram user IDs allowed to see every account and clear dues; when empty nobody is an admin
+ADMIN_IDS = set()
+
+# Jcheck argument for every dealer's dues at once
+ALL_DEALERS = "all"
+
+# Most recent settlement periods listed by Jhistory
+MAX_LISTED_PERIODS = 20
+
+# Chats that get low-stock alerts: ALERT_CHAT_ID in .env, or else the admins; with neither they are only logged
+ALERT_CHAT_IDS = []
+
+# Quarantined codes listed per amount by Jquarantine
+MAX_LISTED_QUARANTINED = 20
+
+# Bound by setup()
+client = None
+inventory = None
+service = None
+outbox = None
+forecaster = None
+
+# Command registry; handlers below register themselves with @commands.command
+commands = CommandRegistry(PREFIX)
+
+def setup(bot_client, bot_inventory, executor, admin_ids=(), alert_chat_ids=(), low_stock_hours=None,
+          bot_outbox=None, validator=None):
+    """ Bind the handlers to a client and a loaded inventory and start listening.
+
+    The client only needs add_event_handler, send_message and disconnect, so
+    benchmarks can pass a stub instead of a connected TelegramClient. With a
+    validator (see validation.Validator) uploads are checked before sale.
+    Call resume() once the event loop runs.
+    """
+    global client, inventory, service, outbox, forecaster, ADMIN_IDS, ALERT_CHAT_IDS, LOW_STOCK_HOURS
+    client = bot_client
+    inventory = bot_inventory
+    service = InventoryService(inventory, executor, validator=validator)
+    # Replies are queued here and sent in the background, merged and rate limited
+    outbox = bot_outbox or Outbox()
+    commands.respond = outbox.respond
+    ADMIN_IDS = set(admin_ids)
+    if not ADMIN_IDS:
+        logging.warning("No admin IDs are set (ADMIN_IDS in .env): admin commands such as Jclear, Jprice and "
+                        "Jstop are refused for every sender.")
+    ALERT_CHAT_IDS = list(alert_chat_ids) or sorted(ADMIN_IDS)
+    if not ALERT_CHAT_IDS:
+        logging.warning("No alert chats are set (ALERT_CHAT_ID or ADMIN_IDS in .env): low-stock and forecast "
+                        "alerts are only logged.")
+    if low_stock_hours is not None:
+        LOW_STOCK_HOURS = low_stock_hours
+    forecaster = start_forecaster()
+    client.add_event_handler(handle_message, events.NewMessage(incoming=True))
+
+async def resume():
+    """ Resume background work left by the last run: open reservations and pending validations """
+    await service.start()
+
+def send_alert(text):
+    logging.warning(text)
+    for chat_id in ALERT_CHAT_IDS:
+        outbox.send(client, chat_id, text)
+
+def start_forecaster():
+    """ Seed the low-stock forecaster from the last week of sales; the service feeds it afterwards """
+    now = int(time.time())
+    since = window_start(now, DAY, 7)
+    forecaster = StockForecaster(send_alert, LOW_STOCK_HOURS).seed(
+        inventory.stock_summary(), inventory.sales_totals(since), now - since, now)
+    service.subscribe(forecaster.observe)
+    return forecaster
+
+def escape_markdown_v2(text):
+    escape_chars = r'_*\[\]()~`>#+-=|{}!.'
+    return re.sub(f"([{re.escape(escape_chars)}])", r"\\\1", text)
+
+def is_admin(event):
+    return event.sender_id in ADMIN_IDS
+
+def dealer_arg(text):
+    """ Arg type for Jcheck: a Telegram user ID, or "all" for every dealer """
+    return ALL_DEALERS if text.lower() == ALL_DEALERS else int(text)
+
+# ✅ Telegram Command Handlers
+async def handle_message(event):
+    """ Handles prefixed commands """
+    await commands.dispatch(event)
+
+@commands.command("start", "Start the bot")
+async def start(event):
+    outbox.reply(event, f"Hello! I'm your UC bot. Use {PREFIX}help to see available commands.")
+
+@commands.command("help", "Show this help message")
+async def show_help(event):
+    outbox.reply(event, commands.help_text())
+
+@commands.command("baki", "Retrieve UC codes", args=(Arg("amount", int), Arg("count", positive_int, 1)),
+                  example=f"{PREFIX}baki 36 or {PREFIX}baki 36 2")
+async def baki(event, amount, count):
+    """Retrieve UC codes and charge them to the sender's account"""
+    result = await service.reserve(amount, count, event.sender_id)
+
+    if result:
+        reservation, codes, price_per_code, previous_due, total_due = result
+        codes_output = '\n'.join([f"`{code}`" for code in codes])  # Format each code in monospace
+
+        response = f"{codes_output}\n\n✓ {amount} 🆄︎🅲︎  x  {count}  ✓\n\nTᴏᴛᴀʟ Dᴜᴇ : ({previous_due}) + ({price_per_code}x{count}) = {total_due}"
+        # The codes are only charged once the reply is delivered
+        service.deliver(reservation, outbox.reply(event, response), outbox.withdraw)
+    else:
+        outbox.reply(event, f"⚠ {amount} UC Stock Out ⚠")
+
+def render_order(lines, previous_due, total_due):
+    result = []
+    for amount, codes, _ in lines:
+        result.append(f"✓ {amount} 🆄︎🅲︎  x  {len(codes)}  ✓")
+        result.extend(f"`{code}`" for code in codes)
+        result.append("")
+
+    total_uc = sum(amount * len(codes) for amount, codes, _ in lines)
+    charges = " + ".join(f"({price_per_code}x{len(codes)})" for _, codes, price_per_code in lines)
+    result.append(f"Tᴏᴛᴀʟ : {total_uc} 🆄︎🅲︎")
+    result.append(f"Tᴏᴛᴀʟ Dᴜᴇ : ({previous_due}) + {charges} = {total_due}")
+    return "\n".join(result)
+
+@commands.command("order", "Retrieve several UC amounts in one reply, or codes making up a UC total", args=None,
+                  usage="<total UC> [cheap|fewest] or <amount>x<count> ...",
+                  example=f"{PREFIX}order 660 or {PREFIX}order 325x2 60x1")
+async def order(event, args):
+    """Reserve every line of the order at once and charge them together once the reply is delivered"""
+    try:
+        target, lines, objective = parse_order(args)
+    except ValueError as e:
+        outbox.reply(event, f"{e}\n{commands.usage('order')}")
+        return
+
+    if target is not None:
+        result = await service.order(target, event.sender_id, objective)
+        stock_out = f"⚠ No combination of codes in stock makes {target} UC ⚠"
+    else:
+        result = await service.reserve_order(lines, event.sender_id)
+        stock_out = "⚠ Not enough stock for this order ⚠"
+
+    if result:
+        reservation, reserved, previous_due, total_due = result
+        # One reply for the whole order, charged only once it is delivered
+        service.deliver(reservation, outbox.reply(event, render_order(reserved, previous_due, total_due)),
+                        outbox.withdraw)
+    else:
+        outbox.reply(event, stock_out)
+
+def parse_time(text):
+    """ A UTC time written as YYYY-MM-DD or YYYY-MM-DDTHH:MM, as a timestamp """
+    return datetime.fromisoformat(text).replace(tzinfo=timezone.utc).timestamp()
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+
+@commands.command("price", "Set price for UC, now or from a UTC time (admin)", args=(
+                  Arg("amount", int), Arg("price", float), Arg("from", parse_time, None)),
+                  example=f"{PREFIX}price 60 0.95 or {PREFIX}price 60 0.95 2025-01-01T00:00")
+async def price(event, amount, price, effective_at):
+    """Add a price version for a UC amount; codes already sold keep the price they sold at."""
+    if not is_admin(event):
+        outbox.reply(event, "Only admins can set prices.")
+        return
+    version = await service.set_price(amount, price, effective_at)
+
+    if version is None:
+        outbox.reply(event, f"⚠ Price for {amount} UC not set: the current price took effect after "
+                            f"{format_time(effective_at)}, so it would never apply. Use a later time, or none "
+                            f"to change it now.")
+    elif effective_at is not None and effective_at > time.time():
+        outbox.reply(event, f"✅ Price for {amount} UC will be {price} from {format_time(effective_at)} "
+                            f"(version {version}).")
+    else:
+        outbox.reply(event, f"✅ Price for {amount} UC updated to {price} (version {version}). "
+                            f"Codes already sold keep their price.")
+
+def render_prices(history, now):
+    if not history:
+        return "No prices set."
+
+    result = ["🏷 Price History:\n"]
+    for amount, versions in groupby(history, key=lambda version: version[0]):
+        versions = list(versions)
+        current = max((version for version in versions if version[3] <= now),
+                      key=lambda version: (version[3], version[1]), default=None)
+        result.append(f"☞︎︎︎ {amount} 🆄︎🅲︎")
+        for version in versions:
+            _, number, price, effective_at = version
+            since = format_time(effective_at) if effective_at else "the start"
+            mark = " ✓" if version == current else " ⏳" if effective_at > now else ""
+            result.append(f"    #{number} ➪ {price} from {since}{mark}")
+    return "\n".join(result)
+
+@commands.command("prices", "Show every price version, for one amount or all", args=(Arg("amount", int, None),))
+async def prices(event, amount):
+    outbox.reply(event, render_prices(await service.price_history(amount), time.time()))
+
+def render_stock(summary):
+    if not summary:
+        return "No codes available."
+
+    total_price = 0  # Store the total price of available stock
+    result = ["💰 Stock Available:\n"]
+
+    for amount, price, available_codes in summary:
+        stock_value = price * available_codes  # Calculate total worth for this UC group
+        total_price += stock_value  # Add to total sum
+
+        result.append(f"☞︎︎︎ {amount:<3} 🆄︎🅲︎  ➪ {available_codes} pcs \n")
+
+    result.append("\n▔▔▔▔▔▔▔▔▔▔▔▔▔▔▔▔")
+    result.append(f"Wᴏʀᴛʜ Oғ : {total_price} ")
+    return "\n".join(result)
+
+@commands.command("stock", "Show available stock")
+async def stock(event):
+    outbox.reply(event, await service.render("stock", inventory.stock_summary, render_stock))
+
+def render_check(check_summary):
+    summary, due = check_summary
+    if not summary and not due:
+        return "No dues available, All clear ✅✅✅."
+
+    result = ["💰 Used Codes Summary:\n"]
+
+    # One line per price an amount sold at; the due is the one every dispense added to, not recomputed
+    for amount, price, used_codes_count in summary:
+        result.append(f"☞︎︎︎ {amount:<3} 🆄︎🅲︎  ➪ {used_codes_count} pcs @ {price} \n")
+
+    result.append("\n▔▔▔▔▔▔▔▔▔▔▔▔▔▔▔▔")
+    result.append(f"☞︎︎︎ Tᴏᴛᴀʟ Dᴜᴇ ➪ {due}")
+    return "\n".join(result)
+
+@commands.command("check", f"Check your used codes and dues (admins: one user's, or {ALL_DEALERS} for everyone's)",
+                  args=(Arg("user_id", dealer_arg, None),), example=f"{PREFIX}check or {PREFIX}check {ALL_DEALERS}")
+async def check(event, user_id):
+    if user_id is None:
+        user_id = event.sender_id
+    elif user_id != event.sender_id and not is_admin(event):
+        outbox.reply(event, "Only admins can check other users' dues.")
+        return
+    dealer = None if user_id == ALL_DEALERS else user_id
+    outbox.reply(event, await service.render(f"check:{dealer}", inventory.check_summary, render_check, dealer))
+
+def render_accounts(accounts):
+    if not accounts:
+        return "No dues available, All clear ✅✅✅."
+
+    result = ["💰 Dues Per User:\n"]
+    for dealer, used_codes_count, due in accounts:
+        name = "unassigned" if dealer == UNASSIGNED else dealer
+        result.append(f"☞︎︎︎ {name} ➪ {used_codes_count} pcs ➪ {due}")
+
+    result.append("\n▔▔▔▔▔▔▔▔▔▔▔▔▔▔▔▔")
+    result.append(f"☞︎︎︎ Tᴏᴛᴀʟ Dᴜᴇ ➪ {sum(due for _, _, due in accounts)}")
+    return "\n".join(result)
+
+@commands.command("accounts", "Show every user's used codes and due (admin)", aliases=("dues",))
+async def accounts(event):
+    if not is_admin(event):
+        outbox.reply(event, "Only admins can see all accounts.")
+        return
+    outbox.reply(event, await service.render("accounts", inventory.account_summary, render_accounts))
+
+def render_rate(price_list):
+    if not price_list:
+        return "No pricing data available."
+
+    result = ["💰 UC Pricing List:\n"]
+
+    for amount, price in price_list:
+        result.append(f"☞︎︎︎ {amount:<3} 🆄︎🅲︎  ➪ {price} \n")
+    return "\n".join(result)
+
+@commands.command("rate", "Show UC prices")
+async def rate(event):
+    outbox.reply(event, await service.render("rate", inventory.price_list, render_rate))
+
+@commands.command("clear", "Close a settlement period: archive used codes and reset dues for everyone or one user (admin)",
+                  args=(Arg("user_id", int, None),))
+async def clear(event, user_id):
+    if not is_admin(event):
+        outbox.reply(event, "Only admins can clear dues.")
+        return
+    period = await service.clear(user_id)
+    if period is None:
+        outbox.reply(event, "No dues available, All clear ✅✅✅.")
+    elif user_id is None:
+        outbox.reply(event, f"Cleared all dues ✅ ✅. Settlement period #{period} closed, see {PREFIX}history {period}.")
+    else:
+        outbox.reply(event, f"Cleared dues of {user_id} ✅ ✅. Settlement period #{period} closed, "
+                            f"see {PREFIX}history {period}.")
+
+def format_closed_at(closed_at):
+    return datetime.fromtimestamp(closed_at).strftime("%Y-%m-%d %H:%M") if closed_at else "before periods"
+
+def render_periods(periods):
+    if not periods:
+        return "No settlement periods closed yet."
+
+    result = ["📜 Settlement Periods:\n"]
+    for period, closed_at, used_codes_count, due in periods[-MAX_LISTED_PERIODS:]:
+        result.append(f"☞︎︎︎ #{period:<3} {format_closed_at(closed_at)} ➪ {used_codes_count} pcs ➪ {due}")
+    if len(periods) > MAX_LISTED_PERIODS:
+        result.append(f"\n... and {len(periods) - MAX_LISTED_PERIODS} older periods")
+    return "\n".join(result)
+
+def render_period(period, detail):
+    if detail is None:
+        return f"No settlement period #{period}."
+
+    closed_at, summary, dues = detail
+    result = [f"📜 Settlement Period #{period} ({format_closed_at(closed_at)}):\n"]
+    for amount, price, used_codes_count in summary:
+        result.append(f"☞︎︎︎ {amount:<3} 🆄︎🅲︎  ➪ {used_codes_count} pcs @ {price} \n")
+    if len(dues) > 1:
+        for dealer, due in sorted(dues.items()):
+            name = "unassigned" if dealer == UNASSIGNED else dealer
+            result.append(f"☞︎︎︎ {name} ➪ {due}")
+
+    result.append("\n▔▔▔▔▔▔▔▔▔▔▔▔▔▔▔▔")
+    result.append(f"☞︎︎︎ Tᴏᴛᴀʟ Dᴜᴇ ➪ {sum(dues.values())}")
+    return "\n".join(result)
+
+@commands.command("history", "Show closed settlement periods, or one period's details",
+                  args=(Arg("period", int, None),), aliases=("periods",))
+async def history(event, period):
+    dealer = None if is_admin(event) else event.sender_id
+    if period is None:
+        text = await service.render(f"history:{dealer}", inventory.period_list, render_periods, dealer)
+    else:
+        text = await service.render(f"history:{period}:{dealer}", inventory.period_detail,
+                                    lambda detail: render_period(period, detail), period, dealer)
+    outbox.reply(event, text)
+
+def format_bucket(start, unit):
+    day = datetime.fromtimestamp(start, timezone.utc)
+    if unit == HOUR:
+        return day.strftime("%Y-%m-%d %H:00")
+    if unit == DAY:
+        return day.strftime("%Y-%m-%d")
+    return day.strftime("week of %Y-%m-%d")
+
+def render_sales(title, unit, series, outlook):
+    if not series:
+        return f"No sales in the last {title}."
+
+    result = [f"📈 Sales, last {title} (UTC):\n"]
+    for start, rows in groupby(series, key=lambda row: row[0]):
+        rows = list(rows)
+        sold = sum(row[2] for row in rows)
+        revenue = sum(row[3] for row in rows)
+        result.append(f"☞︎︎︎ {format_bucket(start, unit)} ➪ {sold} pcs ➪ {revenue}")
+        for _, amount, amount_sold, amount_revenue in rows:
+            result.append(f"    {amount:<3} 🆄︎🅲︎  ➪ {amount_sold} pcs ➪ {amount_revenue}")
+
+    result.append("\nPer amount:")
+    for amount, sold, revenue, available, sell_through, days_left in outlook:
+        if not sold and not available:
+            continue
+        stock_left = f"{days_left:.1f} days left" if days_left is not None else "no recent sales"
+        result.append(f"☞︎︎︎ {amount:<3} 🆄︎🅲︎  ➪ {sold} pcs ➪ {revenue} ➪ {sell_through:.0%} sold ➪ {stock_left}")
+
+    result.append("\n▔▔▔▔▔▔▔▔▔▔▔▔▔▔▔▔")
+    result.append(f"Rᴇᴠᴇɴᴜᴇ : {sum(revenue for _, _, _, revenue in series)}")
+    return "\n".join(result)
+
+@commands.command("sales", "Sales per amount per hour/day/week, revenue, sell-through and days of stock left (admin)",
+                  args=(Arg("unit", str, "day"), Arg("count", int, 7)),
+                  example=f"{PREFIX}sales day 7 or {PREFIX}sales week 4")
+async def sales(event, unit, count):
+    unit_name = unit.lower().rstrip("s")
+    if unit_name not in UNITS or count < 1:
+        outbox.reply(event, commands.usage("sales"))
+        return
+    if not is_admin(event):
+        outbox.reply(event, "Only admins can see sales.")
+        return
+
+    now = int(time.time())
+    since = window_start(now, UNITS[unit_name], count)
+    series = await service.sales_series(since, UNITS[unit_name])
+    totals = await service.sales_totals(since)
+    outlook = stock_outlook(totals, await service.stock_summary(), now - since)
+    title = f"{count} {unit_name}s" if count > 1 else unit_name
+    outbox.reply(event, render_sales(title, UNITS[unit_name], series, outlook))
+
+def render_forecast(summary):
+    if not summary:
+        return "No codes available."
+
+    result = [f"🔮 Stock Forecast (alerts below {LOW_STOCK_HOURS:g} hours):\n"]
+    for amount, available, rate, hours_left in summary:
+        projection = f"{hours_left:.1f} hours left" if hours_left is not None else "not selling"
+        warning = " ⚠" if hours_left is not None and hours_left < LOW_STOCK_HOURS else ""
+        result.append(f"☞︎︎︎ {amount:<3} 🆄︎🅲︎  ➪ {available} pcs ➪ {rate:.1f}/hour ➪ {projection}{warning}")
+    return "\n".join(result)
+
+@commands.command("forecast", "Show projected hours of stock left per amount (admin)")
+async def forecast(event):
+    if not is_admin(event):
+        outbox.reply(event, "Only admins can see the forecast.")
+        return
+    outbox.reply(event, render_forecast(forecaster.summary()))
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    if seconds == float('inf'):
+        return f">{metrics.LATENCY_BUCKETS[-1]:g}s"
+    return f"{seconds * 1000:.3g}ms" if seconds < 1 else f"{seconds:.3g}s"
+
+def render_stats():
+    uptime = (time.time() - metrics.REGISTRY.started) / HOUR
+    result = [f"📊 Bot Stats (up {uptime:.1f} hours):\n", "Commands:"]
+    outcomes = {}
+    for (name, outcome), count in metrics.COMMANDS.items():
+        outcomes.setdefault(name, []).append(f"{count} {outcome}")
+    for name, calls in sorted(outcomes.items()):
+        latency = metrics.COMMAND_SECONDS
+        result.append(f"☞︎︎︎ {name} ➪ {', '.join(calls)} ➪ p50 {format_seconds(latency.quantile(0.5, name))}"
+                      f" ➪ p99 {format_seconds(latency.quantile(0.99, name))}")
+
+    result.append("\nStorage:")
+    for (operation,) in metrics.STORAGE_SECONDS.label_values():
+        storage = metrics.STORAGE_SECONDS
+        transferred = metrics.STORAGE_BYTES.value(operation)
+        size = f" ➪ {transferred / 1024:.1f} KB" if transferred else ""
+        result.append(f"☞︎︎︎ {operation} ➪ {storage.count(operation)} ➪ avg {format_seconds(storage.mean(operation))}"
+                      f" ➪ p99 {format_seconds(storage.quantile(0.99, operation))}{size}")
+
+    sends = metrics.SEND_SECONDS
+    result.append(f"\nSends: {metrics.SENDS.value('ok')} ok, {metrics.SENDS.value('error')} failed"
+                  f" ➪ p50 {format_seconds(sends.quantile(0.5))} ➪ p99 {format_seconds(sends.quantile(0.99))}")
+    result.append(f"Flood waits: {metrics.FLOOD_WAITS.value()} ({metrics.FLOOD_WAIT_SECONDS.value()}s paused)")
+    return "\n".join(result)
+
+@commands.command("stats", "Show command latency, storage and send metrics (admin)")
+async def stats(event):
+    if not is_admin(event):
+        outbox.reply(event, "Only admins can see stats.")
+        return
+    outbox.reply(event, render_stats())
+
+# Upload codes from the message text or an attached .txt/.csv file
+@commands.command("up", "Upload new codes (paste them or attach a .txt/.csv file) (admin)", args=None,
+                  usage="<amount> <code1> [<code2> ...]",
+                  example=f"{PREFIX}up 80 UPBD-N-S-04811675 1679-5939-2679-5224 UPBD-N-S-04810010 4491-9257-2419-2723",
+                  aliases=("upload",))
+async def upload_codes(event, args):
+    """Upload new codes to the stock."""
+    if not is_admin(event):
+        outbox.reply(event, "Only admins can upload codes.")
+        return
+    if not args or (len(args) < 2 and event.message.document is None):
+        outbox.reply(event, commands.usage("up"))
+        return
+
+    try:
+        amount = parse_amount(args[0])
+    except ValueError:
+        outbox.reply(event, "Invalid amount format. Please provide a valid number.")
+        return
+
+    try:
+        document_text = await read_document(event)
+    except ValueError as e:
+        outbox.reply(event, str(e))
+        return
+
+    codes = parse_codes(" ".join(args[1:]))
+    if document_text:
+        codes += parse_codes(document_text)
+
+    if not codes:
+        logging.error("No valid codes found.")
+        outbox.reply(event, "No valid codes found.")
+        return
+
+    added, duplicates, checked = await service.add_codes(amount, codes)
+
+    logging.info(f"Added {len(added)} codes for amount: {amount}, skipped {len(duplicates)} duplicates")
+    outbox.reply(event, upload_report(amount, added, duplicates, validating=checked is not None))
+    if checked is not None and added:
+        report_validation(event, amount, checked)
+
+def report_validation(event, amount, checked):
+    """ Reply with the outcome once the validation pool is done with the codes """
+    checked.add_done_callback(lambda done: outbox.reply(event, validation_report(amount, *done.result())))
+
+def render_quarantine(quarantined):
+    if not quarantined:
+        return "No codes in quarantine ✅"
+
+    result = ["🚫 Quarantined Codes:\n"]
+    for amount, codes in quarantined:
+        result.append(f"☞︎︎︎ {amount:<3} 🆄︎🅲︎  ➪ {len(codes)} pcs")
+        shown = codes[:MAX_LISTED_QUARANTINED]
+        result.append("```" + "\n".join(f"{code} ({reason})" for code, reason in shown) + "```")
+        if len(codes) > len(shown):
+            result.append(f"... and {len(codes) - len(shown)} more")
+    return "\n".join(result)
+
+@commands.command("quarantine", "List codes that failed validation (admin)", args=(Arg("amount", int, None),))
+async def quarantine(event, amount):
+    if not is_admin(event):
+        outbox.reply(event, "Only admins can see quarantined codes.")
+        return
+    outbox.reply(event, render_quarantine(await service.quarantine_list(amount)))
+
+@commands.command("recheck", "Validate quarantined codes again, for one amount or all (admin)",
+                  args=(Arg("amount", int, None),))
+async def recheck(event, amount):
+    if not is_admin(event):
+        outbox.reply(event, "Only admins can recheck codes.")
+        return
+    if service.validation is None:
+        outbox.reply(event, "No validator is configured.")
+        return
+    jobs = await service.recheck(amount)
+    if not jobs:
+        outbox.reply(event, "No codes in quarantine ✅")
+        return
+    outbox.reply(event, f"Rechecking {sum(len(codes) for _, codes, _ in jobs)} quarantined codes...")
+    for recheck_amount, _, checked in jobs:
+        report_validation(event, recheck_amount, checked)
+
+@commands.command("stop", "Stop the bot (admin)")
+async def stop_bot(event):
+    """Stop the bot gracefully."""
+    if not is_admin(event):
+        outbox.reply(event, "Only admins can stop the bot.")
+        return
+    outbox.reply(event, "Stopping the bot...")
+    await outbox.drain()
+    await service.flush()
+    service.close()
+    await client.disconnect()
@@ -0,0 +1,142 @@
+""" Commands driven through handlers.handle_message with the benchmark's stub client:
+    concurrent Jbaki, and who may see and change what.
+
+    python -m unittest discover -s . -p "*test.py"
+"""
+import asyncio
+import os
+import tempfile
+import unittest
+
+from . import handlers
+from .bench import ADMIN, CODE_IN_REPLY, FakeClient, FakeEvent
+from .inventory_test import AMOUNT, PRICE, make_codes
+from .io_executor import IOExecutor
+from .outbox import Outbox
+from .storage import open_inventory
+
+
+class HandlersTestCase(unittest.IsolatedAsyncioTestCase):
+    backend = "json"
+    admin_ids = {ADMIN}
+
+    async def asyncSetUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory(prefix="uc-test-")
+        os.chdir(self.directory.name)
+        self.executor = IOExecutor()
+        self.inventory = open_inventory(self.backend, executor=self.executor).load()
+        self.inventory.set_price(AMOUNT, PRICE)
+        self.inventory.add_codes(AMOUNT, make_codes(200))
+        self.client = FakeClient()
+        handlers.setup(self.client, self.inventory, self.executor, admin_ids=self.admin_ids,
+                       bot_outbox=Outbox(per_chat_interval=0, global_rate=10**9))
+        await handlers.resume()
+
+    async def asyncTearDown(self):
+        await handlers.outbox.drain()
+        await handlers.service.flush()
+        handlers.service.close()
+        handlers.outbox.close()
+        handlers.forecaster.close()
+        self.inventory.close()
+        self.executor.shutdown()
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    async def send(self, text, sender_id=ADMIN):
+        """ Run text through handle_message and return the replies sent to its chat """
+        sent = len(self.client.sent)
+        await handlers.handle_message(FakeEvent(self.client, text, sender_id))
+        await handlers.outbox.drain()
+        await handlers.service.settle()
+        return "\n".join(message for chat_id, message in self.client.sent[sent:] if chat_id == sender_id)
+
+
+class ConcurrentBakiTestCase(HandlersTestCase):
+    dealers = 30
+    per_dealer = 15
+
+    async def test_concurrent_baki_sends_each_code_once(self):
+        dealers = range(11, 11 + self.dealers)
+        # 450 Jbaki of 1-3 codes at once, more than the 200 in stock
+        await asyncio.gather(*(handlers.handle_message(FakeEvent(self.client, f"Jbaki {AMOUNT} {1 + n % 3}", dealer))
+                               for n in range(self.per_dealer) for dealer in dealers))
+        await handlers.outbox.drain()
+        await handlers.service.settle()
+
+        sent = {dealer: [] for dealer in dealers}
+        for chat_id, message in self.client.sent:
+            if chat_id in sent:  # The admin's chat also gets low-stock alerts
+                sent[chat_id].extend(CODE_IN_REPLY.findall(message))
+        codes = [code for dealer_codes in sent.values() for code in dealer_codes]
+        self.assertEqual(len(codes), 200)
+        self.assertEqual(len(set(codes)), 200)
+        self.assertEqual(self.inventory.stock_summary(), [(AMOUNT, PRICE, 0)])
+        dues = {dealer: due for dealer, _, due in self.inventory.account_summary()}
+        self.assertEqual(dues, {dealer: len(dealer_codes) * PRICE
+                                for dealer, dealer_codes in sent.items() if dealer_codes})
+
+
+class SqliteConcurrentBakiTestCase(ConcurrentBakiTestCase):
+    backend = "sqlite"
+
+
+class SalesTestCase(HandlersTestCase):
+
+    async def test_sales_break_each_bucket_down_by_amount(self):
+        self.inventory.set_price(160, 4.0)
+        self.inventory.add_codes(160, make_codes(5, start=1000))
+        await self.send(f"Jbaki {AMOUNT} 2", 11)
+        await self.send("Jbaki 160", 12)
+
+        lines = (await self.send("Jsales hour 1")).splitlines()
+        bucket = next(n for n, line in enumerate(lines) if "3 pcs ➪ 8.0" in line)
+        self.assertIn(f"{AMOUNT:<3} 🆄︎🅲︎  ➪ 2 pcs ➪ {2 * PRICE}", lines[bucket + 1])
+        self.assertIn("160 🆄︎🅲︎  ➪ 1 pcs ➪ 4.0", lines[bucket + 2])
+
+
+class SqliteSalesTestCase(SalesTestCase):
+    backend = "sqlite"
+
+
+class PriceTestCase(HandlersTestCase):
+
+    async def test_price_from_before_the_current_one_is_refused(self):
+        self.assertIn("not set", await self.send(f"Jprice {AMOUNT} 5 2020-01-01"))
+        self.assertIn("will be 7", await self.send(f"Jprice {AMOUNT} 7 2999-01-01"))
+        self.assertIn("updated to 3", await self.send(f"Jprice {AMOUNT} 3"))
+        self.assertEqual([price for _, _, price, _ in self.inventory.price_history(AMOUNT)], [PRICE, 3, 7])
+        self.assertEqual(self.inventory.price_of(AMOUNT), 3)
+
+
+class SqlitePriceTestCase(PriceTestCase):
+    backend = "sqlite"
+
+
+class LedgerTestCase(HandlersTestCase):
+
+    async def test_check_shows_the_senders_own_dues(self):
+        await self.send(f"Jbaki {AMOUNT}", 11)
+        await self.send(f"Jbaki {AMOUNT} 2", 12)
+
+        self.assertIn(f"Dᴜᴇ ➪ {PRICE}", await self.send("Jcheck", 11))
+        self.assertIn(f"Dᴜᴇ ➪ {PRICE}", await self.send("Jcheck 11", 11))
+        self.assertIn("Only admins", await self.send("Jcheck 12", 11))
+        self.assertIn("Only admins", await self.send("Jcheck all", 11))
+        self.assertIn("All clear", await self.send("Jcheck"))
+        self.assertIn(f"Dᴜᴇ ➪ {2 * PRICE}", await self.send("Jcheck 12"))
+        self.assertIn(f"Dᴜᴇ ➪ {3 * PRICE}", await self.send("Jcheck all"))
+
+
+class NoAdminsTestCase(HandlersTestCase):
+    admin_ids = set()
+
+    async def test_nobody_is_an_admin(self):
+        for text in (f"Jprice {AMOUNT} 9", "Jclear", "Jaccounts", "Jcheck all", "Jstop"):
+            self.assertIn("Only admins", await self.send(text))
+        self.assertEqual(self.inventory.price_of(AMOUNT), PRICE)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,988 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from .analytics import SalesRollup
+from .archive import ARCHIVE_DIR, Archive, make_segment
+from .columns import CodeColumn, CodeIndex
+from .journal import JOURNAL_FILE, Journal
+from .lock import LOCK_FILE, FileLock
+from .metrics import STORAGE_BYTES, STORAGE_SECONDS
+from .prices import ALWAYS, PriceBook
+from .snapshot import STOCK, USED, open_snapshot, save_snapshot, stock_sections, used_sections
+
+# Constants
+FILE_NAME = 'codes.bin'  # Binary snapshots, see snapshot.py
+REMOVED_FILE_NAME = 'used.bin'
+JSON_FILE_NAME = 'codes.json'  # Snapshots from before the binary ones; migrated on load
+JSON_REMOVED_FILE_NAME = 'used.json'
+TOTAL_DUE_FILE = 'total_due.json'
+HISTORY_FILE = 'history.json'  # Codes cleared before settlement periods; moved into the archive on load
+SALES_FILE = 'sales.json'  # Hourly sales rollup for Jsales
+VALIDATION_FILE = 'validation.json'  # Uploaded codes waiting for validation or quarantined by it
+PRICES_FILE = 'prices.json'  # Every price version, see prices.py
+
+# Dealer for codes and dues recorded before per-dealer accounts
+UNASSIGNED = 0
+
+# Seconds to batch journal records before an fsync
+FLUSH_DELAY = 0.05
+
+# Journal records to accumulate before rewriting the snapshots
+COMPACT_EVERY = 1000
+
+# Seconds reserved codes are held for their reply to be delivered before going back to stock
+RESERVATION_TTL = 60
+
+
+# ✅ Helper functions
+def load_json(file_name, default_data=None):
+    if os.path.exists(file_name):
+        try:
+            start = time.perf_counter()
+            with open(file_name, 'rb') as file:
+                raw = file.read()
+            STORAGE_SECONDS.since(start, "read")
+            STORAGE_BYTES.inc("read", amount=len(raw))
+            start = time.perf_counter()
+            data = json.loads(raw)
+            STORAGE_SECONDS.since(start, "parse")
+            return data
+        except json.JSONDecodeError:
+            logging.error(f"JSON file {file_name} is corrupted. Resetting.")
+    return default_data if default_data else {"codes": []}
+
+def save_json(data, file_name):
+    """ Write compact JSON through a temp file so a crash never leaves a half-written file """
+    tmp_name = f"{file_name}.tmp"
+    try:
+        start = time.perf_counter()
+        raw = json.dumps(data, separators=(',', ':'))
+        STORAGE_SECONDS.since(start, "serialize")
+        start = time.perf_counter()
+        with open(tmp_name, 'w') as file:
+            file.write(raw)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_name, file_name)
+        STORAGE_SECONDS.since(start, "write")
+        STORAGE_BYTES.inc("write", amount=len(raw))
+        return True
+    except IOError as e:
+        logging.error(f"Error saving {file_name}: {e}")
+        return False
+
+
+def insert_sorted(groups, amount, group):
+    """ Add a group to a dict kept in amount order, so readers never sort """
+    in_order = not groups or amount > next(reversed(groups))
+    groups[amount] = group
+    return groups if in_order else dict(sorted(groups.items()))
+
+
+class StockGroup:
+    """ Available codes for one amount, dispensed oldest first from a packed CodeColumn.
+
+    A group read from a binary snapshot only knows its count until the
+    column is first used.
+    """
+
+    __slots__ = ('amount', 'price', '_column', '_load', '_count')
+
+    def __init__(self, amount, price=0, codes=(), column=None):
+        self.amount = amount
+        self.price = price
+        self._column = column if column is not None else CodeColumn()
+        self._load = None
+        self._count = 0
+        for code in codes:
+            self.add(code)
+
+    @classmethod
+    def from_snapshot(cls, snapshot, group):
+        stock_group = cls(group.amount, group.price)
+        stock_group._column = None
+        stock_group._load = lambda: snapshot.column(group)
+        stock_group._count = group.rows
+        return stock_group
+
+    @classmethod
+    def from_json(cls, group):
+        column = CodeColumn.from_json(group['columns']) if 'columns' in group else None
+        # Codes listed one dict each (files from before columns, or added by cu.py);
+        # only unredeemed ones are still in stock
+        return cls(group['amount'], group.get('price'),
+                   (code['code'] for code in group.get('codes', ()) if not code['redeemed']), column)
+
+    @property
+    def column(self):
+        if self._column is None:
+            self._column, self._load = self._load(), None
+        return self._column
+
+    def __len__(self):
+        return self._count if self._column is None else len(self._column)
+
+    def codes(self):
+        """ Codes in stock, oldest first """
+        return self.column.codes()
+
+    def copy(self):
+        return StockGroup(self.amount, self.price, column=self.column.copy())
+
+    def add(self, code):
+        """ Queue a code; duplicates are turned away by Inventory.add_codes """
+        self.column.append(code)
+
+    def peek(self, count):
+        """ The oldest count codes, the ones the next dispense will take """
+        return self.column.peek(count)
+
+    def discard(self, codes):
+        """ Remove dispensed codes, usually the oldest ones """
+        self.column.take(codes)
+
+
+def record_lines(record):
+    """ (amount, codes, price, version) lines of a dispense or reserve record.
+
+    Single-amount records have no lines, and records from before price
+    versions no version.
+    """
+    if 'lines' in record:
+        return [(line['amount'], line['codes'], line['price'], line.get('version')) for line in record['lines']]
+    return [(record['amount'], record['codes'], record['price'], record.get('version'))]
+
+
+def line_fields(lines):
+    """ Record fields for (amount, codes, price, version) lines, in the single-amount form when there is one """
+    if len(lines) == 1:
+        (amount, codes, price, version), = lines
+        return {"amount": amount, "codes": codes, "price": price, "version": version}
+    return {"lines": [{"amount": amount, "codes": codes, "price": price, "version": version}
+                      for amount, codes, price, version in lines]}
+
+
+class Reservation:
+    """ Codes held out of stock for a reply that hasn't been delivered yet.
+
+    lines are (amount, codes, price, version): one for Jbaki, one per amount
+    for Jorder, priced at the version in effect when they were reserved.
+    """
+
+    __slots__ = ('lines', 'dealer', 'expires_at')
+
+    def __init__(self, lines, dealer, expires_at):
+        self.lines = lines
+        self.dealer = dealer
+        self.expires_at = expires_at
+
+    @property
+    def amounts(self):
+        return tuple(amount for amount, _, _, _ in self.lines)
+
+    @property
+    def codes(self):
+        return [code for _, codes, _, _ in self.lines for code in codes]
+
+    @property
+    def value(self):
+        return sum(price * len(codes) for _, codes, price, _ in self.lines)
+
+    def priced_lines(self):
+        """ (amount, codes, price) lines as reserve_order() and confirm() return them """
+        return [(amount, codes, price) for amount, codes, price, _ in self.lines]
+
+
+class Account:
+    """ One dealer's ledger: the outstanding due and used code counts per amount and price.
+
+    due grows by each dispense's value as it happens and is never recomputed
+    from prices. held is the value of the dealer's open reservations, due
+    once they're confirmed.
+    """
+
+    __slots__ = ('due', 'used', 'held')
+
+    def __init__(self):
+        self.due = 0
+        self.used = {}  # (amount, price sold at) -> used codes
+        self.held = 0
+
+    @property
+    def used_count(self):
+        return sum(self.used.values())
+
+
+class Inventory:
+    """ Stock, used codes and dealer dues, loaded once and served from memory.
+
+    Every mutation is one record in the journal, so a Jbaki that moves codes
+    and bumps the due is a single atomic write. codes.bin, used.bin (see
+    snapshot.py) and the JSON files are snapshots carrying the seq of the
+    last record they include; the journal is replayed on top of them at
+    startup and emptied once it holds COMPACT_EVERY records.
+
+    One process owns the files. Processes sharing stock use SqliteInventory.
+    """
+
+    def __init__(self, file_name=FILE_NAME, removed_file_name=REMOVED_FILE_NAME,
+                 total_due_file=TOTAL_DUE_FILE, history_file=HISTORY_FILE, journal_file=JOURNAL_FILE,
+                 sales_file=SALES_FILE, archive_dir=ARCHIVE_DIR, flush_delay=FLUSH_DELAY,
+                 compact_every=COMPACT_EVERY, executor=None, json_file_name=JSON_FILE_NAME,
+                 json_removed_file_name=JSON_REMOVED_FILE_NAME, lock_file=LOCK_FILE,
+                 validation_file=VALIDATION_FILE, prices_file=PRICES_FILE):
+        self.file_name = file_name
+        self.removed_file_name = removed_file_name
+        self.json_file_name = json_file_name
+        self.json_removed_file_name = json_removed_file_name
+        self.total_due_file = total_due_file
+        self.history_file = history_file
+        self.sales_file = sales_file
+        self.validation_file = validation_file
+        self.prices_file = prices_file
+        self.flush_delay = flush_delay
+        self.compact_every = compact_every
+        self.journal = Journal(journal_file)
+        self.archive = Archive(archive_dir)
+        self.lock = FileLock(lock_file)
+        self.executor = executor
+
+        self.stock = {}  # amount -> StockGroup, its codes packed in a columns.CodeColumn, in amount order
+        self.used = {}  # amount -> {"amount", "codes", "price"}, in amount order
+        self.code_index = CodeIndex()  # Every code seen, for the duplicate check
+        self.accounts = {}  # dealer -> Account
+        self.reserved = {}  # reservation (seq of its record) -> Reservation
+        self.pending = {}  # amount -> {code: None} waiting for validation, in upload order
+        self.quarantined = {}  # amount -> {code: reason}
+        self.prices = PriceBook()
+        self.total_due = 0  # Sum of all dealers' dues
+        self.period = 0  # Last closed settlement period
+        self.sales = SalesRollup()  # Hourly codes sold and revenue per amount, for the analytics reports
+        self.seq = 0  # Seq of the last applied record
+
+        self._snapshot_seq = {}  # file name -> seq its snapshot includes
+        self._dirty = set()
+        self._flush_handle = None
+        self._compaction = None  # Future of the snapshot write in flight
+        self._archiving = None  # Future of the last archive segment write
+
+    # Calls only touch memory, so they stay on the event loop
+    blocking = False
+
+    def load(self):
+        """ Read the snapshots and replay the journal, replacing the in-memory state.
+
+        Takes lock_file (see lock.FileLock) until close(). Stock groups are only
+        read from codes.bin when first used.
+        """
+        self.lock.acquire()
+        stock_snapshot = open_snapshot(self.file_name)
+        used_snapshot = open_snapshot(self.removed_file_name)
+        # Until the first binary snapshots are written the JSON ones stand in
+        data = load_json(self.json_file_name) if stock_snapshot is None else None
+        used_data = load_json(self.json_removed_file_name) if used_snapshot is None else None
+        total_due_data = load_json(self.total_due_file, {"total_due": 0})
+        history_data = load_json(self.history_file)
+        sales_data = load_json(self.sales_file, {"buckets": []})
+        validation_data = load_json(self.validation_file, {"pending": [], "quarantined": []})
+        prices_data = load_json(self.prices_file, {"versions": None})  # None: start from codes.bin's prices
+
+        if stock_snapshot is not None:
+            self.stock = {group.amount: StockGroup.from_snapshot(stock_snapshot, group)
+                          for group in sorted(stock_snapshot.groups, key=lambda group: group.amount)}
+        else:
+            self.stock = {group['amount']: StockGroup.from_json(group)
+                          for group in sorted(data['codes'], key=lambda group: group['amount'])}
+        if used_snapshot is not None:
+            self.used = {group.amount: {"amount": group.amount, "codes": used_snapshot.used_codes(group),
+                                        "price": group.price}
+                         for group in sorted(used_snapshot.groups, key=lambda group: group.amount)}
+        else:
+            self.used = {group['amount']: group
+                         for group in sorted(used_data['codes'], key=lambda group: group['amount'])}
+            # used.json predates price versions: its codes sold at the group's price
+            for group in self.used.values():
+                for code in group['codes']:
+                    code.setdefault('price', group.get('price', 0))
+        self.total_due = total_due_data.get("total_due", 0)
+        self.period = total_due_data.get("period", 0)
+        self.sales = SalesRollup.from_json(sales_data['buckets'])
+        self.accounts = {}
+        self.reserved = {}
+        self.pending = {group['amount']: dict.fromkeys(group['codes']) for group in validation_data['pending']}
+        self.quarantined = {group['amount']: dict(group['codes']) for group in validation_data['quarantined']}
+        self.prices = PriceBook.from_json(prices_data['versions'] or [])
+        dues = total_due_data.get("dues", {UNASSIGNED: self.total_due} if self.total_due else {})
+        for dealer, due in dues.items():
+            self._account(int(dealer)).due = due
+        for amount, group in self.used.items():
+            for code in group['codes']:
+                used = self._account(code.get('dealer', UNASSIGNED)).used
+                key = (amount, code['price'])
+                used[key] = used.get(key, 0) + 1
+        self.archive.load()
+        self.code_index = self.archive.code_index(self.period)
+        for group in history_data['codes']:
+            self.code_index.add(group['codes'])
+        for group in self.used.values():
+            self.code_index.add(code['code'] for code in group['codes'])
+        self._snapshot_seq = {
+            self.file_name: data.get("seq", 0) if data is not None else stock_snapshot.seq,
+            self.removed_file_name: used_data.get("seq", 0) if used_data is not None else used_snapshot.seq,
+            self.total_due_file: total_due_data.get("seq", 0),
+            self.sales_file: sales_data.get("seq", 0),
+            self.validation_file: validation_data.get("seq", 0),
+            self.prices_file: prices_data.get("seq", 0),
+        }
+        self.seq = max(*self._snapshot_seq.values(), history_data.get("seq", 0))
+        self._dirty.clear()
+        migrate_history = os.path.exists(self.history_file)
+        migrate_json = {}
+        for file_name, json_file, snapshot in ((self.file_name, self.json_file_name, stock_snapshot),
+                                               (self.removed_file_name, self.json_removed_file_name, used_snapshot)):
+            if not os.path.exists(json_file):
+                continue
+            if snapshot is None:
+                migrate_json[file_name] = json_file
+            elif json_file != self.json_file_name:
+                logging.warning(f"Ignoring {json_file}: {file_name} replaced it")
+        # A codes.json next to codes.bin holds uploads written since, e.g. by an older cu.py
+        merge_uploads = stock_snapshot is not None and os.path.exists(self.json_file_name)
+        self._dirty.update(migrate_json)
+        if migrate_history and self.period == 0:
+            self._archive_history(history_data)
+
+        records = self.journal.replay()
+        for record in records:
+            self._apply(record, replaying=True)
+            self.seq = max(self.seq, record['seq'])
+        self._release_orphans()
+        self.archive.rollback(self.period)
+        if records or self._dirty or self.journal.has_old_segment():
+            self.compact()  # Start from clean snapshots and an empty journal
+        if migrate_history and self.total_due_file not in self._dirty:
+            os.remove(self.history_file)  # Its codes are in the archive and total_due.json has the period
+        for file_name, json_file in migrate_json.items():
+            if file_name not in self._dirty:
+                os.remove(json_file)
+                logging.info(f"Migrated {json_file} to {file_name}")
+        self.journal.open()
+        if prices_data['versions'] is None:
+            self._seed_prices()
+        if merge_uploads:
+            self._merge_uploads()
+
+        logging.info(f"Loaded {sum(len(g) for g in self.stock.values())} codes "
+                     f"in {len(self.stock)} groups, replayed {len(records)} journal records")
+        return self
+
+    def _archive_history(self, history_data):
+        """ Turn the codes cleared before settlement periods into period 1 """
+        groups = [{"amount": group['amount'], "price": 0,
+                   "codes": [[code, UNASSIGNED] for code in group['codes']]}
+                  for group in history_data['codes'] if group['codes']]
+        if not groups:
+            return
+        self.period = 1
+        segment = make_segment(self.period, None, None, groups, {})
+        self.archive.write(segment)
+        self.archive.add(segment)
+        self._dirty.add(self.total_due_file)
+        logging.info(f"Moved {sum(len(group['codes']) for group in groups)} codes from {self.history_file} "
+                     f"into settlement period 1")
+
+    def _seed_prices(self):
+        """ Start the price history from the stock groups' prices when prices.json is missing """
+        for amount, group in self.stock.items():
+            if group.price is not None and amount not in self.prices:
+                self._record("price", amount=amount, price=group.price, effective_at=ALWAYS)
+                logging.info(f"Price {group.price} for {amount} UC is version {self.seq} of the price history")
+
+    def _merge_uploads(self):
+        """ Add the stock codes of a codes.json written after codes.bin, then remove the file """
+        for group in load_json(self.json_file_name)['codes']:
+            amount = group['amount']
+            if amount not in self.prices and group.get('price') is not None:
+                self._record("price", amount=amount, price=group['price'], effective_at=ALWAYS)
+            added, duplicates = self.add_codes(amount, StockGroup.from_json(group).codes())
+            if added or duplicates:
+                logging.info(f"Merged {len(added)} codes for {amount} UC from {self.json_file_name}, "
+                             f"skipping {len(duplicates)} already known")
+        self.flush()
+        os.remove(self.json_file_name)
+
+    def _release_orphans(self):
+        """ Put codes reserved by the last run back in stock; its replies can't be confirmed any more """
+        for reservation, held in self.reserved.items():
+            for amount, codes, _, _ in held.lines:
+                self.stock[amount].column.restore(codes)
+            self._account(held.dealer).held -= held.value
+            lines = ", ".join(f"{len(codes)} x {amount} UC" for amount, codes, _, _ in held.lines)
+            logging.warning(f"Released reservation {reservation} of {lines} for {held.dealer}, "
+                            f"left open by the last run")
+        if self.reserved:
+            self.reserved = {}
+            self._dirty.add(self.file_name)
+
+    def _account(self, dealer):
+        account = self.accounts.get(dealer)
+        if account is None:
+            account = self.accounts[dealer] = Account()
+        return account
+
+    # ✅ Journal and snapshots
+    def _record(self, op, **fields):
+        """ Apply a new mutation and append it to the journal """
+        self.seq += 1
+        record = {"seq": self.seq, "op": op, **fields}
+        self._apply(record)
+        self.journal.append(record)
+
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._commit()  # No event loop (scripts, shutdown): write straight away
+            return
+        self._flush_handle = loop.call_later(self.flush_delay, self._commit)
+
+    def _stale(self, record, file_name):
+        """ True if the snapshot of file_name predates the record, marking it dirty """
+        if record['seq'] <= self._snapshot_seq.get(file_name, 0):
+            return False
+        self._dirty.add(file_name)
+        return True
+
+    def _apply(self, record, replaying=False):
+        op, seq = record['op'], record['seq']
+        amount = record.get('amount')
+
+        if op == "dispense":
+            dealer = record.get('dealer', UNASSIGNED)
+            account = self._account(dealer)
+            # A confirmed reservation's codes already left stock, unless a snapshot put them back
+            held = self.reserved.pop(record['reservation'], None) if 'reservation' in record else None
+            if held is not None:
+                account.held -= held.value
+            stock_stale = self._stale(record, self.file_name) and held is None
+            used_stale = self._stale(record, self.removed_file_name)
+            due_stale = self._stale(record, self.total_due_file)
+            sales_stale = 'at' in record and self._stale(record, self.sales_file)
+            for amount, codes, price, version in record_lines(record):
+                count = len(codes)
+                if stock_stale:
+                    self.stock[amount].discard(codes)
+                if used_stale:
+                    used_codes = [{"code": code, "redeemed": True, "dealer": dealer, "at": record.get('at'),
+                                   "version": version, "price": price} for code in codes]
+                    used_group = self.used.get(amount)
+                    if not used_group:
+                        self.used = insert_sorted(self.used, amount,
+                                                  {"amount": amount, "codes": used_codes, "price": price})
+                    else:
+                        used_group['codes'].extend(used_codes)
+                    account.used[(amount, price)] = account.used.get((amount, price), 0) + count
+                    self.code_index.add(codes)
+                if due_stale:
+                    account.due += price * count
+                    self.total_due += price * count
+                if sales_stale:
+                    self.sales.add(record['at'], amount, count, price * count)
+        elif op == "upload":
+            if record.get('validate'):
+                if self._stale(record, self.validation_file):
+                    self.pending.setdefault(amount, {}).update(dict.fromkeys(record['codes']))
+            elif self._stale(record, self.file_name):
+                self._stock_codes(amount, record['codes'])
+        elif op == "accept":
+            if self._stale(record, self.validation_file):
+                self._unpend(amount, record['codes'])
+            if self._stale(record, self.file_name):
+                self._stock_codes(amount, record['codes'])
+        elif op == "quarantine":
+            if self._stale(record, self.validation_file):
+                self._unpend(amount, [code for code, _ in record['codes']])
+                self.quarantined.setdefault(amount, {}).update(record['codes'])
+        elif op == "recheck":
+            if self._stale(record, self.validation_file):
+                quarantined = self.quarantined.get(amount, {})
+                for code in record['codes']:
+                    quarantined.pop(code, None)
+                if not quarantined:
+                    self.quarantined.pop(amount, None)
+                self.pending.setdefault(amount, {}).update(dict.fromkeys(record['codes']))
+        elif op == "reserve":
+            # Reservations made before the stock snapshot are back in stock there
+            if self._stale(record, self.file_name):
+                held = self.reserved[seq] = Reservation(record_lines(record), record['dealer'],
+                                                        record['expires_at'])
+                for line_amount, codes, _, _ in held.lines:
+                    self.stock[line_amount].discard(codes)
+                self._account(held.dealer).held += held.value
+        elif op == "release":
+            held = self.reserved.pop(record['reservation'], None)
+            if held is not None and self._stale(record, self.file_name):
+                for line_amount, codes, _, _ in held.lines:
+                    self.stock[line_amount].column.restore(codes)
+                self._account(held.dealer).held -= held.value
+        elif op == "extend":
+            held = self.reserved.get(record['reservation'])
+            if held is not None:
+                held.expires_at = record['expires_at']
+        elif op == "price":
+            # A new version; records from before versions took effect straight away
+            if self._stale(record, self.prices_file):
+                self.prices.add(seq, amount, record['price'], record.get('effective_at', ALWAYS))
+        elif op == "clear":
+            # Without a dealer (and in records from before accounts) everything is cleared
+            dealer = record.get('dealer')
+            period = record.get('period') or self.period + 1
+            self.period = max(self.period, period)
+            if self._stale(record, self.removed_file_name):
+                # The segment must be on disk before a used.bin snapshot without these codes
+                self._write_segment(self._settle(period, record.get('closed_at'), dealer), replaying)
+                if dealer is None:
+                    self.used = {}
+                    for account in self.accounts.values():
+                        account.used = {}
+                else:
+                    for used_amount in list(self.used):
+                        group = self.used[used_amount]
+                        group['codes'] = [code for code in group['codes']
+                                          if code.get('dealer', UNASSIGNED) != dealer]
+                        if not group['codes']:
+                            del self.used[used_amount]
+                    self._account(dealer).used = {}
+            if self._stale(record, self.total_due_file):
+                for account_dealer, account in self.accounts.items():
+                    if dealer is None or account_dealer == dealer:
+                        account.due = 0
+                self.total_due = sum(account.due for account in self.accounts.values())
+            self.accounts = {account_dealer: account for account_dealer, account in self.accounts.items()
+                             if account.due or account.used or account.held}
+        else:
+            logging.error(f"Unknown journal record {op} at seq {seq}. Skipping.")
+
+    def _stock_codes(self, amount, codes):
+        group = self.stock.get(amount)
+        if not group:
+            group = StockGroup(amount)
+            self.stock = insert_sorted(self.stock, amount, group)
+        for code in codes:
+            group.add(code)
+        self.code_index.stocked(codes)
+
+    def _unpend(self, amount, codes):
+        pending = self.pending.get(amount, {})
+        for code in codes:
+            pending.pop(code, None)
+        if not pending:
+            self.pending.pop(amount, None)
+
+    def _settle(self, period, closed_at, dealer):
+        """ Archive segment of the used codes and dues a clear for dealer settles """
+        groups = {}  # (amount, price sold at) -> segment group
+        for amount, group in self.used.items():
+            for code in group['codes']:
+                code_dealer = code.get('dealer', UNASSIGNED)
+                if dealer is None or code_dealer == dealer:
+                    segment_group = groups.get((amount, code['price']))
+                    if segment_group is None:
+                        segment_group = groups[(amount, code['price'])] = {
+                            "amount": amount, "price": code['price'], "codes": []}
+                    segment_group['codes'].append([code['code'], code_dealer])
+        dues = {account_dealer: account.due for account_dealer, account in self.accounts.items()
+                if account.due and (dealer is None or account_dealer == dealer)}
+        return make_segment(period, closed_at, dealer, list(groups.values()), dues)
+
+    def _write_segment(self, segment, replaying):
+        self.archive.add(segment)
+        if self.executor is None or replaying:
+            self.archive.write(segment)
+        else:
+            # Queued ahead of any later snapshot on the same I/O thread
+            self._archiving = self.executor.submit(self.archive.write, segment)
+
+    def _commit(self):
+        """ Sync the journal and compact it once it is long enough.
+
+        With an executor (see io_executor.IOExecutor) fsyncs and snapshot writes
+        run on its thread; the event loop only copies state and rotates the log.
+        """
+        self._flush_handle = None
+        if self.executor is None:
+            self.journal.sync()
+            if self.journal.count >= self.compact_every:
+                self.compact()
+            return
+
+        self.executor.submit(self.journal.sync)
+        if self.journal.count >= self.compact_every and self._compaction is None:
+            payloads, old_journal = self._snapshot()
+            saves = [(file_name, self.executor.save(data, file_name, write)) for file_name, write, data in payloads]
+            # The I/O thread runs jobs in order, so this runs after the snapshot writes
+            self._compaction = self.executor.submit(
+                lambda: self._finish_snapshot([(name, save.result()) for name, save in saves], old_journal))
+            self._compaction.add_done_callback(self._compaction_done)
+
+    def _compaction_done(self, future):
+        self._compaction = None
+        if future.exception():
+            logging.error(f"Journal compaction failed: {future.exception()}")
+
+    def _snapshot(self):
+        """ Copy the dirty files' state and rotate the journal.
+
+        Only the containers are copied here; encoding and writing the files is
+        left to _write_snapshot so it can run off the event loop.
+        """
+        dirty, self._dirty = self._dirty, set()
+        seq = self.seq
+        payloads = []
+        if self.file_name in dirty:
+            stock = {amount: group.copy() for amount, group in self.stock.items()}
+            # Open reservations are saved as stock, so they are released if the bot restarts
+            for held in self.reserved.values():
+                for amount, codes, _, _ in held.lines:
+                    for code in codes:
+                        stock[amount].add(code)
+            stock = list(stock.values())
+            # Only for reading the file: prices come from prices.json
+            prices = {amount: self.prices.current(amount)[1] for amount in self.stock}
+            payloads.append((self.file_name, save_snapshot, lambda: {
+                "kind": STOCK, "seq": seq,
+                "groups": [(group.amount, prices[group.amount], stock_sections(group.column)) for group in stock]}))
+        if self.removed_file_name in dirty:
+            used = [{**group, "codes": list(group['codes'])} for group in self.used.values()]
+            payloads.append((self.removed_file_name, save_snapshot, lambda: {
+                "kind": USED, "seq": seq,
+                "groups": [(group['amount'], group.get('price', 0), used_sections(group['codes']))
+                           for group in used]}))
+        if self.total_due_file in dirty:
+            total_due, period = self.total_due, self.period
+            dues = {str(dealer): account.due for dealer, account in self.accounts.items() if account.due}
+            payloads.append((self.total_due_file, save_json, lambda: {"total_due": total_due, "dues": dues,
+                                                                      "period": period, "seq": seq}))
+        if self.sales_file in dirty:
+            sales = self.sales.to_json()
+            payloads.append((self.sales_file, save_json, lambda: {"buckets": sales, "seq": seq}))
+        if self.prices_file in dirty:
+            versions = self.prices.to_json()
+            payloads.append((self.prices_file, save_json, lambda: {"versions": versions, "seq": seq}))
+        if self.validation_file in dirty:
+            pending = [{"amount": amount, "codes": list(codes)} for amount, codes in self.pending.items()]
+            quarantined = [{"amount": amount, "codes": list(codes.items())}
+                           for amount, codes in self.quarantined.items()]
+            payloads.append((self.validation_file, save_json, lambda: {"pending": pending,
+                                                                       "quarantined": quarantined, "seq": seq}))
+        for file_name in dirty:
+            self._snapshot_seq[file_name] = seq
+        return payloads, self.journal.rotate()
+
+    def _write_snapshot(self, payloads, old_journal):
+        self.journal.sync_old()
+        self._finish_snapshot([(file_name, write(data(), file_name)) for file_name, write, data in payloads],
+                              old_journal)
+
+    def _finish_snapshot(self, results, old_journal):
+        """ Retire the old journal segment if every snapshot was written """
+        failed = [file_name for file_name, ok in results if not ok]
+        if failed:
+            # Keep the old segment; the next rotation appends to it and retries these files
+            self._dirty.update(failed)
+            if old_journal is not None:
+                old_journal.close()
+            return
+        self.journal.retire(old_journal)
+
+    def compact(self):
+        """ Snapshot every changed file and empty the journal, waiting for the writes """
+        if self._compaction is not None:
+            self._compaction.result()
+        if self._archiving is not None:
+            self._archiving.result()
+        self._write_snapshot(*self._snapshot())
+
+    def flush(self):
+        """ Make everything durable and compact the journal, e.g. before shutdown """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self.compact()
+        self.journal.sync()
+
+    def close(self):
+        """ Close the journal and let another process load the files; flush() first """
+        self.journal.close()
+        self.lock.release()
+
+    # ✅ Queries
+    def version(self):
+        """ Changes whenever the inventory does, or a price set ahead of time takes effect """
+        return self.seq, self.prices.changes_by(time.time())
+
+    def price_of(self, amount):
+        return self.prices.current(amount)[1] or 0
+
+    def price_list(self):
+        """ (amount, price) pairs sorted by amount, skipping groups without a price """
+        now = time.time()
+        prices = [(amount, self.prices.current(amount, now)[1]) for amount in self.stock]
+        return [(amount, price) for amount, price in prices if price is not None]
+
+    def stock_summary(self):
+        """ (amount, price, available count) for every stock group sorted by amount """
+        now = time.time()
+        return [(amount, self.prices.current(amount, now)[1] or 0, len(group)) for amount, group in self.stock.items()]
+
+    def price_history(self, amount=None):
+        """ (amount, version, price, effective_at) of every price version, for one amount or all """
+        return self.prices.history(amount)
+
+    def used_summary(self, dealer=None):
+        """ (amount, price sold at, used count) sorted by amount, for one dealer or everyone.
+
+        An amount sold at several prices has a line for each.
+        """
+        if dealer is None:
+            accounts = self.accounts.values()
+        else:
+            accounts = [self.accounts[dealer]] if dealer in self.accounts else []
+        counts = {}
+        for account in accounts:
+            for key, count in account.used.items():
+                counts[key] = counts.get(key, 0) + count
+        return [(amount, price, count) for (amount, price), count in sorted(counts.items())]
+
+    def check_summary(self, dealer=None):
+        """ (used_summary(dealer), due) with the due kept up to date by every dispense """
+        if dealer is None:
+            return self.used_summary(), self.total_due
+        account = self.accounts.get(dealer)
+        return self.used_summary(dealer), account.due if account else 0
+
+    def pending_codes(self):
+        """ (amount, codes) still waiting for validation, sorted by amount """
+        return [(amount, list(codes)) for amount, codes in sorted(self.pending.items())]
+
+    def quarantine_list(self, amount=None):
+        """ (amount, [(code, reason)]) of quarantined codes sorted by amount, for one amount or all """
+        return [(group_amount, list(codes.items())) for group_amount, codes in sorted(self.quarantined.items())
+                if amount is None or group_amount == amount]
+
+    def reservations(self):
+        """ (reservation, amounts, expires_at) of every open reservation """
+        return [(reservation, held.amounts, held.expires_at) for reservation, held in self.reserved.items()]
+
+    def account_summary(self):
+        """ (dealer, used count, due) for every dealer with an open balance """
+        return [(dealer, account.used_count, account.due) for dealer, account in sorted(self.accounts.items())
+                if account.due or account.used]
+
+    def period_list(self, dealer=None):
+        """ (period, closed_at, codes, due) for every closed settlement period """
+        return self.archive.period_list(dealer)
+
+    def period_detail(self, period, dealer=None):
+        """ (closed_at, [(amount, price, count)], {dealer: due}) of a closed period, or None """
+        return self.archive.period_detail(period, dealer)
+
+    def sales_series(self, since, unit):
+        """ (bucket start, amount, codes sold, revenue) per unit and amount from since on """
+        return self.sales.series(since, unit)
+
+    def sales_totals(self, since):
+        """ {amount: (codes sold, revenue)} from since on """
+        return self.sales.totals(since)
+
+    # ✅ Mutations
+    def dispense(self, amount, count, dealer=UNASSIGNED):
+        """ Take count codes for amount and charge them to dealer's due in one record.
+
+        Returns (codes, price_per_code, previous_due, total_due) with the dealer's
+        due, or None if the amount is unknown or out of stock.
+        """
+        if count < 1:
+            raise ValueError(f"Count must be at least 1, got {count}")
+        group = self.stock.get(amount)
+        if not group or len(group) < count:
+            return None
+
+        codes = group.peek(count)
+        version, price_per_code = self.prices.current(amount)
+        price_per_code = price_per_code or 0
+        account = self.accounts.get(dealer)
+        previous_due = account.due if account else 0
+        self._record("dispense", amount=amount, codes=codes, price=price_per_code, version=version, dealer=dealer,
+                     at=int(time.time()))
+        return codes, price_per_code, previous_due, self.accounts[dealer].due
+
+    def reserve(self, amount, count, dealer=UNASSIGNED, expires_at=None):
+        """ Hold count codes for amount out of stock until confirm() or release().
+
+        Returns (reservation, codes, price_per_code, previous_due, total_due) with the
+        dealer's due as it will be once confirmed, counting their other open
+        reservations, or None if the amount is unknown or out of stock.
+        """
+        result = self.reserve_order([(amount, count)], dealer, expires_at)
+        if result is None:
+            return None
+        reservation, [(_, codes, price_per_code)], previous_due, total_due = result
+        return reservation, codes, price_per_code, previous_due, total_due
+
+    def reserve_order(self, lines, dealer=UNASSIGNED, expires_at=None):
+        """ Hold codes for several (amount, count) lines in one reservation, all or nothing.
+
+        Returns (reservation, [(amount, codes, price_per_code)], previous_due, total_due)
+        like reserve(), or None if any amount is unknown or short of stock.
+
+        A "reserve" record takes the codes out of stock; confirm() charges them
+        with the usual "dispense" record and release() puts them back. Reservations
+        live in memory and the journal only: codes.bin counts reserved codes as in
+        stock, so a restart hands back every reservation it finds open.
+        """
+        counts = {}
+        for amount, count in lines:
+            if count < 1:
+                raise ValueError(f"Count must be at least 1, got {count}")
+            counts[amount] = counts.get(amount, 0) + count
+        now = time.time()
+        reserved = []
+        for amount, count in sorted(counts.items()):
+            group = self.stock.get(amount)
+            if not group or len(group) < count:
+                return None
+            # Charged at the version in effect now, even if the price changes before confirm()
+            version, price_per_code = self.prices.current(amount, now)
+            reserved.append((amount, group.peek(count), price_per_code or 0, version))
+
+        account = self.accounts.get(dealer)
+        previous_due = account.due + account.held if account else 0
+        if expires_at is None:
+            expires_at = now + RESERVATION_TTL
+        self._record("reserve", **line_fields(reserved), dealer=dealer, expires_at=expires_at)
+        held = self.reserved[self.seq]
+        return self.seq, held.priced_lines(), previous_due, previous_due + held.value
+
+    def confirm(self, reservation):
+        """ Dispense reserved codes and charge the dealer, like dispense().
+
+        Returns ([(amount, codes, price_per_code)], previous_due, total_due), or None
+        if the reservation was already released.
+        """
+        held = self.reserved.get(reservation)
+        if held is None:
+            return None
+        previous_due = self.accounts[held.dealer].due
+        self._record("dispense", reservation=reservation, **line_fields(held.lines), dealer=held.dealer,
+                     at=int(time.time()))
+        return held.priced_lines(), previous_due, self.accounts[held.dealer].due
+
+    def release(self, reservation, expired_before=None):
+        """ Put reserved codes back in stock, returning False if the reservation is gone.
+
+        With expired_before, only a reservation expiring by then is released.
+        """
+        held = self.reserved.get(reservation)
+        if held is None or expired_before is not None and held.expires_at > expired_before:
+            return False
+        self._record("release", reservation=reservation)
+        return True
+
+    def extend(self, reservation, expires_at):
+        """ Move a reservation's expiry, returning False if it is gone """
+        if reservation not in self.reserved:
+            return False
+        self._record("extend", reservation=reservation, expires_at=expires_at)
+        return True
+
+    def set_price(self, amount, price, effective_at=None):
+        """ Add a price version for amount, effective from effective_at (default now), returning its number.
+
+        Codes already sold, or reserved, keep the price they were taken at. The
+        version is numbered by its record's seq (see prices.PriceBook), and
+        prices.json is the price history's snapshot.
+        """
+        self._record("price", amount=amount, price=price,
+                     effective_at=time.time() if effective_at is None else effective_at)
+        return self.seq
+
+    def clear(self, dealer=None):
+        """ Close a settlement period for one dealer, or everyone, returning its number.
+
+        Their used codes and dues move into an archive segment (see
+        archive.Archive) and leave used.bin, so the hot files only hold the
+        open period. Returns None, closing nothing, if there is nothing to settle.
+        """
+        if dealer is None:
+            open_balance = self.used or self.total_due
+        else:
+            account = self.accounts.get(dealer)
+            open_balance = account and (account.used or account.due)
+        if not open_balance:
+            return None
+        self._record("clear", dealer=dealer, period=self.period + 1, closed_at=int(time.time()))
+        return self.period
+
+    def add_codes(self, amount, codes, validate=False):
+        """ Add codes to an amount group in one record, returning (added, duplicates).
+
+        Any code seen before, under any amount and including sold ones, is a duplicate.
+        With validate the codes wait in pending for accept() or quarantine(); both
+        live in validation.json and count as known codes.
+        """
+        codes = [code.strip() for code in codes]
+        known = self.code_index.find(codes, [group.column for group in self.stock.values()])
+        if self.reserved:
+            # Their rows may already be trimmed from the columns
+            known |= {code for held in self.reserved.values() for code in held.codes}.intersection(codes)
+        for waiting in (*self.pending.values(), *self.quarantined.values()):
+            known.update(filter(waiting.__contains__, codes))
+        added, duplicates, seen = [], [], set()
+        for code in codes:
+            if code in seen or code in known:
+                duplicates.append(code)
+            else:
+                seen.add(code)
+                added.append(code)
+
+        if not added:
+            return added, duplicates
+        if validate:
+            self._record("upload", amount=amount, codes=added, validate=True)
+        else:
+            self._record("upload", amount=amount, codes=added)
+        return added, duplicates
+
+    def accept(self, amount, codes):
+        """ Move validated codes from pending into stock, returning the ones that were pending """
+        pending = self.pending.get(amount, {})
+        codes = [code for code in codes if code in pending]
+        if codes:
+            self._record("accept", amount=amount, codes=codes)
+        return codes
+
+    def quarantine(self, amount, rejected):
+        """ Move codes that failed validation from pending into quarantine; rejected is {code: reason} """
+        pending = self.pending.get(amount, {})
+        codes = [[code, reason] for code, reason in rejected.items() if code in pending]
+        if codes:
+            self._record("quarantine", amount=amount, codes=codes)
+        return len(codes)
+
+    def recheck(self, amount=None):
+        """ Send quarantined codes of amount, or of every amount, back to pending.
+
+        Returns [(amount, codes)] for the validation pool.
+        """
+        amounts = list(self.quarantined) if amount is None else [amount] if amount in self.quarantined else []
+        moved = []
+        for recheck_amount in amounts:
+            codes = list(self.quarantined[recheck_amount])
+            self._record("recheck", amount=recheck_amount, codes=codes)
+            moved.append((recheck_amount, codes))
+        return moved
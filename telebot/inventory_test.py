@@ -0,0 +1,153 @@
+""" Exactly-once dispensing, journal replay and reservation expiry, on both backends.
+
+    python -m unittest discover -s . -p "*test.py"
+"""
+import asyncio
+import os
+import tempfile
+import unittest
+
+from .io_executor import IOExecutor
+from .outbox import Outbox
+from .service import InventoryService
+from .storage import open_inventory
+
+AMOUNT = 80
+PRICE = 2.0
+
+
+def make_codes(count, start=0):
+    return [f"TEST-N-S-{serial:08d} 0000-0000-0000-{serial % 10**4:04d}" for serial in range(start, start + count)]
+
+
+class FlakyChat:
+    """ An event whose chat takes fail_after messages, then fails every send """
+
+    def __init__(self, fail_after):
+        self.chat_id = 1
+        self.fail_after = fail_after
+        self.sent = []
+
+    async def respond(self, message):
+        if len(self.sent) >= self.fail_after:
+            raise ConnectionError("chat is failing")
+        self.sent.append(message)
+
+
+class InventoryTestCase(unittest.IsolatedAsyncioTestCase):
+    backend = "json"
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory(prefix="uc-test-")
+        os.chdir(self.directory.name)
+        self.executor = IOExecutor()
+        self.inventory = self.open()
+        self.inventory.set_price(AMOUNT, PRICE)
+        self.inventory.add_codes(AMOUNT, make_codes(200))
+        self.service = InventoryService(self.inventory, self.executor, ttl=0.05)
+
+    def tearDown(self):
+        self.service.close()
+        self.inventory.close()
+        self.executor.shutdown()
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def open(self):
+        return open_inventory(self.backend).load()
+
+    def available(self):
+        return dict((amount, count) for amount, _, count in self.inventory.stock_summary()).get(AMOUNT, 0)
+
+    def due(self, dealer):
+        return dict((account, due) for account, _, due in self.inventory.account_summary()).get(dealer, 0)
+
+    async def deliver(self, reservation, delivered=True):
+        delivery = asyncio.get_running_loop().create_future()
+        self.service.deliver(reservation, delivery)
+        delivery.set_result(delivered)
+        await asyncio.sleep(0)
+        await self.service.settle()
+
+    async def test_concurrent_reservations_hand_out_each_code_once(self):
+        async def dealer(dealer_id):
+            codes = []
+            for _ in range(5):
+                reservation, reserved, *_ = await self.service.reserve(AMOUNT, 2, dealer_id)
+                await self.deliver(reservation)
+                codes.extend(reserved)
+            return codes
+
+        results = await asyncio.gather(*(dealer(dealer_id) for dealer_id in range(1, 21)))
+        codes = [code for result in results for code in result]
+        self.assertEqual(len(codes), 200)
+        self.assertEqual(len(set(codes)), 200)
+        self.assertEqual(self.available(), 0)
+        self.assertIsNone(await self.service.reserve(AMOUNT, 1, 1))
+        for dealer_id in range(1, 21):
+            self.assertEqual(self.due(dealer_id), 10 * PRICE)
+
+    async def test_state_survives_a_restart_without_flush(self):
+        self.inventory.dispense(AMOUNT, 3, 7)
+        reservation, *_ = self.inventory.reserve(AMOUNT, 2, 8)
+        self.inventory.confirm(reservation)
+        self.inventory.set_price(AMOUNT, 3.0)
+        self.inventory.dispense(AMOUNT, 1, 7)
+        self.inventory.add_codes(AMOUNT, make_codes(5, start=1000))
+        stock, used = self.inventory.stock_summary(), self.inventory.used_summary()
+        # No flush(): the JSON backend has to replay its journal
+        self.inventory.close()
+        self.inventory = self.open()
+
+        self.assertEqual(self.inventory.stock_summary(), stock)
+        self.assertEqual(self.inventory.used_summary(), used)
+        self.assertEqual(self.due(7), 3 * PRICE + 3.0)
+        self.assertEqual(self.due(8), 2 * PRICE)
+        self.assertEqual(self.inventory.add_codes(AMOUNT, make_codes(1))[0], [])
+
+    async def test_expired_reservation_goes_back_in_stock(self):
+        await self.service.start()
+        self.assertIsNotNone(await self.service.reserve(AMOUNT, 4, 9))
+        self.assertEqual(self.available(), 196)
+        await asyncio.sleep(0.2)
+        await self.service.settle()
+        self.assertEqual(self.available(), 200)
+        self.assertEqual(self.inventory.reservations(), [])
+        self.assertEqual(self.due(9), 0)
+
+    async def test_undelivered_reply_releases_its_codes(self):
+        reservation, *_ = await self.service.reserve(AMOUNT, 4, 9)
+        await self.deliver(reservation, delivered=False)
+        self.assertEqual(self.available(), 200)
+        self.assertEqual(self.due(9), 0)
+
+    async def test_partly_sent_reply_is_charged(self):
+        outbox = Outbox(per_chat_interval=0, global_rate=10**9)
+        chat = FlakyChat(fail_after=1)
+        reservation, codes, *_ = await self.service.reserve(AMOUNT, 2, 9)
+        # Longer than one message, so it goes out in two chunks and only the first gets through
+        self.service.deliver(reservation, outbox.reply(chat, "\n".join(codes) + "\n" + "x" * 5000))
+        await outbox.drain()
+        await asyncio.sleep(0)
+        await self.service.settle()
+        outbox.close()
+        self.assertEqual(len(chat.sent), 1)
+        self.assertEqual(self.available(), 198)
+        self.assertEqual(self.due(9), 2 * PRICE)
+
+    async def test_counts_below_one_are_rejected(self):
+        for count in (0, -1):
+            with self.assertRaises(ValueError):
+                self.inventory.dispense(AMOUNT, count, 9)
+            with self.assertRaises(ValueError):
+                self.inventory.reserve(AMOUNT, count, 9)
+        self.assertEqual(self.available(), 200)
+
+
+class SqliteInventoryTestCase(InventoryTestCase):
+    backend = "sqlite"
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from .inventory import save_json
+
+
+class IOExecutor:
+    """ One background thread for blocking persistence work.
+
+    Jobs run in submission order. Saves of a file that queue up behind an
+    unstarted save of the same file are coalesced: only the latest data is
+    written, and every caller gets the same future.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="io")
+        self._lock = threading.Lock()
+        self._pending = {}  # file name -> (data, future) not yet written
+
+    def submit(self, func, *args):
+        return self._executor.submit(func, *args)
+
+    async def run(self, func, *args):
+        """ Await func(*args) on the I/O thread """
+        return await asyncio.wrap_future(self.submit(func, *args))
+
+    def save(self, data, file_name, write=save_json):
+        """ Run write(data, file_name), where data may be a callable building it on this thread """
+        with self._lock:
+            if file_name in self._pending:
+                future = self._pending[file_name][2]
+                self._pending[file_name] = (data, write, future)
+                return future
+            future = self.submit(self._write, file_name)
+            self._pending[file_name] = (data, write, future)
+            return future
+
+    def _write(self, file_name):
+        with self._lock:
+            data, write, _ = self._pending.pop(file_name)
+        return write(data() if callable(data) else data, file_name)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from .metrics import STORAGE_BYTES, STORAGE_SECONDS
+
+JOURNAL_FILE = 'journal.log'
+
+
+class Journal:
+    """ Append-only log of inventory mutations, one compact JSON record per line.
+
+    Records are buffered on append and made durable in batches by sync(), so a
+    burst of commands costs a single fsync. A torn last line left by a crash is
+    dropped on replay.
+
+    Compaction rotates the log: appends continue in a fresh file while the old
+    segment (file_name + '.old') waits for the snapshots that cover it.
+    """
+
+    def __init__(self, file_name=JOURNAL_FILE):
+        self.file_name = file_name
+        self.old_name = f"{file_name}.old"
+        self.count = 0  # Records in the current segment
+        self._file = None
+        self._pending = False
+        self._lock = threading.Lock()  # append() on the loop, sync() on the I/O thread
+
+    def _replay_file(self, file_name):
+        records = []
+        if not os.path.exists(file_name):
+            return records
+
+        good_offset = 0
+        with open(file_name, 'rb') as file:
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+                good_offset += len(line)
+            torn = file.seek(0, os.SEEK_END) != good_offset
+
+        if torn:
+            logging.warning(f"Journal {file_name} has a torn record after {len(records)} entries. Dropping it.")
+            with open(file_name, 'r+b') as file:
+                file.truncate(good_offset)
+        return records
+
+    def replay(self):
+        """ Return every complete record, oldest segment first, truncating torn tails """
+        old_records = self._replay_file(self.old_name)
+        records = self._replay_file(self.file_name)
+        self.count = len(records)
+        return old_records + records
+
+    def has_old_segment(self):
+        return os.path.exists(self.old_name)
+
+    def open(self):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.file_name, 'a')
+
+    def append(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.file_name, 'a')
+            self._file.write(line)
+            STORAGE_BYTES.inc("journal_append", amount=len(line))
+            self.count += 1
+            self._pending = True
+
+    def sync(self):
+        """ Flush buffered records and fsync them to disk """
+        with self._lock:
+            if not self._pending:
+                return
+            self._file.flush()
+            fd = self._file.fileno()
+            self._pending = False
+        start = time.perf_counter()
+        os.fsync(fd)
+        STORAGE_SECONDS.since(start, "journal_fsync")
+
+    def rotate(self):
+        """ Move the current segment aside and start a fresh one.
+
+        Returns the old segment's file object; call sync_old() before writing
+        the snapshots covering its records, and pass it to retire() once they
+        are on disk.
+        """
+        with self._lock:
+            old_file, self._file = self._file, None
+            if old_file is not None:
+                old_file.flush()
+            if os.path.exists(self.old_name) and os.path.exists(self.file_name):
+                # A previous snapshot failed and still needs the old segment; extend it
+                with open(self.file_name, 'rb') as src, open(self.old_name, 'ab') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(self.file_name)
+            elif os.path.exists(self.file_name):
+                os.replace(self.file_name, self.old_name)
+            self._file = open(self.file_name, 'a')
+            self.count = 0
+            self._pending = False
+        return old_file
+
+    def sync_old(self):
+        """ fsync the old segment, so its records are on disk before snapshots stand in for them """
+        if not os.path.exists(self.old_name):
+            return
+        start = time.perf_counter()
+        with open(self.old_name, 'ab') as file:
+            os.fsync(file.fileno())
+        STORAGE_SECONDS.since(start, "journal_fsync")
+
+    def retire(self, old_file):
+        """ Drop the old segment after a snapshot made it redundant """
+        if old_file is not None:
+            old_file.close()
+        if os.path.exists(self.old_name):
+            os.remove(self.old_name)
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,68 @@
+import logging
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Held by the process that owns the JSON inventory files in a directory
+LOCK_FILE = 'inventory.lock'
+
+
+class FileLock:
+    """ An exclusive, non-blocking lock on a file, released on release() or process exit.
+
+    The JSON backend keeps its state in memory and rewrites whole files, so
+    two processes on the same files would overwrite each other's changes.
+    The lock makes the second one fail at startup instead. The pid of the
+    holder is written into the file for the error message.
+    """
+
+    def __init__(self, file_name=LOCK_FILE):
+        self.file_name = file_name
+        self._file = None
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def acquire(self):
+        """ Take the lock, raising RuntimeError if another process holds it """
+        if self._file is not None:
+            return self
+        file = open(self.file_name, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            file.seek(0)
+            holder = file.read().strip() or "another process"
+            file.close()
+            raise RuntimeError(f"{self.file_name} is held by {holder}. Only one process can use the JSON "
+                               f"inventory in a directory; share stock between processes with "
+                               f"STORAGE_BACKEND=sqlite.")
+        file.seek(0)
+        file.truncate()
+        file.write(f"pid {os.getpid()}")
+        file.flush()
+        self._file = file
+        return self
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        except OSError as e:
+            logging.error(f"Error releasing {self.file_name}: {e}")
+        self._file.close()
+        self._file = None
@@ -0,0 +1,178 @@
+import asyncio
+from bisect import bisect_left
+import logging
+import threading
+import time
+
+# Local endpoint serving the metrics in the Prometheus text format; port 0 disables it
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9464
+
+# Upper bounds in seconds, from a cached reply to a slow Telegram send
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """ Monotonic count per label values; safe to bump from the I/O thread """
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}  # label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def items(self):
+        """ (label values, count) pairs, sorted """
+        with self._lock:
+            return sorted(self._values.items())
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in self.items():
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """ Observations per label values, counted into fixed buckets.
+
+    observe() is a bisect and three additions, cheap enough for every command.
+    Quantiles are estimated as the upper bound of the bucket they fall in.
+    """
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts (last one is +Inf), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def since(self, start, *label_values):
+        """ Observe the seconds elapsed since a time.perf_counter() reading """
+        self.observe(time.perf_counter() - start, *label_values)
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return series[2] if series else 0
+
+    def quantile(self, q, *label_values):
+        series = self._series.get(label_values)
+        if not series or not series[2]:
+            return None
+        rank = q * series[2]
+        seen = 0
+        for bound, count in zip(self.buckets, series[0]):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def mean(self, *label_values):
+        series = self._series.get(label_values)
+        return series[1] / series[2] if series and series[2] else None
+
+    def label_values(self):
+        with self._lock:
+            return sorted(self._series)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((label_values, [list(s[0]), s[1], s[2]]) for label_values, s in self._series.items())
+        for label_values, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = format_labels(self.labels, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.started = time.time()
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """ Every metric in the Prometheus text exposition format """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+COMMANDS = REGISTRY.counter("bot_commands_total", "Commands handled, by outcome", ("command", "outcome"))
+COMMAND_SECONDS = REGISTRY.histogram("bot_command_seconds", "Time spent in command handlers", ("command",))
+STORAGE_SECONDS = REGISTRY.histogram("bot_storage_seconds", "Time spent in storage operations", ("operation",))
+STORAGE_BYTES = REGISTRY.counter("bot_storage_bytes_total", "Bytes read and written by storage", ("operation",))
+SEND_SECONDS = REGISTRY.histogram("bot_send_seconds", "Time to deliver one outgoing message")
+SENDS = REGISTRY.counter("bot_sends_total", "Outgoing messages, by outcome", ("outcome",))
+FLOOD_WAITS = REGISTRY.counter("bot_flood_waits_total", "FloodWaitErrors returned by Telegram")
+FLOOD_WAIT_SECONDS = REGISTRY.counter("bot_flood_wait_seconds_total", "Seconds spent paused by flood waits")
+VALIDATED_CODES = REGISTRY.counter("bot_validated_codes_total", "Uploaded codes checked, by outcome", ("outcome",))
+VALIDATION_SECONDS = REGISTRY.histogram("bot_validation_seconds", "Time per validator call")
+
+
+async def start_server(host=METRICS_HOST, port=METRICS_PORT, registry=REGISTRY):
+    """ Serve GET /metrics over plain HTTP on host:port """
+    async def handle(reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # Skip headers
+            if request.split()[1:2] == [b"/metrics"]:
+                status, body = "200 OK", registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except Exception as e:
+            logging.error(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
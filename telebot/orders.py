@@ -0,0 +1,117 @@
+""" Jorder: several amounts in one order, given as lines or as a UC total to make up.
+
+solve() picks the codes for a total with a bounded knapsack over the
+denominations in stock. Each amount's available codes are split into
+bundles of 1, 2, 4, ... codes, so any count is a sum of distinct bundles,
+and every bundle is one pass over the table of reachable totals. A pass is
+whole-row map() calls rather than a Python loop per total.
+"""
+from itertools import repeat
+from math import gcd
+from operator import add, lt
+import re
+
+# Largest total Jorder solves; the table has one entry per reachable total
+MAX_ORDER_UC = 100_000
+
+# What solve() minimises
+CHEAPEST = "cheap"
+FEWEST = "fewest"
+OBJECTIVES = (CHEAPEST, FEWEST)
+
+# A line of an order, "325x2" (also "325*2" or "325×2")
+ORDER_LINE = re.compile(r'(\d+)[x×*](\d+)', re.IGNORECASE)
+
+# Bit layout of a table entry: (primary, secondary) packed into one int so min() compares both
+COUNT_BITS = 24  # Codes in one order stay below 2**24
+CENTS_BITS = 48
+
+UNREACHABLE = 1 << 100
+
+
+def parse_order(args):
+    """ (target, lines, objective) from Jorder's words; one of target and lines is None.
+
+    Raises ValueError with a message for the user.
+    """
+    if not args:
+        raise ValueError("Give a UC total or amount x count lines.")
+    if ORDER_LINE.fullmatch(args[0]):
+        lines = {}
+        for word in args:
+            match = ORDER_LINE.fullmatch(word)
+            if match is None:
+                raise ValueError(f"Invalid order line: {word}")
+            amount, count = int(match.group(1)), int(match.group(2))
+            if count < 1:
+                raise ValueError(f"Invalid order line: {word}")
+            lines[amount] = lines.get(amount, 0) + count
+        return None, sorted(lines.items()), None
+
+    try:
+        target = int(args[0].lower().removesuffix("uc"))
+    except ValueError:
+        raise ValueError(f"Invalid UC total: {args[0]}") from None
+    if not 0 < target <= MAX_ORDER_UC:
+        raise ValueError(f"The UC total must be between 1 and {MAX_ORDER_UC}.")
+    objective = args[1].lower() if len(args) > 1 else CHEAPEST
+    if objective not in OBJECTIVES or len(args) > 2:
+        raise ValueError(f"Choose {' or '.join(OBJECTIVES)}.")
+    return target, None, objective
+
+
+def _bundles(count):
+    """ 1, 2, 4, ... and a remainder, adding up to count """
+    size = 1
+    while count > 0:
+        bundle = min(size, count)
+        yield bundle
+        count -= bundle
+        size *= 2
+
+
+def _weight(count, cents, objective):
+    """ Table entry of count codes costing cents; lower is better """
+    if objective == FEWEST:
+        return count << CENTS_BITS | cents
+    return cents << COUNT_BITS | count
+
+
+def solve(target, stock, objective=CHEAPEST):
+    """ [(amount, count)] adding up to exactly target UC, or None if stock can't make it.
+
+    stock is (amount, price, available) like stock_summary(). The cheapest
+    combination wins, fewest codes breaking ties; FEWEST swaps the two.
+    """
+    stock = [(amount, price, available) for amount, price, available in stock if amount > 0 and available > 0]
+    # Totals are counted in steps of the denominations' gcd
+    step = 0
+    for amount, _, _ in stock:
+        step = gcd(step, amount)
+    if not step or target % step:
+        return None
+    size = target // step
+
+    best = [0] + [UNREACHABLE] * size  # Best entry for each reachable total
+    passes = []  # (amount, bundle, width, took) with took[t] set if the bundle was added to reach t + width
+    for amount, price, available in stock:
+        unit = amount // step
+        if unit > size:
+            continue
+        cents = round((price or 0) * 100)
+        for bundle in _bundles(min(available, size // unit)):
+            width = unit * bundle
+            kept = best[width:]
+            added = list(map(add, best[:-width], repeat(_weight(bundle, cents * bundle, objective))))
+            passes.append((amount, bundle, width, bytes(map(lt, added, kept))))
+            best[width:] = map(min, kept, added)
+    if best[size] >= UNREACHABLE:
+        return None
+
+    counts = {}
+    total = size
+    for amount, bundle, width, took in reversed(passes):
+        if total >= width and took[total - width]:
+            counts[amount] = counts.get(amount, 0) + bundle
+            total -= width
+    return sorted(counts.items())
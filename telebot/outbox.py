@@ -0,0 +1,201 @@
+import asyncio
+from collections import defaultdict
+import logging
+import time
+
+from telethon.errors import FloodWaitError
+
+from .metrics import FLOOD_WAIT_SECONDS, FLOOD_WAITS, SEND_SECONDS, SENDS
+
+# Telegram rejects longer messages
+MAX_MESSAGE_LENGTH = 4096
+
+# Seconds between two messages to the same chat, and messages per second overall
+PER_CHAT_INTERVAL = 1.0
+GLOBAL_RATE = 25
+
+# Replies to one chat are merged with this separator
+SEPARATOR = "\n\n"
+
+# What a reply's future resolves to when a send failed after some of its chunks went out
+PARTLY_SENT = "partly sent"
+
+
+def split_message(text, limit=MAX_MESSAGE_LENGTH):
+    """ Split text into chunks of at most limit characters, on line breaks where possible """
+    chunks = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+    if current or not chunks:
+        chunks.append(current)
+    return chunks
+
+
+def merge_replies(texts, limit=MAX_MESSAGE_LENGTH):
+    """ Pack queued replies into as few messages as fit, never splitting one that fits.
+
+    Returns (messages, spans) where spans[i] is the (first, last) message
+    index carrying texts[i].
+    """
+    messages = []
+    spans = []
+    current = ""
+    for text in texts:
+        if len(text) > limit:
+            if current:
+                messages.append(current)
+                current = ""
+            chunks = split_message(text, limit)
+            spans.append((len(messages), len(messages) + len(chunks) - 1))
+            messages.extend(chunks)
+            continue
+        candidate = f"{current}{SEPARATOR}{text}" if current else text
+        if len(candidate) > limit:
+            messages.append(current)
+            current = text
+        else:
+            current = candidate
+        spans.append((len(messages), len(messages)))
+    if current:
+        messages.append(current)
+    return messages, spans
+
+
+class ChatTarget:
+    """ Stands in for an event when messaging a chat unprompted, e.g. an alert """
+
+    __slots__ = ('client', 'chat_id')
+
+    def __init__(self, client, chat_id):
+        self.client = client
+        self.chat_id = chat_id
+
+    async def respond(self, message):
+        await self.client.send_message(self.chat_id, message)
+
+
+class Outbox:
+    """ Outgoing replies, sent by one background task.
+
+    reply() only queues the text and returns a future that resolves to True
+    once it was delivered, False if none of it was sent and PARTLY_SENT if
+    sending failed midway, so handlers never wait on Telegram. Replies queued for a chat while it is rate limited are merged
+    into one message and chunked to Telegram's length limit. A FloodWaitError
+    pauses all sending for the requested time and the message is retried.
+    withdraw() takes back a reply that hasn't started sending.
+    """
+
+    def __init__(self, per_chat_interval=PER_CHAT_INTERVAL, global_rate=GLOBAL_RATE):
+        self.per_chat_interval = per_chat_interval
+        self.global_interval = 1 / global_rate
+        self._pending = defaultdict(list)  # chat id -> [(text, future)]
+        self._events = {}  # chat id -> latest event, used to send the reply
+        self._next_send = {}  # chat id -> loop time the chat may be sent to again
+        self._ready = None  # Queue of chat ids with pending replies
+        self._worker = None
+        self._last_send = 0
+
+    def reply(self, event, text):
+        """ Queue text as a reply in event's chat """
+        loop = asyncio.get_running_loop()
+        if self._worker is None:
+            self._ready = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+        future = loop.create_future()
+        chat_id = event.chat_id
+        self._events[chat_id] = event
+        if not self._pending[chat_id]:
+            self._ready.put_nowait(chat_id)
+        self._pending[chat_id].append((text, future))
+        return future
+
+    def send(self, client, chat_id, text):
+        """ Queue text as a new message to chat_id """
+        return self.reply(ChatTarget(client, chat_id), text)
+
+    async def respond(self, event, text):
+        """ Awaitable form of reply() for callers that take an event.respond-style function """
+        self.reply(event, text)
+
+    def withdraw(self, future):
+        """ Cancel the queued reply behind future, returning False if it is being or was sent """
+        if future.done() or not any(queued is future for replies in self._pending.values() for _, queued in replies):
+            return False
+        future.cancel()
+        return True
+
+    async def drain(self):
+        """ Wait until everything queued so far was sent """
+        futures = [future for replies in self._pending.values() for _, future in replies]
+        if futures:
+            await asyncio.wait(futures)
+
+    def close(self):
+        """ Stop the background sender; anything still queued is dropped """
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            chat_id = await self._ready.get()
+            wait = self._next_send.get(chat_id, 0) - loop.time()
+            if wait > 0:
+                # Let other chats go first; replies arriving meanwhile get merged
+                loop.call_later(wait, self._ready.put_nowait, chat_id)
+                continue
+
+            event = self._events.pop(chat_id)
+            replies = [(text, future) for text, future in self._pending.pop(chat_id) if not future.cancelled()]
+            if not replies:
+                continue
+            messages, spans = merge_replies([text for text, _ in replies])
+            sent = 0
+            try:
+                for message in messages:
+                    await self._send(event, message)
+                    sent += 1
+            except Exception as e:
+                logging.error(f"Failed to send reply to chat {chat_id}: {e}")
+            self._next_send[chat_id] = loop.time() + self.per_chat_interval
+            # Each reply by its own chunks: one that went out before the failure was delivered
+            for (_, future), (first, last) in zip(replies, spans):
+                if not future.done():
+                    future.set_result(True if last < sent else PARTLY_SENT if first < sent else False)
+
+    async def _send(self, event, message):
+        loop = asyncio.get_running_loop()
+        while True:
+            wait = self._last_send + self.global_interval - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._last_send = loop.time()
+            start = time.perf_counter()
+            try:
+                await event.respond(message)
+            except FloodWaitError as e:
+                FLOOD_WAITS.inc()
+                FLOOD_WAIT_SECONDS.inc(amount=e.seconds)
+                logging.warning(f"Flood wait of {e.seconds}s from Telegram. Pausing sends.")
+                await asyncio.sleep(e.seconds)
+            except Exception:
+                SENDS.inc("error")
+                raise
+            else:
+                SEND_SECONDS.since(start)
+                SENDS.inc("ok")
+                return
@@ -0,0 +1,61 @@
+""" Versioned prices: Jprice adds a version instead of overwriting the price.
+
+Each version takes effect at its effective_at time, so a price can be set
+ahead of time. Dispensed codes are stamped with the version in effect when
+they were taken and the price it had, so codes already sold keep their
+price and a dealer's due always matches their used codes.
+"""
+from bisect import bisect_right, insort
+import math
+import time
+
+# Effective time of versions carried over from before price history
+ALWAYS = 0
+
+
+class PriceBook:
+    """ Every price version of every amount; versions are unique across amounts """
+
+    def __init__(self):
+        self.versions = {}  # amount -> [(effective_at, version, price)] in effective order
+        self._effective = []  # effective_at of every version, sorted
+
+    def __contains__(self, amount):
+        return amount in self.versions
+
+    def add(self, version, amount, price, effective_at=ALWAYS):
+        insort(self.versions.setdefault(amount, []), (effective_at, version, price))
+        insort(self._effective, effective_at)
+
+    def current(self, amount, at=None):
+        """ (version, price) in effect for amount at a time (default now), or (None, None) """
+        versions = self.versions.get(amount)
+        if not versions:
+            return None, None
+        # The latest version effective by then; of versions effective at once, the last one set
+        index = bisect_right(versions, (time.time() if at is None else at, math.inf))
+        if not index:
+            return None, None
+        _, version, price = versions[index - 1]
+        return version, price
+
+    def changes_by(self, at):
+        """ How many versions took effect by at; moves when a version set ahead of time starts """
+        return bisect_right(self._effective, at)
+
+    def history(self, amount=None):
+        """ (amount, version, price, effective_at) sorted by amount and effective time """
+        return [(version_amount, version, price, effective_at)
+                for version_amount, versions in sorted(self.versions.items())
+                if amount is None or version_amount == amount
+                for effective_at, version, price in versions]
+
+    def to_json(self):
+        return [[version, amount, price, effective_at] for amount, version, price, effective_at in self.history()]
+
+    @classmethod
+    def from_json(cls, rows):
+        book = cls()
+        for version, amount, price, effective_at in rows:
+            book.add(version, amount, price, effective_at)
+        return book
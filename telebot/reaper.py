@@ -0,0 +1,71 @@
+import asyncio
+import heapq
+import time
+
+
+class Reaper:
+    """ Calls expire(key) once a key's deadline (a time.time() value) has passed.
+
+    Deadlines sit in a heap and only the earliest one has a timer on the event
+    loop, so open keys cost nothing until they fall due: there is no periodic
+    sweep. discard() and re-adding a key leave the old heap entry behind; it is
+    skipped when it reaches the top.
+
+    Keys added before the event loop runs are armed by the next add() on it.
+    """
+
+    def __init__(self, expire):
+        self.expire = expire
+        self._heap = []  # (deadline, key), including discarded entries
+        self._deadlines = {}  # key -> current deadline
+        self._timer = None
+        self._timer_at = None
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def add(self, key, deadline):
+        """ Expire key at deadline, replacing any earlier deadline it had """
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, key))
+        self._schedule()
+
+    def discard(self, key):
+        self._deadlines.pop(key, None)
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _schedule(self):
+        heap = self._heap
+        while heap and self._deadlines.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        if not heap:
+            self.close()
+            return
+        deadline = heap[0][0]
+        if self._timer is not None and self._timer_at <= deadline:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.close()
+        self._timer = loop.call_later(max(deadline - time.time(), 0), self._fire)
+        self._timer_at = deadline
+
+    def _fire(self):
+        self._timer = None
+        now = time.time()
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, key = heapq.heappop(heap)
+            if self._deadlines.get(key) == deadline:
+                del self._deadlines[key]
+                self.expire(key)
+        self._schedule()
@@ -0,0 +1,318 @@
+import asyncio
+from collections import defaultdict
+from contextlib import AsyncExitStack, asynccontextmanager
+import logging
+import time
+
+from .inventory import RESERVATION_TTL
+from .orders import CHEAPEST, solve
+from .outbox import PARTLY_SENT
+from .reaper import Reaper
+from .validation import ValidationPool
+
+# Times Jorder solves again when its codes were taken before it could reserve them
+ORDER_ATTEMPTS = 3
+
+# Seconds between sweeps for reservations another process left past their expiry, e.g. by dying
+SWEEP_INTERVAL = 30
+
+
+class InventoryService:
+    """ Async front for an inventory, used by the command handlers.
+
+    Each amount has its own lock, so every code is dispensed exactly once even
+    when the storage call awaits, while requests for different amounts still
+    run side by side. Calls on a blocking backend run on the I/O executor so
+    the event loop keeps serving other chats.
+
+    Listeners added with subscribe() are called as listener(kind, amount, count)
+    after every dispense ("dispense") and upload ("restock").
+
+    Jbaki goes through reserve() and deliver(): the codes are held out of
+    stock while the reply is sent, charged when it is delivered and released
+    when it fails. A reservation whose reply hasn't gone out within ttl
+    seconds is withdrawn and released by the reaper; one still being sent
+    then gets another ttl, since its codes may already be on screen. A reply
+    that was only partly sent is charged, never released.
+
+    Processes sharing a database each sweep every SWEEP_INTERVAL seconds for
+    reservations that stayed open a ttl past their expiry, which only happens
+    when the process holding them is gone, and release them.
+
+    Jorder reserves several amounts at once, holding their locks in amount
+    order so two orders never wait on each other.
+
+    With a validator (see validation.Validator) uploads go to pending and a
+    ValidationPool moves them into stock or quarantine in the background.
+    """
+
+    def __init__(self, inventory, executor, ttl=RESERVATION_TTL, validator=None):
+        self.inventory = inventory
+        self.executor = executor
+        self.ttl = ttl
+        self.validation = ValidationPool(validator, self._checked) if validator is not None else None
+        self._locks = defaultdict(asyncio.Lock)  # amount -> lock
+        self._rendered = {}  # name -> (inventory version, text)
+        self._listeners = []
+        self._reaper = Reaper(self._expire)
+        self._held = {}  # reservation -> amounts
+        self._deliveries = {}  # reservation -> (delivery future, withdraw)
+        self._settling = set()  # Tasks confirming, releasing or extending reservations
+        self._sweeper = None  # Timer of the next sweep
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def _notify(self, kind, amount, count):
+        for listener in self._listeners:
+            listener(kind, amount, count)
+
+    async def _run(self, func, *args):
+        if self.inventory.blocking:
+            return await self.executor.run(func, *args)
+        return func(*args)
+
+    @asynccontextmanager
+    async def _locked(self, amounts):
+        """ Hold the locks of several amounts, taken in amount order """
+        async with AsyncExitStack() as stack:
+            for amount in sorted(set(amounts)):
+                await stack.enter_async_context(self._locks[amount])
+            yield
+
+    def _spawn(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._settling.add(task)
+        task.add_done_callback(self._settling.discard)
+
+    async def start(self):
+        """ Pick up work left by earlier runs, once the event loop is running.
+
+        Expired reservations are released and the rest watched; codes still
+        pending go back to the validation pool.
+        """
+        now = time.time()
+        for reservation, amounts, expires_at in await self._run(self.inventory.reservations):
+            if expires_at > now:
+                self._held[reservation] = amounts
+                self._reaper.add(reservation, expires_at)
+            elif await self._run(self.inventory.release, reservation, now):
+                logging.warning(f"Released expired reservation {reservation} of "
+                                f"{', '.join(map(str, amounts))} UC")
+        self._schedule_sweep()
+        if self.validation is not None:
+            for amount, codes in await self._run(self.inventory.pending_codes):
+                logging.info(f"Resuming validation of {len(codes)} codes for {amount} UC")
+                self.validation.submit(amount, codes)
+
+    def _schedule_sweep(self):
+        self._sweeper = asyncio.get_running_loop().call_later(SWEEP_INTERVAL, self._sweep_due)
+
+    def _sweep_due(self):
+        self._spawn(self._sweep())
+        self._schedule_sweep()
+
+    async def _sweep(self):
+        """ Release reservations other processes left open a ttl past their expiry """
+        # Their owner extends a reservation whose reply is still being sent when it expires
+        cutoff = time.time() - self.ttl
+        for reservation, amounts, expires_at in await self._run(self.inventory.reservations):
+            if reservation in self._held or expires_at > cutoff:
+                continue
+            async with self._locked(amounts):
+                released = await self._run(self.inventory.release, reservation, cutoff)
+            if released:
+                logging.warning(f"Released reservation {reservation} of {', '.join(map(str, amounts))} UC, "
+                                f"abandoned by another process")
+
+    # ✅ Queries
+    async def render(self, name, query, render, *args):
+        """ render(query(*args)) for a read-only command, cached until the inventory changes """
+        version = await self._run(self.inventory.version)
+        cached = self._rendered.get(name)
+        if cached and cached[0] == version:
+            return cached[1]
+        text = render(await self._run(query, *args))
+        self._rendered[name] = (version, text)
+        return text
+
+    async def stock_summary(self):
+        return await self._run(self.inventory.stock_summary)
+
+    async def sales_series(self, since, unit):
+        return await self._run(self.inventory.sales_series, since, unit)
+
+    async def sales_totals(self, since):
+        return await self._run(self.inventory.sales_totals, since)
+
+    async def price_history(self, amount=None):
+        return await self._run(self.inventory.price_history, amount)
+
+    async def quarantine_list(self, amount=None):
+        return await self._run(self.inventory.quarantine_list, amount)
+
+    # ✅ Mutations
+    async def reserve(self, amount, count, dealer):
+        """ Hold codes for a reply; pass the reply to deliver() to charge or release them """
+        expires_at = time.time() + self.ttl
+        async with self._locks[amount]:
+            result = await self._run(self.inventory.reserve, amount, count, dealer, expires_at)
+        if result:
+            self._held[result[0]] = (amount,)
+            self._reaper.add(result[0], expires_at)
+        return result
+
+    async def reserve_order(self, lines, dealer):
+        """ Hold codes for several (amount, count) lines at once, like reserve().
+
+        Returns (reservation, [(amount, codes, price_per_code)], previous_due, total_due),
+        or None if any line is short of stock.
+        """
+        expires_at = time.time() + self.ttl
+        amounts = tuple(sorted({amount for amount, _ in lines}))
+        async with self._locked(amounts):
+            result = await self._run(self.inventory.reserve_order, lines, dealer, expires_at)
+        if result:
+            self._held[result[0]] = amounts
+            self._reaper.add(result[0], expires_at)
+        return result
+
+    async def order(self, target, dealer, objective=CHEAPEST):
+        """ Reserve codes adding up to target UC, picked by orders.solve().
+
+        Returns reserve_order()'s result, or None if no combination of the
+        codes in stock makes target. The solver runs on a worker thread; if
+        another dispense takes its codes before they are reserved, it runs
+        again on the new stock.
+        """
+        for _ in range(ORDER_ATTEMPTS):
+            stock = await self.stock_summary()
+            lines = await asyncio.to_thread(solve, target, stock, objective)
+            if lines is None:
+                return None
+            result = await self.reserve_order(lines, dealer)
+            if result:
+                return result
+        return None
+
+    def deliver(self, reservation, delivery, withdraw=None):
+        """ Confirm the reservation once delivery (an Outbox reply future) went out, else release it.
+
+        A reply that went out only in part is confirmed too, since some of its
+        codes are already on the dealer's screen.
+
+        withdraw(delivery) should drop the reply if it hasn't started sending,
+        returning False otherwise; the reaper calls it when the reservation expires.
+        """
+        self._deliveries[reservation] = (delivery, withdraw)
+        delivery.add_done_callback(
+            lambda future: self._settle(reservation, not future.cancelled() and future.result()))
+
+    def _settle(self, reservation, delivered):
+        self._reaper.discard(reservation)
+        self._deliveries.pop(reservation, None)
+        if delivered == PARTLY_SENT:
+            logging.error(f"Reply for reservation {reservation} was only partly delivered; charging its codes "
+                          f"since some of them reached the dealer")
+        if delivered:
+            self._spawn(self.confirm(reservation))
+        else:
+            logging.warning(f"Reply for reservation {reservation} was not delivered; releasing its codes")
+            self._spawn(self.release(reservation))
+
+    def _expire(self, reservation):
+        delivery, withdraw = self._deliveries.get(reservation, (None, None))
+        if delivery is None:
+            # Never handed to a reply, or left open by an earlier run
+            self._spawn(self.release(reservation, time.time()))
+        elif withdraw is None or not withdraw(delivery):
+            self._spawn(self._extend(reservation))
+        # else the withdrawn delivery was cancelled, and its callback releases the codes
+
+    async def _extend(self, reservation):
+        expires_at = time.time() + self.ttl
+        if await self._run(self.inventory.extend, reservation, expires_at):
+            self._reaper.add(reservation, expires_at)
+
+    async def confirm(self, reservation):
+        amounts = self._held.pop(reservation)
+        async with self._locked(amounts):
+            result = await self._run(self.inventory.confirm, reservation)
+        if result:
+            for amount, codes, _ in result[0]:
+                self._notify("dispense", amount, len(codes))
+        else:
+            logging.error(f"Reservation {reservation} was delivered after being released; "
+                          f"its {', '.join(map(str, amounts))} UC codes may be handed out twice")
+        return result
+
+    async def release(self, reservation, expired_before=None):
+        amounts = self._held.pop(reservation)
+        async with self._locked(amounts):
+            # With expired_before, a reservation another process has extended stays with it
+            return await self._run(self.inventory.release, reservation, expired_before)
+
+    async def add_codes(self, amount, codes):
+        """ Upload codes, returning (added, duplicates, checked).
+
+        Without a validator the codes are in stock straight away and checked
+        is None. Otherwise they are pending and checked is a future of
+        (accepted, {code: reason}) once the validation pool is done with them.
+        """
+        validate = self.validation is not None
+        async with self._locks[amount]:
+            added, duplicates = await self._run(self.inventory.add_codes, amount, codes, validate)
+        if not validate:
+            if added:
+                self._notify("restock", amount, len(added))
+            return added, duplicates, None
+        return added, duplicates, self.validation.submit(amount, added)
+
+    async def _checked(self, amount, accepted, rejected):
+        """ Move a validated batch out of pending """
+        async with self._locks[amount]:
+            accepted = await self._run(self.inventory.accept, amount, accepted)
+            if rejected:
+                await self._run(self.inventory.quarantine, amount, rejected)
+        if accepted:
+            self._notify("restock", amount, len(accepted))
+
+    async def recheck(self, amount=None):
+        """ Validate quarantined codes again, returning [(amount, codes, checked future)] """
+        return [(recheck_amount, codes, self.validation.submit(recheck_amount, codes, fresh=True))
+                for recheck_amount, codes in await self._run(self.inventory.recheck, amount)]
+
+    async def set_price(self, amount, price, effective_at=None):
+        """ Add a price version, returning its number.
+
+        Returns None, adding nothing, if effective_at is before the version in
+        effect now took effect: that version would stay current over it.
+        """
+        async with self._locks[amount]:
+            if effective_at is not None:
+                now = time.time()
+                started = [since for _, _, _, since in await self._run(self.inventory.price_history, amount)
+                           if since <= now]
+                if started and effective_at < max(started):
+                    return None
+            return await self._run(self.inventory.set_price, amount, price, effective_at)
+
+    async def clear(self, dealer=None):
+        return await self._run(self.inventory.clear, dealer)
+
+    async def settle(self):
+        """ Wait until every reply that has resolved has its reservation confirmed or released """
+        while self._settling:
+            await asyncio.wait(set(self._settling))
+
+    async def flush(self):
+        await self.settle()
+        return await self._run(self.inventory.flush)
+
+    def close(self):
+        self._reaper.close()
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        if self.validation is not None:
+            self.validation.close()
@@ -0,0 +1,282 @@
+""" Versioned binary snapshots of the stock (codes.bin), used codes (used.bin) and
+the archived codes' duplicate index (archive/code-index.bin).
+
+Layout, all little-endian:
+
+    header     HEADER: magic, format version, kind, seq of the last journal record, group count
+    directory  per group: GROUP (amount, price, rows) and a SECTION (offset, length) for each
+               name in SECTIONS[kind]
+    sections   the arrays of every group, each starting on an 8 byte boundary
+
+Codes are stored the way columns.CodeColumn holds them, so a group's columns
+are one copy out of the memory-mapped file. Opening a snapshot only reads
+the header and directory; stock groups load when first used.
+
+python -m telebot.export prints a snapshot as JSON for inspection.
+"""
+from array import array
+from itertools import repeat
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+
+from .columns import CodeColumn, CodeIndex
+from .metrics import STORAGE_BYTES, STORAGE_SECONDS
+
+MAGIC = b'JSNP'
+VERSION = 2
+
+# Snapshot kinds
+STOCK = 1
+USED = 2
+INDEX = 3  # One group of amount 0 holding a columns.CodeIndex; seq is the last period it covers
+
+HEADER = struct.Struct('<4sHHQI4x')
+GROUP = struct.Struct('<qdBxxxI')  # amount, price, has price, rows
+SECTION = struct.Struct('<QQ')
+
+# Sections of each group, in directory order
+SECTIONS = {
+    STOCK: ('prefixes', 'prefix', 'serial', 'pin', 'raw'),
+    USED: ('prefixes', 'prefix', 'serial', 'pin', 'raw', 'dealer', 'at', 'version', 'price'),
+    INDEX: ('prefixes', 'pin', 'rest', 'raw'),
+}
+
+# Format version that added a section; older files don't have it
+ADDED_IN = {'version': 2, 'price': 2}
+
+# Array typecodes of the sections that are arrays; prefixes and raw are JSON
+TYPECODES = {'prefix': 'H', 'serial': 'I', 'pin': 'Q', 'rest': 'Q', 'dealer': 'q', 'at': 'q', 'version': 'q',
+             'price': 'd'}
+
+# "at" of used codes dispensed before timestamps
+NO_TIME = -2**63
+
+
+def _little_endian(column):
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _column_sections(column):
+    return {"prefixes": json.dumps(column.prefixes).encode(),
+            "prefix": _little_endian(column.prefix), "serial": _little_endian(column.serial),
+            "pin": _little_endian(column.pin),
+            "raw": json.dumps({str(row): code for row, code in column.raw.items()}).encode()}
+
+
+def stock_sections(column):
+    """ Sections of a stock group; column must hold only codes in stock (see CodeColumn.copy) """
+    return len(column), _column_sections(column)
+
+
+def used_sections(codes):
+    """ Sections of a used group from its {"code", "dealer", "at", "version", "price"} dicts """
+    column = CodeColumn()
+    for code in codes:
+        column.append(code['code'])
+    sections = _column_sections(column)
+    # 0 is inventory.UNASSIGNED, the dealer of codes from before accounts
+    sections['dealer'] = _little_endian(array('q', (code.get('dealer', 0) for code in codes)))
+    at = (NO_TIME if code.get('at') is None else code['at'] for code in codes)
+    sections['at'] = _little_endian(array('q', at))
+    # 0 for codes sold before price versions
+    sections['version'] = _little_endian(array('q', (code.get('version') or 0 for code in codes)))
+    sections['price'] = _little_endian(array('d', (code['price'] for code in codes)))
+    return len(codes), sections
+
+
+def index_sections(index):
+    """ Sections of a CodeIndex; merge its new codes in first """
+    return len(index.pin), {"prefixes": json.dumps(index.prefixes()).encode(),
+                            "pin": _little_endian(index.pin), "rest": _little_endian(index.rest),
+                            "raw": json.dumps(sorted(index.raw)).encode()}
+
+
+def save_snapshot(data, file_name):
+    """ Write {"kind", "seq", "groups": [(amount, price, (rows, sections))]} like inventory.save_json """
+    tmp_name = f"{file_name}.tmp"
+    try:
+        start = time.perf_counter()
+        kind, groups = data['kind'], data['groups']
+        names = SECTIONS[kind]
+        offset = HEADER.size + len(groups) * (GROUP.size + len(names) * SECTION.size)
+        directory, blobs = [], []
+        for amount, price, (rows, sections) in groups:
+            directory.append(GROUP.pack(amount, price or 0.0, price is not None, rows))
+            for name in names:
+                blob = sections[name]
+                directory.append(SECTION.pack(offset, len(blob)))
+                padding = -len(blob) % 8
+                blobs.append(blob + bytes(padding))
+                offset += len(blob) + padding
+        raw = b"".join([HEADER.pack(MAGIC, VERSION, kind, data['seq'], len(groups)), *directory, *blobs])
+        STORAGE_SECONDS.since(start, "serialize")
+        start = time.perf_counter()
+        with open(tmp_name, 'wb') as file:
+            file.write(raw)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_name, file_name)
+        STORAGE_SECONDS.since(start, "write")
+        STORAGE_BYTES.inc("write", amount=len(raw))
+        return True
+    except IOError as e:
+        logging.error(f"Error saving {file_name}: {e}")
+        return False
+
+
+class SnapshotGroup:
+    __slots__ = ('amount', 'price', 'rows', 'sections')
+
+    def __init__(self, amount, price, rows, sections):
+        self.amount = amount
+        self.price = price
+        self.rows = rows
+        self.sections = sections  # name -> (offset, length)
+
+
+class Snapshot:
+    """ A snapshot file mapped into memory.
+
+    The header and directory are parsed on open; each group's columns are
+    copied out when asked for. The file is unmapped once every group has
+    been read, or on close(). Raises ValueError if the file isn't a
+    snapshot this version can read.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        start = time.perf_counter()
+        with open(file_name, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError(f"{file_name} is truncated")
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, self.kind, self.seq, count = HEADER.unpack_from(self._map)
+            if magic != MAGIC:
+                raise ValueError(f"{file_name} is not a snapshot")
+            if version > VERSION:
+                raise ValueError(f"{file_name} has snapshot format {version}, newer than {VERSION}")
+            names = SECTIONS.get(self.kind)
+            if names is None:
+                raise ValueError(f"{file_name} has unknown snapshot kind {self.kind}")
+            names = [name for name in names if ADDED_IN.get(name, 1) <= version]
+            self.groups = []
+            offset = HEADER.size
+            for _ in range(count):
+                amount, price, has_price, rows = GROUP.unpack_from(self._map, offset)
+                offset += GROUP.size
+                sections = {}
+                for name in names:
+                    section_offset, length = SECTION.unpack_from(self._map, offset)
+                    offset += SECTION.size
+                    if section_offset + length > size:
+                        raise ValueError(f"{file_name} is truncated")
+                    sections[name] = (section_offset, length)
+                self.groups.append(SnapshotGroup(amount, price if has_price else None, rows, sections))
+        except (ValueError, struct.error) as e:
+            self.close()
+            raise ValueError(str(e)) from e
+        self._unread = len(self.groups)
+        STORAGE_SECONDS.since(start, "read")
+        if not self._unread:
+            self.close()
+
+    def _bytes(self, group, name):
+        offset, length = group.sections[name]
+        return self._map[offset:offset + length]
+
+    def _array(self, group, name):
+        offset, length = group.sections[name]
+        column = array(TYPECODES[name])
+        with memoryview(self._map) as view, view[offset:offset + length] as section:
+            column.frombytes(section)
+        if sys.byteorder == 'big':
+            column.byteswap()
+        if len(column) != group.rows:
+            raise ValueError(f"{self.file_name} has {len(column)} {name} rows for amount {group.amount}, "
+                             f"expected {group.rows}")
+        return column
+
+    def column(self, group):
+        """ The group's codes as a CodeColumn """
+        if self._map is None:
+            raise ValueError(f"{self.file_name} was already closed")
+        start = time.perf_counter()
+        column = CodeColumn.from_arrays(
+            json.loads(self._bytes(group, 'prefixes')), self._array(group, 'prefix'),
+            self._array(group, 'serial'), self._array(group, 'pin'),
+            {int(row): code for row, code in json.loads(self._bytes(group, 'raw')).items()})
+        STORAGE_BYTES.inc("read", amount=sum(length for _, length in group.sections.values()))
+        STORAGE_SECONDS.since(start, "parse")
+        self._read(group)
+        return column
+
+    def used_codes(self, group):
+        """ The group's used codes as {"code", "redeemed", "dealer", "at", "version", "price"} dicts.
+
+        Codes from format 1 files have no version and the group's price.
+        """
+        dealers, times = self._array(group, 'dealer'), self._array(group, 'at')
+        if 'version' in group.sections:
+            versions, prices = self._array(group, 'version'), self._array(group, 'price')
+        else:
+            versions, prices = repeat(0, group.rows), repeat(group.price or 0, group.rows)
+        column = self.column(group)
+        return [{"code": column.code(row), "redeemed": True, "dealer": dealer, "at": None if at == NO_TIME else at,
+                 "version": version or None, "price": price}
+                for row, dealer, at, version, price in zip(range(group.rows), dealers, times, versions, prices)]
+
+    def code_index(self, group):
+        """ The group's codes as a CodeIndex """
+        if self._map is None:
+            raise ValueError(f"{self.file_name} was already closed")
+        index = CodeIndex.from_arrays(json.loads(self._bytes(group, 'prefixes')), self._array(group, 'pin'),
+                                      self._array(group, 'rest'), set(json.loads(self._bytes(group, 'raw'))))
+        STORAGE_BYTES.inc("read", amount=sum(length for _, length in group.sections.values()))
+        self._read(group)
+        return index
+
+    def _read(self, group):
+        self._unread -= 1
+        if self._unread <= 0:
+            self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+def open_snapshot(file_name):
+    """ The Snapshot in file_name, or None if there is none or it can't be read """
+    if not os.path.exists(file_name):
+        return None
+    try:
+        return Snapshot(file_name)
+    except (OSError, ValueError) as e:
+        logging.error(f"Snapshot {file_name} is unreadable ({e}). Resetting.")
+        return None
+
+
+def export_json(snapshot):
+    """ The snapshot in the format of the JSON files it replaced """
+    if snapshot.kind == INDEX:
+        return {"codes": [code for group in snapshot.groups for code in snapshot.code_index(group).codes()],
+                "seq": snapshot.seq}
+    groups = []
+    for group in snapshot.groups:
+        if snapshot.kind == STOCK:
+            codes = [{"code": code, "redeemed": False} for code in snapshot.column(group).codes()]
+        else:
+            codes = snapshot.used_codes(group)
+        groups.append({"amount": group.amount, "codes": codes, "price": group.price})
+    return {"codes": groups, "seq": snapshot.seq}
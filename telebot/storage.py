@@ -0,0 +1,777 @@
+from contextlib import contextmanager
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from .analytics import HOUR, WEEK, WEEK_OFFSET, bucket_start
+from .archive import ARCHIVE_DIR, Archive, make_segment
+from .inventory import RESERVATION_TTL, UNASSIGNED, Inventory
+from .metrics import STORAGE_SECONDS
+
+# Storage backends: "json" (snapshot files + journal) or "sqlite"
+STORAGE_BACKEND = 'json'
+SQLITE_FILE = 'inventory.db'
+
+# SQLite caps the number of bound parameters per statement
+BATCH_SIZE = 500
+
+# Seconds to wait for another connection's write transaction before giving up
+BUSY_TIMEOUT = 30
+
+# codes.redeemed besides 0 (in stock) and 1 (sold)
+RESERVED = 2  # Held by a reservation
+PENDING = 3  # Waiting for validation
+QUARANTINED = 4  # Failed validation, with codes.reason
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS codes (
+    id INTEGER PRIMARY KEY,
+    amount INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    redeemed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS codes_amount_redeemed ON codes (amount, redeemed);
+CREATE INDEX IF NOT EXISTS codes_code ON codes (code);
+CREATE TABLE IF NOT EXISTS used (
+    id INTEGER PRIMARY KEY,
+    amount INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    price REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS used_amount ON used (amount);
+CREATE TABLE IF NOT EXISTS prices (
+    amount INTEGER PRIMARY KEY,
+    price REAL
+);
+CREATE TABLE IF NOT EXISTS dues (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total_due REAL NOT NULL DEFAULT 0
+);
+"""
+
+# Schema upgrades, applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    # 1: per-amount counters kept up to date by every mutation
+    """
+    ALTER TABLE prices ADD COLUMN available INTEGER NOT NULL DEFAULT 0;
+    CREATE TABLE used_groups (
+        amount INTEGER PRIMARY KEY,
+        price REAL NOT NULL DEFAULT 0,
+        count INTEGER NOT NULL DEFAULT 0
+    );
+    UPDATE prices SET available = (SELECT COUNT(*) FROM codes c WHERE c.amount = prices.amount AND c.redeemed = 0);
+    INSERT INTO used_groups (amount, price, count) SELECT amount, MAX(price), COUNT(*) FROM used GROUP BY amount;
+    """,
+    # 2: per-dealer accounts; existing used codes and the due go to the unassigned dealer
+    f"""
+    ALTER TABLE used ADD COLUMN dealer INTEGER NOT NULL DEFAULT {UNASSIGNED};
+    CREATE INDEX used_dealer ON used (dealer, amount);
+    CREATE TABLE accounts (
+        dealer INTEGER PRIMARY KEY,
+        due REAL NOT NULL DEFAULT 0
+    );
+    CREATE TABLE ledger (
+        dealer INTEGER NOT NULL,
+        amount INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dealer, amount)
+    );
+    INSERT INTO accounts (dealer, due) SELECT {UNASSIGNED}, total_due FROM dues WHERE total_due != 0;
+    INSERT INTO ledger (dealer, amount, count) SELECT dealer, amount, COUNT(*) FROM used GROUP BY dealer, amount;
+    """,
+    # 3: settlement periods; cleared codes go to the archive instead of being deleted
+    """
+    ALTER TABLE dues ADD COLUMN period INTEGER NOT NULL DEFAULT 0;
+    """,
+    # 4: dispense times and the hourly sales rollup behind Jsales
+    """
+    ALTER TABLE used ADD COLUMN dispensed_at INTEGER;
+    CREATE TABLE sales (
+        hour INTEGER NOT NULL,
+        amount INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, amount)
+    );
+    """,
+    # 5: codes held for replies not yet delivered
+    """
+    ALTER TABLE codes ADD COLUMN reservation INTEGER;
+    CREATE INDEX codes_reservation ON codes (reservation) WHERE reservation IS NOT NULL;
+    CREATE TABLE reservations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        amount INTEGER NOT NULL,
+        dealer INTEGER NOT NULL,
+        price REAL NOT NULL DEFAULT 0,
+        count INTEGER NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    """,
+    # 6: why a quarantined code failed validation
+    """
+    ALTER TABLE codes ADD COLUMN reason TEXT;
+    """,
+    # 7: Jorder reservations, one row per amount sharing the order_id of the first
+    """
+    ALTER TABLE reservations ADD COLUMN order_id INTEGER;
+    UPDATE reservations SET order_id = id;
+    CREATE INDEX reservations_order ON reservations (order_id);
+    """,
+    # 8: price history; used codes keep the version and price they sold at, and the
+    # counters split by that price. prices.price is left as it was and no longer read.
+    """
+    CREATE TABLE price_versions (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        amount INTEGER NOT NULL,
+        price REAL NOT NULL,
+        effective_at REAL NOT NULL DEFAULT 0
+    );
+    CREATE INDEX price_versions_amount ON price_versions (amount, effective_at);
+    CREATE INDEX price_versions_effective ON price_versions (effective_at);
+    INSERT INTO price_versions (amount, price) SELECT amount, price FROM prices WHERE price IS NOT NULL ORDER BY amount;
+    ALTER TABLE used ADD COLUMN version INTEGER;
+    ALTER TABLE reservations ADD COLUMN version INTEGER;
+    CREATE TABLE used_prices (
+        amount INTEGER NOT NULL,
+        price REAL NOT NULL DEFAULT 0,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (amount, price)
+    );
+    INSERT INTO used_prices (amount, price, count) SELECT amount, price, COUNT(*) FROM used GROUP BY amount, price;
+    DROP TABLE used_groups;
+    ALTER TABLE used_prices RENAME TO used_groups;
+    CREATE TABLE ledger_prices (
+        dealer INTEGER NOT NULL,
+        amount INTEGER NOT NULL,
+        price REAL NOT NULL DEFAULT 0,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dealer, amount, price)
+    );
+    INSERT INTO ledger_prices (dealer, amount, price, count)
+    SELECT dealer, amount, price, COUNT(*) FROM used GROUP BY dealer, amount, price;
+    DROP TABLE ledger;
+    ALTER TABLE ledger_prices RENAME TO ledger;
+    """,
+]
+
+# Recompute the materialized counters from the code tables
+REFRESH_COUNTERS = """
+UPDATE prices SET available = (SELECT COUNT(*) FROM codes c WHERE c.amount = prices.amount AND c.redeemed = 0);
+DELETE FROM used_groups;
+INSERT INTO used_groups (amount, price, count) SELECT amount, price, COUNT(*) FROM used GROUP BY amount, price;
+DELETE FROM ledger;
+INSERT INTO ledger (dealer, amount, price, count)
+SELECT dealer, amount, price, COUNT(*) FROM used GROUP BY dealer, amount, price;
+"""
+
+# The price version in effect for prices.amount at :now
+CURRENT_PRICE = """(
+    SELECT v.price FROM price_versions v WHERE v.amount = prices.amount AND v.effective_at <= :now
+    ORDER BY v.effective_at DESC, v.version DESC LIMIT 1)"""
+
+
+def execute_script(db, script):
+    """ Run a multi-statement script inside the current transaction (executescript would commit) """
+    for statement in script.split(";"):
+        if statement.strip():
+            db.execute(statement)
+
+
+def batched(items, size=BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class SqliteInventory:
+    """ Inventory kept in a SQLite database in WAL mode.
+
+    Same interface as Inventory, but the database is the source of truth:
+    dispensing selects and marks codes in one transaction, and the summaries
+    read per-amount counters (prices.available, used_groups) that every
+    mutation updates in the same transaction. Sold codes stay in the codes
+    table, so it doubles as the global duplicate index. Each dealer's due is
+    in accounts and their used counts per amount and price in ledger.
+
+    Prices are versions in price_versions, each with an effective_at time;
+    a dispense stamps its used rows with the version in effect and its
+    price, and a new version never touches them.
+
+    Jclear closes a settlement period into the same archive the JSON backend
+    uses; the segment is written inside the clearing transaction, and dues.period
+    only moves on if that transaction commits.
+
+    The sales table is the hourly rollup behind Jsales, updated by dispense.
+
+    Reserved codes are marked RESERVED with their row in reservations, which
+    any process can release once it expires; their owner extends the ones
+    whose reply is still being sent. A Jorder reservation has a row per
+    amount, and its rows share the order_id of the first. Codes uploaded for validation are
+    PENDING until accepted into stock or QUARANTINED with a reason.
+
+    Several bot processes can share one database. Every mutation runs under
+    BEGIN IMMEDIATE, SQLite's single write lock, so their dispenses are
+    serialized and each code is marked redeemed by exactly one of them.
+    version() sees other processes' commits, and Jhistory re-reads the
+    archive when another process closed a period.
+    """
+
+    # Every call hits the database, so the service runs them on the I/O thread
+    blocking = True
+
+    def __init__(self, db_file=SQLITE_FILE, archive_dir=ARCHIVE_DIR):
+        self.db_file = db_file
+        self.archive = Archive(archive_dir)
+        self.db = None
+        self._commits = 0  # Transactions committed through this connection
+
+    def load(self):
+        """ Open the database, creating it from the JSON files on first use """
+        self.db = sqlite3.connect(self.db_file, isolation_level=None, check_same_thread=False,
+                                  timeout=BUSY_TIMEOUT)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self._migrate()
+
+        with self._transaction():
+            if self.db.execute("SELECT 1 FROM dues").fetchone() is None:
+                self.db.execute("INSERT INTO dues (id, total_due) VALUES (1, 0)")
+                import_json(self)
+            self._load_archive()
+        return self
+
+    def close(self):
+        self.db.close()
+
+    def _migrate(self):
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            with self._transaction():
+                execute_script(self.db, script)
+                self.db.execute(f"PRAGMA user_version = {number}")
+            logging.info(f"Migrated {self.db_file} to schema version {number}")
+
+    @contextmanager
+    def _transaction(self):
+        start = time.perf_counter()
+        changes = self.db.total_changes
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+        if self.db.total_changes != changes:
+            self._commits += 1  # Only transactions that wrote change version()
+        STORAGE_SECONDS.since(start, "transaction")
+
+    def flush(self):
+        """ Fold the WAL back into the database, e.g. before shutdown """
+        self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def _load_archive(self):
+        """ Re-read the archive, dropping segments of periods that never committed.
+
+        Runs under the write lock, so a segment that another process's Jclear
+        has written but not yet committed is never taken for an orphan.
+        """
+        self.archive.load()
+        self.archive.rollback(self.db.execute("SELECT period FROM dues").fetchone()[0])
+
+    def _sync_archive(self):
+        """ Pick up settlement periods closed by other processes sharing the database """
+        if self.db.execute("SELECT period FROM dues").fetchone()[0] != self.archive.last_period:
+            with self._transaction():
+                self._load_archive()
+
+    # ✅ Queries
+    def version(self):
+        """ Changes whenever the database does, including commits by other connections,
+        or a price set ahead of time takes effect """
+        return (self._commits, self.db.execute("PRAGMA data_version").fetchone()[0],
+                self.db.execute("SELECT COUNT(*) FROM price_versions WHERE effective_at <= ?",
+                                (time.time(),)).fetchone()[0])
+
+    def _current_price(self, amount, now=None):
+        """ (version, price) in effect for amount, or (None, 0) if it has no price """
+        row = self.db.execute("""
+            SELECT version, price FROM price_versions WHERE amount = ? AND effective_at <= ?
+            ORDER BY effective_at DESC, version DESC LIMIT 1
+        """, (amount, time.time() if now is None else now)).fetchone()
+        return row if row else (None, 0)
+
+    def price_of(self, amount):
+        return self._current_price(amount)[1]
+
+    def price_list(self):
+        """ (amount, price) pairs sorted by amount, skipping groups without a price """
+        return self.db.execute(f"""
+            SELECT amount, price FROM (SELECT amount, {CURRENT_PRICE} AS price FROM prices)
+            WHERE price IS NOT NULL ORDER BY amount
+        """, {"now": time.time()}).fetchall()
+
+    def stock_summary(self):
+        """ (amount, price, available count) for every stock group sorted by amount """
+        return self.db.execute(f"SELECT amount, COALESCE({CURRENT_PRICE}, 0), available FROM prices ORDER BY amount",
+                               {"now": time.time()}).fetchall()
+
+    def price_history(self, amount=None):
+        """ (amount, version, price, effective_at) of every price version, for one amount or all """
+        where, params = ("", ()) if amount is None else (" WHERE amount = ?", (amount,))
+        return self.db.execute(f"SELECT amount, version, price, effective_at FROM price_versions{where} "
+                               f"ORDER BY amount, effective_at, version", params).fetchall()
+
+    def used_summary(self, dealer=None):
+        """ (amount, price sold at, used count) sorted by amount, for one dealer or everyone.
+
+        An amount sold at several prices has a line for each.
+        """
+        if dealer is None:
+            return self.db.execute(
+                "SELECT amount, price, count FROM used_groups WHERE count > 0 ORDER BY amount, price").fetchall()
+        return self.db.execute(
+            "SELECT amount, price, count FROM ledger WHERE dealer = ? AND count > 0 ORDER BY amount, price",
+            (dealer,)).fetchall()
+
+    def check_summary(self, dealer=None):
+        """ (used_summary(dealer), due) with the due kept up to date by every dispense """
+        if dealer is None:
+            due = self.db.execute("SELECT total_due FROM dues").fetchone()[0]
+        else:
+            row = self.db.execute("SELECT due FROM accounts WHERE dealer = ?", (dealer,)).fetchone()
+            due = row[0] if row else 0
+        return self.used_summary(dealer), due
+
+    def pending_codes(self):
+        """ (amount, codes) still waiting for validation, sorted by amount """
+        return self._grouped(f"SELECT amount, code FROM codes WHERE redeemed = {PENDING} ORDER BY amount, id")
+
+    def quarantine_list(self, amount=None):
+        """ (amount, [(code, reason)]) of quarantined codes sorted by amount, for one amount or all """
+        where, params = ("", ()) if amount is None else (" AND amount = ?", (amount,))
+        return self._grouped(f"SELECT amount, code, reason FROM codes WHERE redeemed = {QUARANTINED}{where} "
+                             f"ORDER BY amount, id", params)
+
+    def _grouped(self, query, params=()):
+        """ Rows of (amount, *values) as [(amount, [values])], values being one column or a tuple """
+        groups = {}
+        for amount, *values in self.db.execute(query, params):
+            groups.setdefault(amount, []).append(values[0] if len(values) == 1 else tuple(values))
+        return list(groups.items())
+
+    def reservations(self):
+        """ (reservation, amounts, expires_at) of every open reservation """
+        orders = {}
+        for order_id, amount, expires_at in self.db.execute(
+                "SELECT order_id, amount, expires_at FROM reservations ORDER BY order_id, amount"):
+            amounts, _ = orders.get(order_id, ((), None))
+            orders[order_id] = (amounts + (amount,), expires_at)
+        return [(order_id, amounts, expires_at) for order_id, (amounts, expires_at) in orders.items()]
+
+    def account_summary(self):
+        """ (dealer, used count, due) for every dealer with an open balance """
+        return self.db.execute("""
+            SELECT a.dealer, COALESCE(SUM(l.count), 0) AS used, a.due
+            FROM accounts a LEFT JOIN ledger l USING (dealer)
+            GROUP BY a.dealer HAVING a.due != 0 OR used > 0 ORDER BY a.dealer
+        """).fetchall()
+
+    def period_list(self, dealer=None):
+        """ (period, closed_at, codes, due) for every closed settlement period """
+        self._sync_archive()
+        return self.archive.period_list(dealer)
+
+    def period_detail(self, period, dealer=None):
+        """ (closed_at, [(amount, price, count)], {dealer: due}) of a closed period, or None """
+        self._sync_archive()
+        return self.archive.period_detail(period, dealer)
+
+    def sales_series(self, since, unit):
+        """ (bucket start, amount, codes sold, revenue) per unit and amount from since on """
+        offset = WEEK_OFFSET if unit == WEEK else 0
+        return self.db.execute("""
+            SELECT (hour - ?) / ? * ? + ? AS bucket, amount, SUM(count), SUM(revenue) FROM sales
+            WHERE hour >= ? GROUP BY bucket, amount ORDER BY bucket, amount
+        """, (offset, unit, unit, offset, since)).fetchall()
+
+    def sales_totals(self, since):
+        """ {amount: (codes sold, revenue)} from since on """
+        return {amount: (count, revenue) for amount, count, revenue in self.db.execute(
+            "SELECT amount, SUM(count), SUM(revenue) FROM sales WHERE hour >= ? GROUP BY amount", (since,))}
+
+    # ✅ Mutations
+    def dispense(self, amount, count, dealer=UNASSIGNED):
+        """ Take count codes for amount and charge them to dealer's due in one transaction.
+
+        Returns (codes, price_per_code, previous_due, total_due) with the dealer's
+        due, or None if the amount is unknown or out of stock.
+        """
+        if count < 1:
+            raise ValueError(f"Count must be at least 1, got {count}")
+        with self._transaction():
+            if self.db.execute("SELECT 1 FROM prices WHERE amount = ?", (amount,)).fetchone() is None:
+                return None
+            rows = self.db.execute(
+                "SELECT id, code FROM codes WHERE amount = ? AND redeemed = 0 ORDER BY id LIMIT ?",
+                (amount, count)).fetchall()
+            if len(rows) < count:
+                return None
+
+            version, price_per_code = self._current_price(amount)
+            codes = [code for _, code in rows]
+            self.db.executemany("UPDATE codes SET redeemed = 1 WHERE id = ?", [(id_,) for id_, _ in rows])
+            self.db.execute("UPDATE prices SET available = available - ? WHERE amount = ?", (count, amount))
+            previous_due, total_due = self._charge(amount, codes, price_per_code, dealer, version)
+        return codes, price_per_code, previous_due, total_due
+
+    def _charge(self, amount, codes, price_per_code, dealer, version):
+        """ Record dispensed codes as used and add them to dealer's due, returning (previous_due, total_due) """
+        count = len(codes)
+        now = int(time.time())
+        self.db.executemany(
+            "INSERT INTO used (amount, code, price, version, dealer, dispensed_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(amount, code, price_per_code, version, dealer, now) for code in codes])
+        self.db.execute("""
+            INSERT INTO sales (hour, amount, count, revenue) VALUES (?, ?, ?, ?)
+            ON CONFLICT (hour, amount) DO UPDATE
+            SET count = count + excluded.count, revenue = revenue + excluded.revenue
+        """, (bucket_start(now, HOUR), amount, count, price_per_code * count))
+        self.db.execute("""
+            INSERT INTO used_groups (amount, price, count) VALUES (?, ?, ?)
+            ON CONFLICT (amount, price) DO UPDATE SET count = count + excluded.count
+        """, (amount, price_per_code, count))
+        self.db.execute("""
+            INSERT INTO ledger (dealer, amount, price, count) VALUES (?, ?, ?, ?)
+            ON CONFLICT (dealer, amount, price) DO UPDATE SET count = count + excluded.count
+        """, (dealer, amount, price_per_code, count))
+        row = self.db.execute("SELECT due FROM accounts WHERE dealer = ?", (dealer,)).fetchone()
+        previous_due = row[0] if row else 0
+        total_due = previous_due + price_per_code * count
+        self.db.execute("INSERT OR REPLACE INTO accounts (dealer, due) VALUES (?, ?)", (dealer, total_due))
+        self.db.execute("UPDATE dues SET total_due = total_due + ?", (price_per_code * count,))
+        return previous_due, total_due
+
+    def reserve(self, amount, count, dealer=UNASSIGNED, expires_at=None):
+        """ Hold count codes for amount out of stock until confirm() or release().
+
+        Returns (reservation, codes, price_per_code, previous_due, total_due) with the
+        dealer's due as it will be once confirmed, counting their other open
+        reservations, or None if the amount is unknown or out of stock.
+        """
+        result = self.reserve_order([(amount, count)], dealer, expires_at)
+        if result is None:
+            return None
+        reservation, [(_, codes, price_per_code)], previous_due, total_due = result
+        return reservation, codes, price_per_code, previous_due, total_due
+
+    def reserve_order(self, lines, dealer=UNASSIGNED, expires_at=None):
+        """ Hold codes for several (amount, count) lines in one transaction, all or nothing.
+
+        Returns (reservation, [(amount, codes, price_per_code)], previous_due, total_due)
+        like reserve(), or None if any amount is unknown or short of stock.
+        """
+        counts = {}
+        for amount, count in lines:
+            if count < 1:
+                raise ValueError(f"Count must be at least 1, got {count}")
+            counts[amount] = counts.get(amount, 0) + count
+        now = time.time()
+        if expires_at is None:
+            expires_at = now + RESERVATION_TTL
+        with self._transaction():
+            selected = []
+            for amount, count in sorted(counts.items()):
+                if self.db.execute("SELECT 1 FROM prices WHERE amount = ?", (amount,)).fetchone() is None:
+                    return None
+                rows = self.db.execute(
+                    "SELECT id, code FROM codes WHERE amount = ? AND redeemed = 0 ORDER BY id LIMIT ?",
+                    (amount, count)).fetchall()
+                if len(rows) < count:
+                    return None
+                # Charged at the version in effect now, even if the price changes before confirm()
+                version, price_per_code = self._current_price(amount, now)
+                selected.append((amount, price_per_code, version, rows))
+
+            row = self.db.execute("""
+                SELECT COALESCE((SELECT due FROM accounts WHERE dealer = ?), 0)
+                     + COALESCE((SELECT SUM(price * count) FROM reservations WHERE dealer = ?), 0)
+            """, (dealer, dealer)).fetchone()
+            previous_due = row[0]
+            reservation = None
+            for amount, price_per_code, version, rows in selected:
+                line = self.db.execute(
+                    "INSERT INTO reservations (amount, dealer, price, version, count, expires_at, order_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (amount, dealer, price_per_code, version, len(rows), expires_at, reservation)).lastrowid
+                if reservation is None:
+                    reservation = line
+                    self.db.execute("UPDATE reservations SET order_id = id WHERE id = ?", (line,))
+                self.db.executemany(f"UPDATE codes SET redeemed = {RESERVED}, reservation = ? WHERE id = ?",
+                                    [(line, id_) for id_, _ in rows])
+                self.db.execute("UPDATE prices SET available = available - ? WHERE amount = ?", (len(rows), amount))
+        reserved = [(amount, [code for _, code in rows], price_per_code)
+                    for amount, price_per_code, _, rows in selected]
+        total_due = previous_due + sum(price_per_code * len(rows) for _, price_per_code, _, rows in selected)
+        return reservation, reserved, previous_due, total_due
+
+    def confirm(self, reservation):
+        """ Dispense reserved codes and charge the dealer, like dispense().
+
+        Returns ([(amount, codes, price_per_code)], previous_due, total_due), or None
+        if the reservation was already released.
+        """
+        with self._transaction():
+            lines = self.db.execute("SELECT id, amount, dealer, price, version FROM reservations "
+                                    "WHERE order_id = ? ORDER BY amount", (reservation,)).fetchall()
+            if not lines:
+                return None
+            confirmed = []
+            previous_due = None
+            for line, amount, dealer, price_per_code, version in lines:
+                codes = [code for (code,) in self.db.execute(
+                    "SELECT code FROM codes WHERE reservation = ? ORDER BY id", (line,))]
+                self.db.execute("UPDATE codes SET redeemed = 1, reservation = NULL WHERE reservation = ?", (line,))
+                line_due, total_due = self._charge(amount, codes, price_per_code, dealer, version)
+                if previous_due is None:
+                    previous_due = line_due
+                confirmed.append((amount, codes, price_per_code))
+            self.db.execute("DELETE FROM reservations WHERE order_id = ?", (reservation,))
+        return confirmed, previous_due, total_due
+
+    def release(self, reservation, expired_before=None):
+        """ Put reserved codes back in stock, returning False if the reservation is gone.
+
+        With expired_before, only a reservation expiring by then is released.
+        """
+        with self._transaction():
+            lines = self.db.execute("SELECT id, amount, count, expires_at FROM reservations WHERE order_id = ?",
+                                    (reservation,)).fetchall()
+            if not lines or expired_before is not None and lines[0][3] > expired_before:
+                return False
+            for line, amount, count, _ in lines:
+                self.db.execute("UPDATE codes SET redeemed = 0, reservation = NULL WHERE reservation = ?", (line,))
+                self.db.execute("UPDATE prices SET available = available + ? WHERE amount = ?", (count, amount))
+            self.db.execute("DELETE FROM reservations WHERE order_id = ?", (reservation,))
+        return True
+
+    def extend(self, reservation, expires_at):
+        """ Move a reservation's expiry, returning False if it is gone """
+        with self._transaction():
+            return self.db.execute("UPDATE reservations SET expires_at = ? WHERE order_id = ?",
+                                   (expires_at, reservation)).rowcount > 0
+
+    def set_price(self, amount, price, effective_at=None):
+        """ Add a price version for amount, effective from effective_at (default now), returning its number.
+
+        Codes already sold, or reserved, keep the price they were taken at.
+        """
+        with self._transaction():
+            return self.db.execute("INSERT INTO price_versions (amount, price, effective_at) VALUES (?, ?, ?)",
+                                   (amount, price, time.time() if effective_at is None else effective_at)).lastrowid
+
+    def clear(self, dealer=None):
+        """ Close a settlement period for one dealer, or everyone, returning its number.
+
+        Their used codes and dues move into the archive and their due resets.
+        Returns None, closing nothing, if there is nothing to settle.
+        """
+        with self._transaction():
+            where, params = ("", ()) if dealer is None else (" WHERE dealer = ?", (dealer,))
+            rows = self.db.execute(f"SELECT amount, price, code, dealer FROM used{where} ORDER BY amount, price, id",
+                                   params).fetchall()
+            dues = {account_dealer: due for account_dealer, due
+                    in self.db.execute(f"SELECT dealer, due FROM accounts{where}", params) if due}
+            if not rows and not dues:
+                return None
+
+            groups = {}
+            for amount, price, code, code_dealer in rows:
+                group = groups.setdefault((amount, price), {"amount": amount, "price": price, "codes": []})
+                group['codes'].append([code, code_dealer])
+            period = self.db.execute("SELECT period FROM dues").fetchone()[0] + 1
+            segment = make_segment(period, int(time.time()), dealer, list(groups.values()), dues)
+            self.archive.write(segment)
+            self.db.execute("UPDATE dues SET period = ?", (period,))
+            self._settle(dealer)
+        self.archive.add(segment)
+        return period
+
+    def _settle(self, dealer):
+        """ Drop the used codes and dues a clear for dealer archived """
+        if dealer is None:
+            for table in ("used", "used_groups", "ledger", "accounts"):
+                self.db.execute(f"DELETE FROM {table}")
+            self.db.execute("UPDATE dues SET total_due = 0")
+        else:
+            self.db.execute("DELETE FROM used WHERE dealer = ?", (dealer,))
+            self.db.execute("""
+                UPDATE used_groups SET count = count - (
+                    SELECT l.count FROM ledger l
+                    WHERE l.dealer = ? AND l.amount = used_groups.amount AND l.price = used_groups.price)
+                WHERE (amount, price) IN (SELECT amount, price FROM ledger WHERE dealer = ?)
+            """, (dealer, dealer))
+            self.db.execute("DELETE FROM used_groups WHERE count <= 0")
+            self.db.execute("DELETE FROM ledger WHERE dealer = ?", (dealer,))
+            self.db.execute("DELETE FROM accounts WHERE dealer = ?", (dealer,))
+            self.db.execute("UPDATE dues SET total_due = (SELECT COALESCE(SUM(due), 0) FROM accounts)")
+
+    def add_codes(self, amount, codes, validate=False):
+        """ Add codes to an amount group in one transaction, returning (added, duplicates).
+
+        Any code seen before, under any amount and including sold ones, is a duplicate.
+        With validate the codes wait in pending for accept() or quarantine().
+        """
+        codes = [code.strip() for code in codes]
+        if not codes:
+            return [], []
+        with self._transaction():
+            existing = set()
+            for batch in batched(codes):
+                existing.update(code for (code,) in self.db.execute(
+                    f"SELECT code FROM codes WHERE code IN ({','.join('?' * len(batch))})", batch))
+
+            added, duplicates = [], []
+            for code in codes:
+                if code in existing:
+                    duplicates.append(code)
+                else:
+                    existing.add(code)
+                    added.append(code)
+            if not added:
+                return added, duplicates
+            self.db.execute("INSERT OR IGNORE INTO prices (amount, price) VALUES (?, 0)", (amount,))
+            state = PENDING if validate else 0
+            self.db.executemany("INSERT INTO codes (amount, code, redeemed) VALUES (?, ?, ?)",
+                                [(amount, code, state) for code in added])
+            if not validate:
+                self.db.execute("UPDATE prices SET available = available + ? WHERE amount = ?",
+                                (len(added), amount))
+        return added, duplicates
+
+    def _pending_ids(self, amount, codes):
+        """ {code: id} of codes pending under amount, looked up through the code index """
+        ids = {}
+        for batch in batched(codes):
+            ids.update((code, id_) for id_, code, code_amount, state in self.db.execute(
+                f"SELECT id, code, amount, redeemed FROM codes WHERE code IN ({','.join('?' * len(batch))})", batch)
+                if code_amount == amount and state == PENDING)
+        return ids
+
+    def accept(self, amount, codes):
+        """ Move validated codes from pending into stock, returning the ones that were pending """
+        with self._transaction():
+            ids = self._pending_ids(amount, list(codes))
+            self.db.executemany("UPDATE codes SET redeemed = 0 WHERE id = ?", [(id_,) for id_ in ids.values()])
+            self.db.execute("UPDATE prices SET available = available + ? WHERE amount = ?", (len(ids), amount))
+        return [code for code in codes if code in ids]
+
+    def quarantine(self, amount, rejected):
+        """ Move codes that failed validation from pending into quarantine; rejected is {code: reason} """
+        with self._transaction():
+            ids = self._pending_ids(amount, list(rejected))
+            self.db.executemany(f"UPDATE codes SET redeemed = {QUARANTINED}, reason = ? WHERE id = ?",
+                                [(rejected[code], id_) for code, id_ in ids.items()])
+        return len(ids)
+
+    def recheck(self, amount=None):
+        """ Send quarantined codes of amount, or of every amount, back to pending.
+
+        Returns [(amount, codes)] for the validation pool.
+        """
+        where, params = ("", ()) if amount is None else (" AND amount = ?", (amount,))
+        with self._transaction():
+            moved = self._grouped(f"SELECT amount, code FROM codes WHERE redeemed = {QUARANTINED}{where} "
+                                  f"ORDER BY amount, id", params)
+            self.db.execute(f"UPDATE codes SET redeemed = {PENDING}, reason = NULL "
+                            f"WHERE redeemed = {QUARANTINED}{where}", params)
+        return moved
+
+
+@contextmanager
+def json_copy():
+    """ Yield the JSON inventory loaded from a temporary copy of its files.
+
+    Inventory.load() migrates, compacts and seeds what it reads; the copy
+    keeps all of that away from the originals.
+    """
+    source = Inventory()
+    source.lock.acquire()  # Keep a JSON bot from writing the files while they are copied
+    try:
+        with tempfile.TemporaryDirectory(prefix="uc-import-") as directory:
+            def copy(name):
+                return os.path.join(directory, os.path.basename(name))
+
+            names = {"file_name": source.file_name, "removed_file_name": source.removed_file_name,
+                     "json_file_name": source.json_file_name,
+                     "json_removed_file_name": source.json_removed_file_name,
+                     "total_due_file": source.total_due_file, "history_file": source.history_file,
+                     "sales_file": source.sales_file, "validation_file": source.validation_file,
+                     "prices_file": source.prices_file, "journal_file": source.journal.file_name}
+            for name in (*names.values(), source.journal.old_name):
+                if os.path.exists(name):
+                    shutil.copy2(name, copy(name))
+            if os.path.isdir(source.archive.directory):
+                shutil.copytree(source.archive.directory, copy(source.archive.directory))
+            inventory = Inventory(**{key: copy(name) for key, name in names.items()},
+                                  archive_dir=copy(source.archive.directory),
+                                  lock_file=copy(source.lock.file_name)).load()
+            try:
+                yield inventory
+            finally:
+                inventory.close()
+    finally:
+        source.lock.release()
+
+
+def import_json(store, inventory=None):
+    """ One-shot copy of the JSON inventory (snapshots and journal) into a SqliteInventory.
+
+    Runs inside the caller's transaction. Price versions keep their numbers,
+    and used codes the version and price they sold at. Without an inventory
+    the JSON files are read through json_copy(), so they are left as they were.
+    """
+    if inventory is None:
+        with json_copy() as inventory:
+            return import_json(store, inventory)
+    db = store.db
+    db.executemany("INSERT OR REPLACE INTO prices (amount, price) VALUES (?, ?)",
+                   [(amount, inventory.price_of(amount)) for amount in inventory.stock])
+    db.executemany("INSERT INTO price_versions (version, amount, price, effective_at) VALUES (?, ?, ?, ?)",
+                   [(version, amount, price, effective_at)
+                    for amount, version, price, effective_at in inventory.price_history()])
+    db.executemany("INSERT INTO codes (amount, code) VALUES (?, ?)",
+                   [(amount, code) for amount, group in inventory.stock.items() for code in group.codes()])
+    db.executemany("INSERT INTO codes (amount, code, redeemed) VALUES (?, ?, 1)",
+                   [(amount, code['code']) for amount, group in inventory.used.items()
+                    for code in group['codes']])
+    db.executemany("INSERT INTO codes (amount, code, redeemed) VALUES (?, ?, 1)",
+                   [(amount, code) for amount, code in inventory.archive.codes()])
+    db.executemany(f"INSERT INTO codes (amount, code, redeemed) VALUES (?, ?, {PENDING})",
+                   [(amount, code) for amount, codes in inventory.pending_codes() for code in codes])
+    db.executemany(f"INSERT INTO codes (amount, code, redeemed, reason) VALUES (?, ?, {QUARANTINED}, ?)",
+                   [(amount, code, reason) for amount, codes in inventory.quarantine_list() for code, reason in codes])
+    db.executemany("INSERT INTO used (amount, code, price, version, dealer, dispensed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                   [(amount, code['code'], code['price'], code.get('version'), code.get('dealer', UNASSIGNED),
+                     code.get('at')) for amount, group in inventory.used.items() for code in group['codes']])
+    db.executemany("INSERT INTO sales (hour, amount, count, revenue) VALUES (?, ?, ?, ?)",
+                   inventory.sales.to_json())
+    db.executemany("INSERT INTO accounts (dealer, due) VALUES (?, ?)",
+                   [(dealer, account.due) for dealer, account in inventory.accounts.items()])
+    db.execute("UPDATE dues SET total_due = ?, period = ?", (inventory.total_due, inventory.period))
+    execute_script(db, REFRESH_COUNTERS)
+    logging.info(f"Imported {sum(len(g) for g in inventory.stock.values())} stock codes and "
+                 f"{sum(len(g['codes']) for g in inventory.used.values())} used codes into {store.db_file}")
+
+
+def open_inventory(backend=None, executor=None, sqlite_file=None):
+    """ Create the inventory for the configured backend; call load() on the result """
+    backend = (backend or os.getenv("STORAGE_BACKEND") or STORAGE_BACKEND).lower()
+    if backend == "json":
+        return Inventory(executor=executor)
+    if backend == "sqlite":
+        return SqliteInventory(sqlite_file or os.getenv("SQLITE_FILE") or SQLITE_FILE)
+    raise ValueError(f"Unknown storage backend: {backend}. Use 'json' or 'sqlite'.")
@@ -0,0 +1,147 @@
+""" Several processes sharing one SQLite inventory, and importing the JSON one into it.
+
+    python -m unittest discover -s . -p "*test.py"
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+
+from . import service
+from .inventory_test import AMOUNT, PRICE, make_codes
+from .inventory import save_json
+from .io_executor import IOExecutor
+from .storage import SqliteInventory, open_inventory
+
+PROCESSES = 2
+PER_PROCESS = 150
+
+
+def dispense_in_process(directory, dealer, count, start_at):
+    """ Take count codes one Jbaki at a time from its own connection, returning them """
+    os.chdir(directory)
+    inventory = SqliteInventory().load()
+    time.sleep(max(start_at - time.time(), 0))  # Start together with the other process
+    codes = []
+    for _ in range(count):
+        result = inventory.dispense(AMOUNT, 1, dealer)
+        if result:
+            codes.extend(result[0])
+    inventory.close()
+    return codes
+
+
+def reserve_and_die(directory, dealer, count, expires_at):
+    """ Reserve codes, then exit without confirming or releasing them """
+    os.chdir(directory)
+    inventory = SqliteInventory().load()
+    _, codes, *_ = inventory.reserve(AMOUNT, count, dealer, expires_at)
+    inventory.close()
+    return codes
+
+
+class SharedSqliteTestCase(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory(prefix="uc-test-")
+        os.chdir(self.directory.name)
+        self.inventory = SqliteInventory().load()
+        self.inventory.set_price(AMOUNT, PRICE)
+        self.inventory.add_codes(AMOUNT, make_codes(PROCESSES * PER_PROCESS + 50))
+        self.pool = ProcessPoolExecutor(PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+
+    def tearDown(self):
+        self.pool.shutdown()
+        self.inventory.close()
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def available(self):
+        return dict((amount, count) for amount, _, count in self.inventory.stock_summary()).get(AMOUNT, 0)
+
+    def test_processes_hand_out_each_code_once(self):
+        start_at = time.time() + 1  # Time for both processes to start and load
+        results = list(self.pool.map(dispense_in_process, [self.directory.name] * PROCESSES,
+                                     range(1, PROCESSES + 1), [PER_PROCESS] * PROCESSES,
+                                     [start_at] * PROCESSES))
+        codes = [code for result in results for code in result]
+        self.assertEqual(len(codes), PROCESSES * PER_PROCESS)
+        self.assertEqual(len(set(codes)), len(codes))
+        self.assertEqual(self.available(), 50)
+        dues = {dealer: due for dealer, _, due in self.inventory.account_summary()}
+        self.assertEqual(dues, {dealer: PER_PROCESS * PRICE for dealer in range(1, PROCESSES + 1)})
+
+    async def test_sweep_releases_reservations_of_a_dead_process(self):
+        executor = IOExecutor()
+        inventory_service = service.InventoryService(self.inventory, executor, ttl=0.05)
+        sweep_interval, service.SWEEP_INTERVAL = service.SWEEP_INTERVAL, 0.05
+        try:
+            await inventory_service.start()
+            # Reserved after start(), so only the sweep can find it
+            codes = await asyncio.wrap_future(
+                self.pool.submit(reserve_and_die, self.directory.name, 9, 4, time.time()))
+            self.assertEqual(len(codes), 4)
+            self.assertEqual(self.available(), PROCESSES * PER_PROCESS + 46)
+            await asyncio.sleep(0.3)
+            await inventory_service.settle()
+        finally:
+            service.SWEEP_INTERVAL = sweep_interval
+            inventory_service.close()
+            executor.shutdown()
+        self.assertEqual(self.available(), PROCESSES * PER_PROCESS + 50)
+        self.assertEqual(self.inventory.reservations(), [])
+
+
+class ImportJsonTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory(prefix="uc-test-")
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def files(self):
+        """ {path: contents} of the JSON inventory's files, skipping the lock and the database """
+        files = {}
+        for root, _, names in os.walk("."):
+            for name in names:
+                if not name.startswith("inventory."):
+                    with open(os.path.join(root, name), 'rb') as file:
+                        files[os.path.join(root, name)] = file.read()
+        return files
+
+    def import_json(self):
+        before = self.files()
+        inventory = SqliteInventory().load()
+        stock, used = inventory.stock_summary(), inventory.used_summary()
+        inventory.close()
+        self.assertEqual(self.files(), before)
+        return stock, used
+
+    def test_import_leaves_json_files_from_before_snapshots_alone(self):
+        save_json({"codes": [{"amount": AMOUNT, "price": PRICE, "codes": [
+            {"code": code, "redeemed": False} for code in make_codes(5)]}]}, 'codes.json')
+        save_json({"codes": [{"amount": AMOUNT, "price": PRICE, "codes": [
+            {"code": code, "redeemed": True} for code in make_codes(2, start=100)]}]}, 'used.json')
+        save_json({"total_due": 2 * PRICE}, 'total_due.json')
+        self.assertEqual(self.import_json(), ([(AMOUNT, PRICE, 5)], [(AMOUNT, PRICE, 2)]))
+
+    def test_import_leaves_snapshots_and_journal_alone(self):
+        inventory = open_inventory("json").load()
+        inventory.set_price(AMOUNT, PRICE)
+        inventory.add_codes(AMOUNT, make_codes(5))
+        inventory.flush()
+        inventory.dispense(AMOUNT, 2, 7)
+        inventory.close()  # Without flush(), so the dispense is only in journal.log
+        self.assertEqual(self.import_json(), ([(AMOUNT, PRICE, 3)], [(AMOUNT, PRICE, 2)]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import logging
+import re
+
+# Serial and PIN of a voucher, e.g. "UPBD-N-S-04811675 1679-5939-2679-5224". Pastes and
+# CSV files may split the two halves with a newline, comma or semicolon.
+CODE_PATTERN = re.compile(r'([a-zA-Z]{4}-[a-zA-Z]-S-\d{8})[\s,;]+(\d{4}-\d{4}-\d{4}-\d{4})')
+
+# Attached files accepted by Jup
+UPLOAD_EXTENSIONS = ('.txt', '.csv')
+MAX_UPLOAD_BYTES = 5 * 1024 * 1024
+
+# Duplicates listed in the upload report before it just counts them
+MAX_REPORTED_DUPLICATES = 20
+
+
+def parse_codes(text):
+    """ Extract every code from text in a single pass, normalised to "<serial> <pin>" """
+    return [f"{serial} {pin}" for serial, pin in CODE_PATTERN.findall(text)]
+
+
+def parse_amount(text):
+    """ Parse an upload amount given as "80" or "80uc" """
+    if text.lower().endswith("uc"):
+        text = text[:-2]
+    return int(text)
+
+
+def is_upload_document(document):
+    name = next((attr.file_name for attr in document.attributes if hasattr(attr, 'file_name')), "")
+    mime_type = document.mime_type or ""
+    return name.lower().endswith(UPLOAD_EXTENSIONS) or mime_type in ("text/plain", "text/csv")
+
+
+async def read_document(event):
+    """ Text of a .txt/.csv document attached to the message, or None if there is none.
+
+    Raises ValueError for attachments that are not a text file or are too large.
+    """
+    document = event.message.document
+    if document is None:
+        return None
+    if not is_upload_document(document):
+        raise ValueError("Attach codes as a .txt or .csv file.")
+    if document.size > MAX_UPLOAD_BYTES:
+        raise ValueError(f"File is too large. The limit is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+
+    data = await event.message.download_media(file=bytes)
+    logging.info(f"Downloaded {len(data)} byte upload")
+    return data.decode('utf-8', errors='ignore')
+
+
+def upload_report(amount, added, duplicates, validating=False):
+    """ One summary message for a whole upload """
+    if validating:
+        lines = [f"Validating {len(added)} codes for amount: {amount}"]
+    else:
+        lines = [f"Added {len(added)} codes for amount: {amount}"]
+    if duplicates:
+        lines.append(f"Skipped {len(duplicates)} duplicate codes:")
+        shown = duplicates[:MAX_REPORTED_DUPLICATES]
+        lines.append("```" + "\n".join(shown) + "```")
+        if len(duplicates) > len(shown):
+            lines.append(f"... and {len(duplicates) - len(shown)} more")
+    return "\n".join(lines)
+
+
+def validation_report(amount, accepted, rejected):
+    """ Outcome of validating an upload; rejected is {code: reason} """
+    lines = [f"✅ {len(accepted)} codes for amount {amount} validated and in stock"]
+    if rejected:
+        lines.append(f"⚠ Quarantined {len(rejected)} codes:")
+        shown = list(rejected.items())[:MAX_REPORTED_DUPLICATES]
+        lines.append("```" + "\n".join(f"{code} ({reason})" for code, reason in shown) + "```")
+        if len(rejected) > len(shown):
+            lines.append(f"... and {len(rejected) - len(shown)} more")
+    return "\n".join(lines)
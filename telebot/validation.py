@@ -0,0 +1,196 @@
+""" Checks uploaded codes before they go on sale.
+
+Jup with a validator configured puts codes in a pending state; a
+ValidationPool checks them in batches on a few background workers and the
+service then moves each one into stock or into quarantine.
+"""
+import asyncio
+from collections import OrderedDict
+import logging
+import time
+
+from .columns import parse_code
+from .metrics import VALIDATED_CODES, VALIDATION_SECONDS
+
+# Concurrent validator calls
+VALIDATION_WORKERS = 4
+
+# Codes per validator call, unless the validator sets its own batch_size
+VALIDATION_BATCH = 100
+
+# Validation results remembered, and for how many seconds
+CACHE_SIZE = 100_000
+CACHE_TTL = 3600
+
+# Attempts at a batch whose validator call raises before its codes are quarantined
+VALIDATION_ATTEMPTS = 3
+RETRY_DELAY = 1.0  # Doubled after every failed attempt
+
+
+class Validator:
+    """ Checks codes with whoever issued them.
+
+    validate() gets a batch of codes and returns {code: reason} for the ones
+    that can't be sold; the others are valid. Raising means the batch
+    couldn't be checked, and it is retried.
+    """
+
+    batch_size = VALIDATION_BATCH
+
+    async def validate(self, codes):
+        raise NotImplementedError
+
+
+class StubValidator(Validator):
+    """ Local stand-in for tests and the bench.
+
+    Rejects codes in invalid and ones that aren't in the usual format, each
+    call taking delay seconds like a round trip to a real service.
+    """
+
+    def __init__(self, invalid=(), delay=0.0):
+        self.invalid = set(invalid)
+        self.delay = delay
+        self.calls = 0
+
+    async def validate(self, codes):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        rejected = {}
+        for code in codes:
+            if code in self.invalid:
+                rejected[code] = "redeemed"
+            elif parse_code(code) is None:
+                rejected[code] = "malformed"
+        return rejected
+
+
+class Job:
+    """ One submitted upload; done resolves to (accepted, {code: reason}) once every batch is checked """
+
+    __slots__ = ('amount', 'done', 'fresh', 'accepted', 'rejected', 'batches')
+
+    def __init__(self, amount, done, fresh):
+        self.amount = amount
+        self.done = done
+        self.fresh = fresh  # Skip cached results
+        self.accepted = []
+        self.rejected = {}
+        self.batches = 0
+
+
+class ValidationPool:
+    """ A fixed number of workers checking submitted codes in batches.
+
+    Each submit() is split into batches that share one queue, so a large
+    upload is spread over every worker and at most `workers` validator calls
+    are in flight. Codes checked in the last cache_ttl seconds reuse their
+    result. After each batch on_checked(amount, accepted, {code: reason}) is
+    awaited to move the codes out of pending.
+    """
+
+    def __init__(self, validator, on_checked, workers=VALIDATION_WORKERS, cache_size=CACHE_SIZE,
+                 cache_ttl=CACHE_TTL, attempts=VALIDATION_ATTEMPTS, retry_delay=RETRY_DELAY):
+        self.validator = validator
+        self.on_checked = on_checked
+        self.workers = workers
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self._cache = OrderedDict()  # code -> (checked at, reason or None), oldest first
+        self._queue = None  # Queue of (job, codes)
+        self._workers = []
+
+    def submit(self, amount, codes, fresh=False):
+        """ Queue codes for checking, returning the job's done future; fresh ignores the cache """
+        loop = asyncio.get_running_loop()
+        if not self._workers:
+            self._queue = asyncio.Queue()
+            self._workers = [loop.create_task(self._run()) for _ in range(self.workers)]
+        job = Job(amount, loop.create_future(), fresh)
+        size = self.validator.batch_size
+        for start in range(0, len(codes), size):
+            self._queue.put_nowait((job, codes[start:start + size]))
+            job.batches += 1
+        if not job.batches:
+            job.done.set_result(([], {}))
+        return job.done
+
+    async def drain(self):
+        """ Wait until every batch queued so far was checked """
+        if self._queue is not None:
+            await self._queue.join()
+
+    def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    def _cached(self, code, now):
+        entry = self._cache.get(code)
+        if entry is None or now - entry[0] > self.cache_ttl:
+            return None
+        return entry
+
+    def _remember(self, results, now):
+        for code, reason in results.items():
+            self._cache[code] = (now, reason)
+            self._cache.move_to_end(code)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _check(self, codes, fresh):
+        """ {code: reason or None} for a batch, from the cache or the validator """
+        now = time.time()
+        results = {}
+        unknown = []
+        for code in codes:
+            entry = None if fresh else self._cached(code, now)
+            if entry is None:
+                unknown.append(code)
+            else:
+                results[code] = entry[1]
+        VALIDATED_CODES.inc("cached", amount=len(results))
+        if not unknown:
+            return results
+        for attempt in range(self.attempts):
+            try:
+                start = time.perf_counter()
+                rejected = await self.validator.validate(unknown)
+                VALIDATION_SECONDS.since(start)
+                break
+            except Exception as e:
+                logging.warning(f"Validating {len(unknown)} codes failed (attempt {attempt + 1}): {e}")
+                error = e
+                if attempt + 1 < self.attempts:
+                    await asyncio.sleep(self.retry_delay * 2 ** attempt)
+        else:
+            # Not cached: the next check may get through
+            results.update((code, f"not checked: {error}") for code in unknown)
+            return results
+        checked = {code: rejected.get(code) for code in unknown}
+        self._remember(checked, time.time())
+        results.update(checked)
+        return results
+
+    async def _run(self):
+        while True:
+            job, codes = await self._queue.get()
+            try:
+                results = await self._check(codes, job.fresh)
+                accepted = [code for code in codes if results[code] is None]
+                rejected = {code: results[code] for code in codes if results[code] is not None}
+                VALIDATED_CODES.inc("valid", amount=len(accepted))
+                VALIDATED_CODES.inc("quarantined", amount=len(rejected))
+                await self.on_checked(job.amount, accepted, rejected)
+                job.accepted.extend(accepted)
+                job.rejected.update(rejected)
+            except Exception as e:
+                logging.error(f"Validation of {len(codes)} codes for {job.amount} UC failed: {e}")
+            finally:
+                self._queue.task_done()
+                job.batches -= 1
+                if not job.batches and not job.done.done():
+                    job.done.set_result((job.accepted, job.rejected))